@@ -18,9 +18,19 @@ class Config():
     # Chat Bot parameters
     CHATBOT_SESSION_TIMEOUT = os.getenv('SESSION_TIMEOUT', 60 * 60) # 1 hour
     CHATBOT_MAX_MESSAGES = os.getenv('MAX_MESSAGES', 100) # Max number of messages per session including bot messages
+    # Chat history expires this many seconds after the session timeout
+    CHATBOT_HISTORY_TTL_GRACE = int(os.getenv('HISTORY_TTL_GRACE', 10 * 60))
+    # Expired history is removed and the size of the history index is reported at most this often, in seconds
+    CHATBOT_HISTORY_MAINTENANCE_INTERVAL = int(os.getenv('HISTORY_MAINTENANCE_INTERVAL', 10 * 60))
 	
     # LLM parameters
-    LLM_TYPE = os.getenv('LLM_TYPE', 'openai')
+    LLM_TYPE = os.getenv('LLM_TYPE', 'openai') # openai, local
+
+    # Local LLM parameters, a deterministic embeddings model and a stub chat model for tests and benchmarks.
+    # The chat model waits LOCAL_LLM_LATENCY seconds, then produces LOCAL_LLM_TOKENS_PER_SECOND tokens per second (0 for no delay)
+    LOCAL_LLM_LATENCY = float(os.getenv('LOCAL_LLM_LATENCY', 0))
+    LOCAL_LLM_TOKENS_PER_SECOND = float(os.getenv('LOCAL_LLM_TOKENS_PER_SECOND', 0))
+    LOCAL_LLM_RESPONSE_TOKENS = int(os.getenv('LOCAL_LLM_RESPONSE_TOKENS', 64))
 
     # OpenAI parameters
     OPENAI_API_TYPE = os.getenv('OPENAI_API_TYPE', 'azure')
@@ -33,6 +43,31 @@ class Config():
     OPENAI_MAX_TOKENS = os.getenv('OPENAI_MAX_TOKENS', 1000)
     # for text-embedding-ada-002 model , you will obtain a high-dimensional array (vector) consisting of 1536 floating-point numbers
     OPENAI_EMBEDDING_SIZE = os.getenv('OPENAI_EMBEDDING_SIZE', 1536) 
+    # Texts are embedded in batches of at most this many texts and tokens, with at most
+    # OPENAI_EMBEDDING_MAX_CONCURRENCY batches in flight per process
+    OPENAI_EMBEDDING_BATCH_SIZE = int(os.getenv('OPENAI_EMBEDDING_BATCH_SIZE', 16))
+    OPENAI_EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv('OPENAI_EMBEDDING_BATCH_MAX_TOKENS', 32768))
+    OPENAI_EMBEDDING_MAX_CONCURRENCY = int(os.getenv('OPENAI_EMBEDDING_MAX_CONCURRENCY', 4))
+    # The requests to a deployment go through a rate limiter shared by the process, which keeps them
+    # under the quotas of the deployment (0 for no quota) and retries them when they are throttled.
+    # The Flask worker thread is blocked while its request waits for a slot or for a retry. A request
+    # that would wait longer than OPENAI_MAX_QUEUE_WAIT seconds in all fails with a 429 instead.
+    OPENAI_RATE_LIMIT = os.getenv('OPENAI_RATE_LIMIT', 'true').lower() == 'true'
+    OPENAI_REQUESTS_PER_MINUTE = int(os.getenv('OPENAI_REQUESTS_PER_MINUTE', 0))
+    OPENAI_TOKENS_PER_MINUTE = int(os.getenv('OPENAI_TOKENS_PER_MINUTE', 0))
+    OPENAI_EMBEDDING_REQUESTS_PER_MINUTE = int(os.getenv('OPENAI_EMBEDDING_REQUESTS_PER_MINUTE', 0))
+    OPENAI_EMBEDDING_TOKENS_PER_MINUTE = int(os.getenv('OPENAI_EMBEDDING_TOKENS_PER_MINUTE', 0))
+    OPENAI_MAX_CONCURRENCY = int(os.getenv('OPENAI_MAX_CONCURRENCY', 16)) # Per deployment, lowered while the deployment throttles
+    OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', 6))
+    OPENAI_MAX_QUEUE_WAIT = float(os.getenv('OPENAI_MAX_QUEUE_WAIT', 60))
+
+    # Embeddings are cached per model and text, in memory and in a folder shared by the processes.
+    # The least recently used embeddings are evicted once the vectors take EMBEDDING_CACHE_MAX_SIZE bytes.
+    # The folder must be writable, otherwise only the memory is used.
+    EMBEDDING_CACHE = os.getenv('EMBEDDING_CACHE', 'false').lower() == 'true'
+    EMBEDDING_CACHE_DIR = os.getenv('EMBEDDING_CACHE_DIR', 'data/embeddings')
+    EMBEDDING_CACHE_MAX_SIZE = int(os.getenv('EMBEDDING_CACHE_MAX_SIZE', 1024 * 1024 * 1024))
+    EMBEDDING_CACHE_MEMORY_ITEMS = int(os.getenv('EMBEDDING_CACHE_MEMORY_ITEMS', 4096))
 
     # Vector Store parameters
     VECTOR_STORE_TYPE = os.getenv('VECTOR_STORE_TYPE', 'faiss') # redis, azure, faiss
@@ -40,12 +75,52 @@ class Config():
     # Faiss parameters
     FAISS_LOCAL_FILE_CHATHISTORY = os.getenv('FAISS_LOCAL_FILE_CHATHISTORY', 'data/faiss/chathistory')
     FAISS_LOCAL_FILE_INDEX = os.getenv('FAISS_LOCAL_FILE_INDEXING', 'data/faiss/index')
+    # Keep loaded indexes resident in memory and only reload them when the files on disk change
+    FAISS_RESIDENT_INDEX = os.getenv('FAISS_RESIDENT_INDEX', 'true').lower() == 'true'
+    # Serve indexes read-only and memory-mapped, so that workers share one copy in the page cache
+    FAISS_MMAP_INDEX = os.getenv('FAISS_MMAP_INDEX', 'false').lower() == 'true'
+    # Distance metric of indexes created without create_index, which takes the metric as an argument
+    FAISS_DISTANCE_METRIC = os.getenv('FAISS_DISTANCE_METRIC', 'L2') # L2, IP, COSINE
+    # Append the texts added to an index to a write-ahead log, instead of saving the whole index every time.
+    # The log is compacted into a new snapshot of the index in the background once it reaches FAISS_WAL_MAX_SIZE bytes.
+    FAISS_WAL = os.getenv('FAISS_WAL', 'true').lower() == 'true'
+    FAISS_WAL_MAX_SIZE = int(os.getenv('FAISS_WAL_MAX_SIZE', 256 * 1024 * 1024))
+    # Deleted vectors are only left out of searches. Once more than this share of an index is deleted,
+    # the index is rebuilt without them in the background.
+    FAISS_TOMBSTONE_RATIO = float(os.getenv('FAISS_TOMBSTONE_RATIO', 0.2))
+    FAISS_INDEX_TYPE = os.getenv('FAISS_INDEX_TYPE', 'flat') # flat, ivf, hnsw, ivfpq
+    FAISS_VECTOR_ENCODING = os.getenv('FAISS_VECTOR_ENCODING', 'float32') # float32, fp16, sq8, pq. ivfpq always uses pq
+    # Fetch this many times k candidates from a quantized index and re-rank them with exact distances.
+    # The float16 vectors used for re-ranking are kept in a side file, 0 disables it.
+    FAISS_RERANK_FACTOR = int(os.getenv('FAISS_RERANK_FACTOR', 0))
+    # Indexes other than flat are trained (or built) once a flat index holds this many vectors
+    FAISS_TRAIN_THRESHOLD = int(os.getenv('FAISS_TRAIN_THRESHOLD', 10000))
+    FAISS_IVF_NLIST = int(os.getenv('FAISS_IVF_NLIST', 1024)) # Upper bound, FAISS needs about 39 training vectors per list
+    FAISS_IVF_NPROBE = int(os.getenv('FAISS_IVF_NPROBE', 16))
+    FAISS_HNSW_M = int(os.getenv('FAISS_HNSW_M', 32))
+    FAISS_HNSW_EF_CONSTRUCTION = int(os.getenv('FAISS_HNSW_EF_CONSTRUCTION', 40))
+    FAISS_HNSW_EF_SEARCH = int(os.getenv('FAISS_HNSW_EF_SEARCH', 64))
+    FAISS_PQ_M = int(os.getenv('FAISS_PQ_M', 64)) # Number of sub-quantizers, must divide the embedding size
+    FAISS_PQ_NBITS = int(os.getenv('FAISS_PQ_NBITS', 8))
+    # Filtered searches matching at most this many vectors score them exactly instead of searching the index
+    FAISS_EXACT_FILTER_LIMIT = int(os.getenv('FAISS_EXACT_FILTER_LIMIT', 4096))
 
     # Redis parameters
     REDIS_HOST = os.getenv('REDIS_HOST', 'localhost')
     REDIS_PORT = os.getenv('REDIS_PORT', 6379)
     REDIS_PROTOCOL = os.getenv('REDIS_PROTOCOL', 'redis://')
     REDIS_PASSWORD = os.getenv('REDIS_PASSWORD', None)
+    # Size of the connection pool shared by the vector stores of a process
+    REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', 64))
+    # HNSW parameters of the indexes created, which create_index can override per index
+    REDIS_HNSW_M = int(os.getenv('REDIS_HNSW_M', 16))
+    REDIS_HNSW_EF_CONSTRUCTION = int(os.getenv('REDIS_HNSW_EF_CONSTRUCTION', 200))
+    REDIS_HNSW_EF_RUNTIME = int(os.getenv('REDIS_HNSW_EF_RUNTIME', 10))
+    REDIS_HNSW_INITIAL_CAP = int(os.getenv('REDIS_HNSW_INITIAL_CAP', 1000))
+    # FLOAT16 halves the memory of the vectors, it needs RediSearch 2.10 or later and falls back to FLOAT32 otherwise
+    REDIS_VECTOR_TYPE = os.getenv('REDIS_VECTOR_TYPE', 'FLOAT32') # FLOAT32, FLOAT16
+    # Texts are written in non-transactional pipelines of about this many bytes
+    REDIS_PIPELINE_MAX_BYTES = int(os.getenv('REDIS_PIPELINE_MAX_BYTES', 4 * 1024 * 1024))
 
     # Parser parameters
     SUPPORTED_DOCUMENT_TYPES = set(['pdf', 'excel'])
@@ -71,4 +146,4 @@ class Config():
     # Similarity threshold parameters
     CHAT_HISTORY_SEARCH_TYPE = os.getenv('CHAT_HISTORY_SEARCH_TYPE', 'most_related') # most_related, most_recent
     CHAT_HISTORY_SIMILARITY_THRESHOLD = os.getenv('CHAT_HISTORY_SIMILARITY_THRESHOLD', 0)
-    DOCUMENT_SIMILARITY_THRESHOLD = os.getenv('DOCUMENT_SIMILARITY_THRESHOLD', 0.5)
\ No newline at end of file
+    DOCUMENT_SIMILARITY_THRESHOLD = os.getenv('DOCUMENT_SIMILARITY_THRESHOLD', 0) # Smallest relevance score of the documents used, 0 for no threshold
\ No newline at end of file
@@ -12,6 +12,7 @@ from langchain.docstore.document import Document
 
 from app.config import Config
 from app.utils.conversation.history import HistoryManager
+from app.utils.conversation.session import Session
 from app.utils.llm import LLMHelper
 from app.utils.conversation.customprompt import *
 from app.utils.conversation import Message, Answer, Source
@@ -47,20 +48,62 @@ class LLMChatBot:
 
         session_id = str(uuid.uuid4()).replace('-', '')
 
-        # Add the initial message
+        # Record the session, the initial message is not added to the history
+        session = self.history_manager.start_session(session_id, user_meta['user_id'])
+
         initial_message = Message(
             text="",
             session_id=session_id,
             sequence_num=0,
-            received_timestamp=str(datetime.now()),
-            responded_timestamp=str(datetime.now()),
+            received_timestamp=str(session.start_time),
+            responded_timestamp=str(session.start_time),
             user_id=user_meta['user_id'],
             is_bot=1
         ) 
 
-        self.history_manager.add_message(initial_message)
-
         return initial_message
+
+    def get_session(self, message: Message, now: datetime) -> Session:
+        """Get the record of the session of a message.
+
+        Sessions that are not recorded, because their record expired or they were
+        started by older versions, are recorded as starting with their earliest 
+        message and numbered after their latest one, so that they are not extended.
+        Sessions without any message are recorded as new sessions starting now.
+        
+        Args:
+            message: the message
+            now: the current time
+        """
+
+        session = self.history_manager.get_session(message.session_id)
+        if session is None:
+            messages = self.history_manager.get_all_messages(message.session_id)
+
+            start_time, sequence_num = now, 0
+            if len(messages) > 0:
+                start_time = min(datetime.fromisoformat(str(m.received_timestamp)) for m in messages)
+                sequence_num = messages[-1].sequence_num
+
+            session = self.history_manager.start_session(message.session_id, message.user_id, start_time, sequence_num)
+
+        return session
+
+    def is_session_expired(self, session: Session, now: datetime) -> bool:
+        """Check if a session has too many messages or timed out.
+
+        A session recorded without a start time is expired.
+        
+        Args:
+            session: the session
+            now: the current time
+        """
+
+        if session.start_time is None:
+            return True
+
+        return session.sequence_num >= int(self.config.CHATBOT_MAX_MESSAGES) or \
+            (now - session.start_time).total_seconds() > int(self.config.CHATBOT_SESSION_TIMEOUT)
     
     def detect_PII(self, question: str, session_id: str) -> bool:
         """Detect PII in the question.
@@ -172,11 +215,10 @@ class LLMChatBot:
         # Timestamp for recieving the question
         received_timestamp = datetime.now()
 
-        max_sequence_num, earliest_time = self.history_manager.get_max_sequence_num_and_earliest_time(message.session_id)
+        session = self.get_session(message, received_timestamp)
 
         # Check if the session is expired
-        if max_sequence_num >= self.config.CHATBOT_MAX_MESSAGES or \
-            (received_timestamp - earliest_time).total_seconds() > self.config.CHATBOT_SESSION_TIMEOUT:
+        if self.is_session_expired(session, received_timestamp):
             # Exceed the maximum number of messages
             # Restart the session
             initial_message = self.initialize_session(user_meta={'user_id': message.user_id})
@@ -197,7 +239,7 @@ class LLMChatBot:
             logger.debug(f'Condensed question: {question}')
             
             # get related documents
-            related_documents = self.indexer.similarity_search(question, index_name=index_name)
+            related_documents = self.indexer.similarity_search(question, index_name=index_name, score_threshold=float(self.config.DOCUMENT_SIMILARITY_THRESHOLD) or None)
 
             # concatenate the documents
             documents = self.concatenate_documents(related_documents)
@@ -231,7 +273,7 @@ class LLMChatBot:
 
             # get related documents
             logger.info(f"indices: {index_name}")
-            related_documents = self.indexer.similarity_search(question_with_chat_history, index_name=index_name)
+            related_documents = self.indexer.similarity_search(question_with_chat_history, index_name=index_name, score_threshold=float(self.config.DOCUMENT_SIMILARITY_THRESHOLD) or None)
 
             # concatenate the documents
             documents = self.concatenate_documents(related_documents)
@@ -253,8 +295,10 @@ class LLMChatBot:
         
         # Add the question and answer to the history
 
+        sequence_num = self.history_manager.reserve_sequence_nums(message.session_id, 2)
+
         question_message = message
-        question_message.sequence_num = max_sequence_num + 1
+        question_message.sequence_num = sequence_num
         question_message.received_timestamp = str(received_timestamp)
         question_message.responded_timestamp = str(datetime.now())
         question_message.is_bot = 0
@@ -262,7 +306,7 @@ class LLMChatBot:
         answer_message = Message(
             text=answer,
             session_id=message.session_id,
-            sequence_num=max_sequence_num + 2,
+            sequence_num=sequence_num + 1,
             received_timestamp=str(received_timestamp),
             responded_timestamp=str(datetime.now()),
             user_id=message.user_id,
@@ -301,11 +345,10 @@ class LLMChatBot:
         # Timestamp for recieving the question
         received_timestamp = datetime.now()
 
-        max_sequence_num, earliest_time = self.history_manager.get_max_sequence_num_and_earliest_time(message.session_id)
+        session = self.get_session(message, received_timestamp)
 
         # Check if the session is expired
-        if max_sequence_num >= self.config.CHATBOT_MAX_MESSAGES or \
-            (received_timestamp - earliest_time).total_seconds() > self.config.CHATBOT_SESSION_TIMEOUT:
+        if self.is_session_expired(session, received_timestamp):
             # Exceed the maximum number of messages
             # Restart the session
             initial_message = self.initialize_session(user_meta={'user_id': message.user_id})
@@ -348,8 +391,10 @@ class LLMChatBot:
 
         # Add the question and answer to the history
 
+        sequence_num = self.history_manager.reserve_sequence_nums(message.session_id, 2)
+
         question_message = message
-        question_message.sequence_num = max_sequence_num + 1
+        question_message.sequence_num = sequence_num
         question_message.received_timestamp = str(received_timestamp)
         question_message.responded_timestamp = str(datetime.now())
         question_message.is_bot = 0
@@ -359,7 +404,7 @@ class LLMChatBot:
         answer_message = Message(
             text=result['answer'],
             session_id=message.session_id,
-            sequence_num=max_sequence_num + 2,
+            sequence_num=sequence_num + 1,
             received_timestamp=str(received_timestamp),
             responded_timestamp=str(datetime.now()),
             user_id=message.user_id,
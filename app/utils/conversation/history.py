@@ -1,24 +1,29 @@
 import logging
+import threading
 from datetime import datetime
 from typing import Any, Dict, List, Optional, Tuple
 import hashlib
 
+from langchain.docstore.document import Document
+
 from app.config import Config
 from app.utils.llm import LLMHelper
 from app.utils.conversation import Message
+from app.utils.conversation.session import Session, get_session_registry
 from app.utils.vectorstore import get_vector_store
 from app.utils.vectorstore.redis import format_index_name
+from app.utils.vectorstore.faiss import EXPIRES_AT_KEY
 
 logger = logging.getLogger(__name__)
 
 CHAT_HISTORY_INDEX_NAME = 'chat_history'
 
 metadata_schema = {
-            'session_id': 'TEXT',
+            'session_id': 'TAG',
             'sequence_num': 'NUMERIC',
             'received_timestamp': 'TEXT',
             'responded_timestamp': 'TEXT',
-            'user_id': 'TEXT',
+            'user_id': 'TAG',
             'is_bot': 'NUMERIC' # 0 or 1
 }
 
@@ -49,9 +54,67 @@ class HistoryManager:
                 self.short_term_store.create_index(index_name=CHAT_HISTORY_INDEX_NAME, metadata_schema=metadata_schema)
             
 
+        # The history of a session expires once the session cannot be used anymore
+        self.history_ttl = int(config.CHATBOT_SESSION_TIMEOUT) + config.CHATBOT_HISTORY_TTL_GRACE
+
+        # The counters and start time of the sessions
+        self.session_registry = get_session_registry(config, self.short_term_store, self.history_ttl)
+
+        # The time and the history index size of the last maintenance, and the maintenance running
+        self.last_maintenance_time = datetime.now()
+        self.last_index_stats = {'num_docs': 0, 'num_added': 0}
+        self.maintenance: Optional[threading.Thread] = None
+        self.maintenance_lock = threading.Lock()
+
         # TODO: We need to also log the history in log anlytics for long term storage
         self.long_term_store = None
 
+    def start_session(
+            self, 
+            session_id: str, 
+            user_id: str, 
+            start_time: Optional[datetime] = None, 
+            sequence_num: int = 0
+        ) -> Session:
+        """
+        Record a new session.
+
+        Args:
+            session_id: the session id
+            user_id: the user id
+            start_time: the time the session started, now by default
+            sequence_num: the last sequence number already given to a message of the session
+        Returns:
+            the session
+        """
+
+        return self.session_registry.create_session(session_id, user_id, start_time, sequence_num)
+
+    def get_session(self, session_id: str) -> Optional[Session]:
+        """
+        Get the record of a session.
+
+        Args:
+            session_id: the session id
+        Returns:
+            the session, or None if it is not recorded
+        """
+
+        return self.session_registry.get_session(session_id)
+
+    def reserve_sequence_nums(self, session_id: str, count: int = 1) -> int:
+        """
+        Reserve the sequence numbers of the next messages of a session.
+
+        Args:
+            session_id: the session id
+            count: the number of messages
+        Returns:
+            the first sequence number reserved
+        """
+
+        return self.session_registry.add_messages(session_id, count)
+
     def add_message(self, message: Message) -> None:
         """
         Add a message to the history.
@@ -76,7 +139,9 @@ class HistoryManager:
         key = f"{format_index_name(CHAT_HISTORY_INDEX_NAME)}:{metadata['session_id']}:{metadata['sequence_num']}"
         keys = [key]
 
-        self.short_term_store.add_texts([text], [metadata], index_name=CHAT_HISTORY_INDEX_NAME, keys=keys)
+        self.short_term_store.add_texts([text], [metadata], index_name=CHAT_HISTORY_INDEX_NAME, keys=keys, ttl=self.history_ttl)
+
+        self.maintain_history_if_due()
 
         # TODO: We need to also log the history in log anlytics for long term storage
     
@@ -105,7 +170,9 @@ class HistoryManager:
         # session_id:sequence_num is the key
         key = f"{format_index_name(CHAT_HISTORY_INDEX_NAME)}:{metadata['session_id']}:{metadata['sequence_num']}"
         keys = [key]
-        self.short_term_store.add_texts([text], [metadata], index_name=CHAT_HISTORY_INDEX_NAME, keys=keys)
+        self.short_term_store.add_texts([text], [metadata], index_name=CHAT_HISTORY_INDEX_NAME, keys=keys, ttl=self.history_ttl)
+
+        self.maintain_history_if_due()
 
     def get_k_most_related_messages(
             self, 
@@ -121,22 +188,21 @@ class HistoryManager:
             query: the query
             session_id: the session id
             k: the number of messages
+            score_threshold: the smallest relevance score of the messages, 0 for no threshold
         Returns:
             the messages
         """
 
+        # The threshold is applied by the vector store
         documents = self.short_term_store.similarity_search(query, 
                                                             k, 
                                                             filter={'session_id': session_id},
-                                                            index_name=CHAT_HISTORY_INDEX_NAME)
+                                                            index_name=CHAT_HISTORY_INDEX_NAME,
+                                                            score_threshold=float(score_threshold) or None)
 
         messages = []
         for doc in documents:
-            # logger.info(f"doc: {doc}")
-            if doc[1] < score_threshold:
-                continue
-
-            message = self.from_doc_to_message(doc)
+            message = self.from_doc_to_message(doc[0])
             if message.sequence_num > 0: # The 0 sequence number is a placeholder
                 messages.append((message.sequence_num, message))
 
@@ -162,29 +228,26 @@ class HistoryManager:
             the messages
         """
 
-        # The vector store cannot be filtered by session_id only, 
-        # so we need to get all the messages sorted by sequence_num and return the top k
-        documents = self.short_term_store.similarity_search(
-            query='',
-            k=self.config.CHATBOT_MAX_MESSAGES, 
+        # The latest messages are listed by the vector store, without embedding anything
+        documents = self.short_term_store.query_by_filter(
             filter={'session_id': session_id},
+            sort_by='sequence_num',
+            limit=k,
+            descending=True,
             index_name=CHAT_HISTORY_INDEX_NAME    
         )
 
         messages = []
 
-        logger.info(f"len(documents): {len(documents)}")
-        for doc in documents:
-            logger.info(f"doc: {doc}")
+        logger.debug(f"len(documents): {len(documents)}")
+        for doc in reversed(documents):
             message = self.from_doc_to_message(doc)
             if int(message.sequence_num) > 0: # The 0 sequence number is a placeholder
-                messages.append((message.sequence_num, message))
-
-        messages.sort(key=lambda x: x[0], reverse=True)
+                messages.append(message)
 
         # TODO: We need to also log the matches in log anlytics for performance investigation
 
-        return [message[1] for message in reversed(messages[:k])]
+        return messages
     
     def get_all_messages(self, session_id: str) -> List[Message]:
         """
@@ -201,25 +264,7 @@ class HistoryManager:
 
         return messages
 
-    def get_max_sequence_num_and_earliest_time(self, session_id: str) -> int:
-        """Get the max sequence number and first timestamp.
-        
-        Args:
-            session_id: the session id
-        Returns:
-            the max sequence number and first timestamp
-        """
-
-        messages = self.get_all_messages(session_id)
-
-        if len(messages) == 0:
-            return 0, datetime.now()
-        else:
-            earliest_time = datetime.strptime(messages[0].received_timestamp, '%Y-%m-%d %H:%M:%S.%f')
-
-            return messages[-1].sequence_num, earliest_time
-        
-    def from_doc_to_message(self, doc) -> Message:
+    def from_doc_to_message(self, doc: Document) -> Message:
         """
         Convert a document to a message.
 
@@ -230,18 +275,106 @@ class HistoryManager:
         """
 
         message = Message(
-            text=doc[0].page_content,
-            session_id=doc[0].metadata['session_id'],
-            sequence_num=int(doc[0].metadata['sequence_num']),
-            received_timestamp=doc[0].metadata['received_timestamp'],
-            responded_timestamp=doc[0].metadata['responded_timestamp'],
-            user_id=doc[0].metadata['user_id'],
-            is_bot=int(doc[0].metadata['is_bot'])
+            text=doc.page_content,
+            session_id=doc.metadata['session_id'],
+            sequence_num=int(doc.metadata['sequence_num']),
+            received_timestamp=doc.metadata['received_timestamp'],
+            responded_timestamp=doc.metadata['responded_timestamp'],
+            user_id=doc.metadata['user_id'],
+            is_bot=int(doc.metadata['is_bot'])
         )
 
         return message
     
+    def maintain_history(self) -> Dict[str, int]:
+        """
+        Remove the expired history and report the size and churn of the history index.
+
+        The history of the expired sessions is deleted, including Redis history 
+        written without a TTL. FAISS does not expire messages by themselves, so the
+        FAISS messages past their TTL are deleted too, and the index is rebuilt without them.
+
+        Returns:
+            the number of documents in the history index, the number of documents 
+            added and removed since the last report, and the number of sessions expired
+        """
+
+        self.last_maintenance_time = datetime.now()
+
+        expired_sessions = self.session_registry.remove_expired_sessions(self.history_ttl)
+        if self.short_term_store.check_existing_index(CHAT_HISTORY_INDEX_NAME):
+            deleted = []
+            if len(expired_sessions) > 0:
+                deleted += self.short_term_store.delete_documents(filter={'session_id': expired_sessions}, index_name=CHAT_HISTORY_INDEX_NAME)
+
+            if self.config.VECTOR_STORE_TYPE == 'faiss':
+                deleted += self.short_term_store.delete_documents(
+                    filter={EXPIRES_AT_KEY: {'lt': datetime.now().timestamp()}}, 
+                    index_name=CHAT_HISTORY_INDEX_NAME
+                )
+
+            if self.config.VECTOR_STORE_TYPE == 'faiss' and len(deleted) > 0:
+                # The history is never saved, so it is not compacted when saving
+                self.short_term_store.rebuild_index(CHAT_HISTORY_INDEX_NAME, retrain=False)
+
+        index_stats = self.short_term_store.get_index_stats(CHAT_HISTORY_INDEX_NAME)
+
+        num_added = index_stats['num_added'] - self.last_index_stats['num_added']
+        report = {
+            'num_docs': index_stats['num_docs'],
+            'num_added': num_added,
+            'num_removed': num_added - (index_stats['num_docs'] - self.last_index_stats['num_docs']),
+            'num_expired_sessions': len(expired_sessions)
+        }
+        self.last_index_stats = index_stats
+
+        logger.info(
+            f"History index '{CHAT_HISTORY_INDEX_NAME}' holds {report['num_docs']} messages, "
+            f"{report['num_added']} added and {report['num_removed']} removed since the last report"
+        )
+
+        return report
+
+    def maintain_history_if_due(self) -> Optional[threading.Thread]:
+        """
+        Maintain the history in the background if CHATBOT_HISTORY_MAINTENANCE_INTERVAL 
+        seconds passed since it was last maintained.
+
+        The FAISS history is rebuilt by the maintenance, so it never runs on the 
+        thread answering the chat, and only one maintenance runs at a time.
+
+        Returns:
+            the thread of the maintenance started, or None if none was started
+        """
+
+        interval = self.config.CHATBOT_HISTORY_MAINTENANCE_INTERVAL
+        if interval <= 0 or (datetime.now() - self.last_maintenance_time).total_seconds() < interval:
+            return None
+
+        with self.maintenance_lock:
+            if self.maintenance is not None and self.maintenance.is_alive():
+                return None
+
+            # Not due again while it runs
+            self.last_maintenance_time = datetime.now()
+
+            self.maintenance = threading.Thread(target=self._maintain_history, name="history-maintenance", daemon=True)
+            self.maintenance.start()
+
+            return self.maintenance
+
+    def _maintain_history(self) -> None:
+        """Maintain the history, logging the errors rather than raising them."""
+
+        try:
+            self.maintain_history()
+        except Exception as e:
+            # The history is still expired by its TTL, or at the next maintenance
+            logger.warning(f"Maintenance of the history failed with '{e}'")
+
     def clear_all_history(self) -> None:
         """Clear all the history."""
 
-        self.short_term_store.drop_index(CHAT_HISTORY_INDEX_NAME)
\ No newline at end of file
+        self.short_term_store.drop_index(CHAT_HISTORY_INDEX_NAME)
+        self.session_registry.clear_all_sessions()
+        self.last_index_stats = {'num_docs': 0, 'num_added': 0}
\ No newline at end of file
@@ -0,0 +1,369 @@
+import logging
+import threading
+from abc import abstractmethod
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from app.config import Config
+from app.utils.vectorstore.base import BaseVectorStore
+from app.utils.vectorstore.redis import format_index_name
+
+logger = logging.getLogger(__name__)
+
+CHAT_SESSION_KEY_PREFIX = 'chat_session'
+
+class Session:
+    """This class represents the record of a chat session."""
+
+    def __init__(
+            self,
+            session_id: str,
+            user_id: str = None,
+            start_time: datetime = None,
+            sequence_num: int = 0,
+            message_count: int = 0
+        ):
+        """
+        Initialize the Session.
+
+        Args:
+            session_id: the session id
+            user_id: the user id
+            start_time: the time the session started
+            sequence_num: the last sequence number given to a message of the session
+            message_count: the number of messages of the session
+        """
+
+        self.session_id = session_id
+        self.user_id = user_id
+        self.start_time = start_time
+        self.sequence_num = sequence_num
+        self.message_count = message_count
+
+    def to_json(self):
+        """Convert the session to json."""
+
+        return {
+            'session_id': self.session_id,
+            'user_id': self.user_id,
+            'start_time': str(self.start_time),
+            'sequence_num': self.sequence_num,
+            'message_count': self.message_count
+        }
+
+class BaseSessionRegistry:
+    """This class represents a registry of the chat sessions.
+
+    The registry keeps a small record per session, so that a turn does not need
+    to read the history of its session to number its messages or to check if the
+    session expired.
+    """
+
+    @abstractmethod
+    def create_session(
+            self, 
+            session_id: str, 
+            user_id: str, 
+            start_time: Optional[datetime] = None, 
+            sequence_num: int = 0
+        ) -> Session:
+        """This function records a new session.
+
+        Args:
+            session_id: the session id
+            user_id: the user id
+            start_time: the time the session started, now by default
+            sequence_num: the last sequence number already given to a message of the session
+        Returns:
+            the session
+        """
+
+    @abstractmethod
+    def get_session(self, session_id: str) -> Optional[Session]:
+        """This function returns the record of a session.
+
+        Args:
+            session_id: the session id
+        Returns:
+            the session, or None if it is not recorded
+        """
+
+    @abstractmethod
+    def add_messages(self, session_id: str, count: int = 1) -> int:
+        """This function atomically reserves the sequence numbers of new messages of a session.
+
+        Args:
+            session_id: the session id
+            count: the number of messages
+        Returns:
+            the first sequence number reserved
+        """
+
+    @abstractmethod
+    def remove_expired_sessions(self, ttl: int) -> List[str]:
+        """This function removes the records of the sessions started more than ttl seconds ago.
+
+        Args:
+            ttl: the seconds a session is kept
+        Returns:
+            the ids of the sessions removed
+        """
+
+    @abstractmethod
+    def clear_all_sessions(self) -> None:
+        """This function removes the records of every session."""
+
+class LocalSessionRegistry(BaseSessionRegistry):
+    """This class represents a session registry held in memory, for the FAISS vector store."""
+
+    def __init__(self):
+        """Initialize the Local Session Registry."""
+
+        self.sessions: Dict[str, Session] = {}
+        self.lock = threading.Lock()
+
+    def create_session(
+            self, 
+            session_id: str, 
+            user_id: str, 
+            start_time: Optional[datetime] = None, 
+            sequence_num: int = 0
+        ) -> Session:
+        """This function records a new session.
+
+        Args:
+            session_id: the session id
+            user_id: the user id
+            start_time: the time the session started, now by default
+            sequence_num: the last sequence number already given to a message of the session
+        Returns:
+            the session
+        """
+
+        session = Session(session_id, user_id, start_time or datetime.now(), sequence_num, sequence_num)
+
+        with self.lock:
+            self.sessions[session_id] = session
+
+        return Session(**vars(session))
+
+    def get_session(self, session_id: str) -> Optional[Session]:
+        """This function returns the record of a session.
+
+        Args:
+            session_id: the session id
+        Returns:
+            the session, or None if it is not recorded
+        """
+
+        with self.lock:
+            session = self.sessions.get(session_id)
+
+            # A copy, the record keeps changing
+            return Session(**vars(session)) if session is not None else None
+
+    def add_messages(self, session_id: str, count: int = 1) -> int:
+        """This function atomically reserves the sequence numbers of new messages of a session.
+
+        Args:
+            session_id: the session id
+            count: the number of messages
+        Returns:
+            the first sequence number reserved
+        """
+
+        with self.lock:
+            session = self.sessions.setdefault(session_id, Session(session_id, start_time=datetime.now()))
+            session.sequence_num += count
+            session.message_count += count
+
+            return session.sequence_num - count + 1
+
+    def remove_expired_sessions(self, ttl: int) -> List[str]:
+        """This function removes the records of the sessions started more than ttl seconds ago.
+
+        Args:
+            ttl: the seconds a session is kept
+        Returns:
+            the ids of the sessions removed
+        """
+
+        now = datetime.now()
+
+        with self.lock:
+            expired = [
+                session_id for session_id, session in self.sessions.items() 
+                if (now - session.start_time).total_seconds() > ttl
+            ]
+            for session_id in expired:
+                del self.sessions[session_id]
+
+        return expired
+
+    def clear_all_sessions(self) -> None:
+        """This function removes the records of every session."""
+
+        with self.lock:
+            self.sessions.clear()
+
+class RedisSessionRegistry(BaseSessionRegistry):
+    """This class represents a session registry stored as one Redis hash per session.
+
+    The counters are advanced with HINCRBY, so concurrent turns of a session
+    never get the same sequence numbers. The hashes expire like the history of
+    their session. A hash that expired before its counters were advanced is
+    created again with the current time as its start time.
+
+    A sorted set keeps the time every session was last updated, so that the
+    sessions whose hash expired are known once the hash is gone, and their
+    history is deleted even if it was written without a TTL.
+    """
+
+    def __init__(self, redis_client, ttl: Optional[int] = None):
+        """
+        Initialize the Redis Session Registry.
+
+        Args:
+            redis_client: the redis client
+            ttl: the seconds after which the hash of a session expires, from its last update
+        """
+
+        self.redis_client = redis_client
+        self.ttl = ttl
+
+    def _get_key(self, session_id: str) -> str:
+        """This function returns the key of the hash of a session."""
+
+        return f"{format_index_name(CHAT_SESSION_KEY_PREFIX)}:{session_id}"
+
+    def _get_updates_key(self) -> str:
+        """This function returns the key of the sorted set of the last update time of every session."""
+
+        return f"{format_index_name(CHAT_SESSION_KEY_PREFIX)}_updates"
+
+    def create_session(
+            self, 
+            session_id: str, 
+            user_id: str, 
+            start_time: Optional[datetime] = None, 
+            sequence_num: int = 0
+        ) -> Session:
+        """This function records a new session.
+
+        Args:
+            session_id: the session id
+            user_id: the user id
+            start_time: the time the session started, now by default
+            sequence_num: the last sequence number already given to a message of the session
+        Returns:
+            the session
+        """
+
+        session = Session(session_id, user_id, start_time or datetime.now(), sequence_num, sequence_num)
+
+        pipeline = self.redis_client.pipeline(transaction=True)
+        pipeline.hset(self._get_key(session_id), mapping={
+            'user_id': user_id if user_id is not None else '',
+            'start_time': session.start_time.isoformat(),
+            'sequence_num': session.sequence_num,
+            'message_count': session.message_count
+        })
+        if self.ttl is not None:
+            pipeline.expire(self._get_key(session_id), self.ttl)
+        pipeline.zadd(self._get_updates_key(), {session_id: datetime.now().timestamp()})
+        pipeline.execute()
+
+        return session
+
+    def get_session(self, session_id: str) -> Optional[Session]:
+        """This function returns the record of a session.
+
+        Args:
+            session_id: the session id
+        Returns:
+            the session, or None if it is not recorded
+        """
+
+        fields = self.redis_client.hgetall(self._get_key(session_id))
+        if not fields:
+            return None
+
+        fields = {key.decode('utf-8') if isinstance(key, bytes) else key: value.decode('utf-8') if isinstance(value, bytes) else value
+                  for key, value in fields.items()}
+
+        return Session(
+            session_id,
+            user_id=fields.get('user_id') or None,
+            start_time=datetime.fromisoformat(fields['start_time']) if 'start_time' in fields else None,
+            sequence_num=int(fields.get('sequence_num', 0)),
+            message_count=int(fields.get('message_count', 0))
+        )
+
+    def add_messages(self, session_id: str, count: int = 1) -> int:
+        """This function atomically reserves the sequence numbers of new messages of a session.
+
+        Args:
+            session_id: the session id
+            count: the number of messages
+        Returns:
+            the first sequence number reserved
+        """
+
+        pipeline = self.redis_client.pipeline(transaction=True)
+        pipeline.hincrby(self._get_key(session_id), 'sequence_num', count)
+        pipeline.hincrby(self._get_key(session_id), 'message_count', count)
+        pipeline.hsetnx(self._get_key(session_id), 'start_time', datetime.now().isoformat())
+        if self.ttl is not None:
+            pipeline.expire(self._get_key(session_id), self.ttl)
+        pipeline.zadd(self._get_updates_key(), {session_id: datetime.now().timestamp()})
+        sequence_num = pipeline.execute()[0]
+
+        return sequence_num - count + 1
+
+    def remove_expired_sessions(self, ttl: int) -> List[str]:
+        """This function removes the sessions not updated for more than ttl seconds.
+
+        Their hashes expire by themselves, so only their entries of the sorted set
+        of updates are removed. The entries are read and removed in one transaction,
+        so a session updated meanwhile is kept.
+
+        Args:
+            ttl: the seconds a session is kept after its last update
+        Returns:
+            the ids of the sessions removed
+        """
+
+        max_update_time = datetime.now().timestamp() - ttl
+
+        pipeline = self.redis_client.pipeline(transaction=True)
+        pipeline.zrangebyscore(self._get_updates_key(), '-inf', max_update_time)
+        pipeline.zremrangebyscore(self._get_updates_key(), '-inf', max_update_time)
+        session_ids, _ = pipeline.execute()
+
+        return [session_id.decode('utf-8') if isinstance(session_id, bytes) else session_id for session_id in session_ids]
+
+    def clear_all_sessions(self) -> None:
+        """This function removes the records of every session."""
+
+        keys = list(self.redis_client.scan_iter(match=self._get_key('*')))
+        self.redis_client.delete(self._get_updates_key(), *keys)
+
+def get_session_registry(config: Config, vector_store: BaseVectorStore, ttl: Optional[int] = None) -> BaseSessionRegistry:
+    """This function returns the session registry based on the config.
+
+    Args:
+        config: the config object
+        vector_store: the vector store of the chat history
+        ttl: the seconds after which the record of a session expires, if the registry expires records
+    Returns:
+        the session registry
+    """
+
+    if config.VECTOR_STORE_TYPE == 'faiss':
+        return LocalSessionRegistry()
+
+    elif config.VECTOR_STORE_TYPE == 'redis':
+        return RedisSessionRegistry(vector_store.redis_client, ttl)
+
+    else:
+        raise ValueError('Vector store type not supported')
@@ -49,6 +49,7 @@ class Indexer:
             where metadata_type is one of the following:
             - TEXT
             - NUMERIC
+            - TAG, matched exactly by filters
 
             The underlying vector store will automatically create 2 fields automatically:
             1. a field called content which is the text of the document.
@@ -87,6 +88,11 @@ class Indexer:
         if self.config.VECTOR_STORE_TYPE == 'faiss':
             # remove the local file
             if os.path.exists(self.config.FAISS_LOCAL_FILE_INDEX):
+                # Dropping the indexes first waits for their background compactions
+                for file_name in os.listdir(self.config.FAISS_LOCAL_FILE_INDEX):
+                    if file_name.endswith('.faiss'):
+                        self.vector_store.drop_index(file_name[:-len('.faiss')])
+
                 logger.info(f"Removing FAISS local file '{self.config.FAISS_LOCAL_FILE_INDEX}'")
                 shutil.rmtree(self.config.FAISS_LOCAL_FILE_INDEX)
 
@@ -102,6 +108,32 @@ class Indexer:
             none
         """
         
+    def delete_document(self, source_url: str, index_name: str) -> int:
+        """
+        Delete the chunks of a document from the vector store.
+
+        Args:
+            source_url: the source url the document was added with
+            index_name: the index name
+        Returns:
+            the number of chunks deleted
+        """
+
+        # The chunks are added with the source url without its query string
+        source_url = source_url.split('?')[0]
+
+        # First load the index from local file if it is a faiss vector store
+        if self.config.VECTOR_STORE_TYPE == 'faiss':
+            self.vector_store.load_local(self.config.FAISS_LOCAL_FILE_INDEX, index_name=index_name)
+
+        deleted = self.vector_store.delete_documents(filter={"source": source_url}, index_name=index_name)
+
+        # Save the index to local file if it is a faiss vector store
+        if self.config.VECTOR_STORE_TYPE == 'faiss':
+            self.vector_store.save_local(self.config.FAISS_LOCAL_FILE_INDEX, index_name=index_name)
+
+        return len(deleted)
+
     def check_existing_index(self, index_name: str) -> bool:
         """This function checks if the index exists.
         
@@ -148,6 +180,9 @@ class FixedChunkIndexer(Indexer):
         """
         Embed and add the document to the vector store.
 
+        The chunks of a document already added from the same source url are 
+        replaced.
+
         Args:
             source_url: the source url
             index_name: the index name
@@ -188,14 +223,35 @@ class FixedChunkIndexer(Indexer):
 
         # First load the index from local file if it is a faiss vector store
         if self.config.VECTOR_STORE_TYPE == 'faiss':
-            self.vector_store.load_local(self.config.FAISS_LOCAL_FILE_INDEX)
+            self.vector_store.load_local(self.config.FAISS_LOCAL_FILE_INDEX, index_name=index_name)
+
+        if self.config.VECTOR_STORE_TYPE == 'redis':
+            # Redis keys the chunks by the hashes of their texts and only embeds the new ones,
+            # so the chunks of the previous version of the document are removed once the new ones are added.
+            # A new index is created by adding the first document, it has no previous chunks
+            previous_keys = []
+            if self.vector_store.check_existing_index(index_name):
+                previous_keys = [
+                    document.metadata['id'] for document in 
+                    self.vector_store.query_by_filter(filter={"source": source_url.split('?')[0]}, index_name=index_name)
+                ]
+
+            keys = self.vector_store.add_documents(chunks, index_name=index_name, **kwargs)
+
+            stale_keys = list(set(previous_keys) - set(keys))
+            if len(stale_keys) > 0:
+                self.vector_store.delete_documents(ids=stale_keys, index_name=index_name)
+
+        else:
+            # Remove the chunks of the previous version of the document
+            self.vector_store.delete_documents(filter={"source": source_url.split('?')[0]}, index_name=index_name)
 
-        # Add the chunks to the vector store
-        self.vector_store.add_documents(chunks, index_name=index_name, **kwargs)
+            # Add the chunks to the vector store
+            self.vector_store.add_documents(chunks, index_name=index_name, **kwargs)
 
         # Save the index to local file if it is a faiss vector store
         if self.config.VECTOR_STORE_TYPE == 'faiss':
-            self.vector_store.save_local(self.config.FAISS_LOCAL_FILE_INDEX)
+            self.vector_store.save_local(self.config.FAISS_LOCAL_FILE_INDEX, index_name=index_name)
 
         return None
     
@@ -204,16 +260,17 @@ class FixedChunkIndexer(Indexer):
             query: str, 
             k: int = 4, 
             filter: Optional[Dict[str, Any]] = None,
-            index_name: Optional[str] = None
+            index_name: Optional[str] = None,
+            score_threshold: Optional[float] = None
         ) -> List[Tuple[Document, float]]:
         """This function performs a similarity search.
         
         """
         # First load the index from local file if it is a faiss vector store
         if self.config.VECTOR_STORE_TYPE == 'faiss':
-            self.vector_store.load_local(self.config.FAISS_LOCAL_FILE_INDEX)
+            self.vector_store.load_local(self.config.FAISS_LOCAL_FILE_INDEX, read_only=True, index_name=index_name)
 
-        return self.vector_store.similarity_search(query, k, filter=filter, index_name=index_name)
+        return self.vector_store.similarity_search(query, k, filter=filter, index_name=index_name, score_threshold=score_threshold)
     
 
     
\ No newline at end of file
@@ -1,9 +1,16 @@
 import os
+from typing import Any
 
+from langchain.embeddings.base import Embeddings
 from langchain.embeddings.openai import OpenAIEmbeddings
 from langchain.chat_models import ChatOpenAI
+from langchain.chat_models.base import BaseChatModel
 
 from app.config import Config
+from app.utils.llm.embeddings import BatchedEmbeddings, get_token_counter
+from app.utils.llm.rate_limit import RateLimitedClient, get_rate_limiter
+from app.utils.llm.embedding_cache import CachedEmbeddings, get_embedding_cache
+from app.utils.llm.local import LocalChatModel, LocalEmbeddings
 
 class LLMHelper:
     def __init__(self, config: Config):
@@ -15,7 +22,38 @@ class LLMHelper:
 
         self.config = config
 
-    def get_llm(self, temperature: float = None) -> ChatOpenAI:
+    def _rate_limit(self, model: Any, deployment: str, requests_per_minute: int, tokens_per_minute: int) -> Any:
+        '''
+            Sends the requests of a langchain OpenAI model through the rate limiter of its deployment
+
+            Args:
+                model: the model
+                deployment: the deployment name
+                requests_per_minute: the requests per minute of the deployment
+                tokens_per_minute: the tokens per minute of the deployment
+            Returns:
+                the model
+        '''
+
+        if not self.config.OPENAI_RATE_LIMIT:
+            return model
+
+        rate_limiter = get_rate_limiter(
+            deployment,
+            requests_per_minute,
+            tokens_per_minute,
+            self.config.OPENAI_MAX_CONCURRENCY,
+            self.config.OPENAI_MAX_RETRIES,
+            self.config.OPENAI_MAX_QUEUE_WAIT
+        )
+
+        # The rate limiter retries the requests, a single attempt disables the retries of langchain
+        model.max_retries = 1
+        model.client = RateLimitedClient(model.client, rate_limiter, get_token_counter())
+
+        return model
+
+    def get_llm(self, temperature: float = None) -> BaseChatModel:
         '''
             Returns the LLM model based on the config
 
@@ -35,20 +73,34 @@ class LLMHelper:
                 temperature = self.config.OPENAI_TEMPERATURE
 
             # We should use the chat completion API, since azure GPT-4 only supports chat completion
-            return ChatOpenAI(
+            llm = ChatOpenAI(
                 model_name = self.config.OPENAI_ENGINE,
                 engine = self.config.OPENAI_ENGINE,
                 temperature = temperature,
                 max_tokens = self.config.OPENAI_MAX_TOKENS,
             )
 
+            return self._rate_limit(llm, self.config.OPENAI_ENGINE, self.config.OPENAI_REQUESTS_PER_MINUTE, self.config.OPENAI_TOKENS_PER_MINUTE)
+
+        elif self.config.LLM_TYPE == 'local':
+            return LocalChatModel(
+                latency = self.config.LOCAL_LLM_LATENCY,
+                tokens_per_second = self.config.LOCAL_LLM_TOKENS_PER_SECOND,
+                response_tokens = min(self.config.LOCAL_LLM_RESPONSE_TOKENS, int(self.config.OPENAI_MAX_TOKENS))
+            )
+
         else:
             raise ValueError('LLM type not supported')
 
-    def get_embeddings(self) -> OpenAIEmbeddings:
+    def get_embeddings(self) -> Embeddings:
         '''
             Returns the LLM embedding based on the config.
 
+            The texts are sent in batches of OPENAI_EMBEDDING_BATCH_SIZE texts, under a 
+            budget of OPENAI_EMBEDDING_BATCH_MAX_TOKENS tokens, and several batches are
+            sent at the same time. With EMBEDDING_CACHE, the embeddings of texts seen
+            before come from the embedding cache of the model.
+
             Args:
                 none
             Returns:
@@ -61,12 +113,39 @@ class LLMHelper:
             assert self.config.OPENAI_API_KEY is not None, 'OPENAI_API_KEY must be set'
             assert self.config.OPENAI_EMBEDDING_ENGINE is not None, 'OPENAI_EMBEDDING_ENGINE must be set'
 
-            return OpenAIEmbeddings(
+            embeddings = OpenAIEmbeddings(
                 model_name = self.config.OPENAI_EMBEDDING_ENGINE,
                 deployment = self.config.OPENAI_EMBEDDING_ENGINE,
-                chunk_size = 1,
+                chunk_size = self.config.OPENAI_EMBEDDING_BATCH_SIZE, # One request per batch
                 disallowed_special = () # Allow all special tokens
             )
+            embeddings = self._rate_limit(
+                embeddings, 
+                self.config.OPENAI_EMBEDDING_ENGINE, 
+                self.config.OPENAI_EMBEDDING_REQUESTS_PER_MINUTE, 
+                self.config.OPENAI_EMBEDDING_TOKENS_PER_MINUTE
+            )
+
+            embeddings = BatchedEmbeddings(
+                embeddings,
+                batch_size = self.config.OPENAI_EMBEDDING_BATCH_SIZE,
+                max_batch_tokens = self.config.OPENAI_EMBEDDING_BATCH_MAX_TOKENS,
+                max_concurrency = self.config.OPENAI_EMBEDDING_MAX_CONCURRENCY
+            )
+
+            if self.config.EMBEDDING_CACHE:
+                embeddings = CachedEmbeddings(embeddings, get_embedding_cache(
+                    self.config.EMBEDDING_CACHE_DIR,
+                    self.config.OPENAI_EMBEDDING_ENGINE,
+                    self.config.EMBEDDING_CACHE_MAX_SIZE,
+                    self.config.EMBEDDING_CACHE_MEMORY_ITEMS
+                ))
+
+            return embeddings
+
+        elif self.config.LLM_TYPE == 'local':
+            # Not cached nor batched, the local model is faster than the cache
+            return LocalEmbeddings(int(self.config.OPENAI_EMBEDDING_SIZE))
 
         else:
             raise ValueError('LLM type not supported')
@@ -0,0 +1,493 @@
+import os
+import re
+import time
+import asyncio
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from langchain.embeddings.base import Embeddings
+
+logger = logging.getLogger(__name__)
+
+# The bytes of the digest of a text stored with its vector, checked when reading the vector,
+# since another process may reuse the slot of an evicted entry at the same time
+TAG_SIZE = 16
+
+# The last uses of the entries looked up are written to the disk tier in batches, once this
+# many are pending or once the oldest pending one is this many seconds old
+TOUCH_BATCH_SIZE = 1024
+TOUCH_INTERVAL = 60
+
+# The caches of the process, keyed by folder, so that every embeddings model shares them
+_embedding_caches: Dict[str, "EmbeddingCache"] = {}
+_embedding_caches_lock = threading.Lock()
+
+def get_text_hash(text: str) -> bytes:
+    """This function returns the sha256 digest of a text, its key in the cache.
+
+    Args:
+        text: the text
+    Returns:
+        the digest
+    """
+
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+class EmbeddingCache:
+    """This class represents a persistent cache of the embeddings of one model.
+
+    Recently used embeddings are kept in an in-process LRU. The others are stored in
+    a folder: the vectors in fixed-size slots of a memory-mapped file, and the slot of
+    every text in an SQLite index. Once the file holds max_size bytes, the least
+    recently used entries are evicted and their slots reused. Several processes can
+    share a folder. If the folder cannot be written, only the memory tier is used.
+
+    Every hit, in memory or on disk, refreshes the last use of its entry on disk, so
+    that the disk tier evicts the embeddings that are not used anymore. These updates
+    are written in batches, see TOUCH_BATCH_SIZE and TOUCH_INTERVAL.
+    """
+
+    def __init__(self, folder_path: str, max_size: int = 1024 * 1024 * 1024, memory_items: int = 4096):
+        """
+        Initialize the Embedding Cache.
+
+        Args:
+            folder_path: the folder of the disk tier
+            max_size: the largest size of the vector file, in bytes
+            memory_items: the number of embeddings kept in memory
+        """
+
+        self.folder_path = folder_path
+        self.max_size = max_size
+        self.memory_items = memory_items
+
+        self.lock = threading.Lock()
+        self.memory: OrderedDict[bytes, np.ndarray] = OrderedDict()
+
+        self.vector_file = os.path.join(folder_path, 'vectors.bin')
+        self.connection: Optional[sqlite3.Connection] = None
+        self.fd: Optional[int] = None
+
+        # Set by the first vector stored
+        self.dimension: Optional[int] = None
+        self._vectors: Optional[np.memmap] = None
+
+        try:
+            self._open()
+        except (sqlite3.Error, OSError) as e:
+            # For example a read-only file system
+            logger.warning(f"Cannot open the embedding cache in '{folder_path}', only keeping embeddings in memory: {e}")
+            self.close()
+
+        # The hits whose last use is not written yet, and when the first of them was made
+        self._touched: Dict[bytes, float] = {}
+        self._touched_since: Optional[float] = None
+
+    def _open(self) -> None:
+        """This function opens the disk tier, creating its folder and files if needed."""
+
+        os.makedirs(self.folder_path, exist_ok=True)
+
+        self.connection = sqlite3.connect(os.path.join(self.folder_path, 'index.sqlite'), timeout=30, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS entries (key BLOB PRIMARY KEY, slot INTEGER NOT NULL, last_used REAL NOT NULL)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS free_slots (slot INTEGER PRIMARY KEY)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+        self.fd = os.open(self.vector_file, os.O_RDWR | os.O_CREAT, 0o644)
+
+        self.dimension = self._get_meta('dimension')
+
+    def close(self) -> None:
+        """This function closes the disk tier, the cache then only keeps embeddings in memory."""
+
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        self._vectors = None
+
+    @property
+    def record_dtype(self) -> np.dtype:
+        """The type of a slot of the vector file."""
+
+        return np.dtype([('tag', f'V{TAG_SIZE}'), ('vector', '<f4', (self.dimension,))])
+
+    @property
+    def max_slots(self) -> int:
+        """The number of slots of the vector file holding max_size bytes."""
+
+        return max(self.max_size // self.record_dtype.itemsize, 1)
+
+    def _get_meta(self, name: str) -> Optional[int]:
+        """This function reads a value of the meta table."""
+
+        row = self.connection.execute("SELECT value FROM meta WHERE name = ?", (name,)).fetchone()
+
+        return row[0] if row is not None else None
+
+    def _get_vectors(self, slot: int) -> Optional[np.memmap]:
+        """This function returns the memory-mapped vector file, mapped again if it grew past a slot."""
+
+        if self._vectors is None or slot >= len(self._vectors):
+            num_slots = os.fstat(self.fd).st_size // self.record_dtype.itemsize
+            if slot >= num_slots:
+                return None
+            self._vectors = np.memmap(self.vector_file, dtype=self.record_dtype, mode='r', shape=(num_slots,))
+
+        return self._vectors
+
+    def get(self, keys: List[bytes]) -> List[Optional[np.ndarray]]:
+        """This function looks up embeddings.
+
+        Args:
+            keys: the digests of the texts
+        Returns:
+            the embeddings, None for the texts not cached
+        """
+
+        results: List[Optional[np.ndarray]] = [None] * len(keys)
+        now = time.time()
+
+        with self.lock:
+            missing = []
+            for i, key in enumerate(keys):
+                vector = self.memory.get(key)
+                if vector is not None:
+                    self.memory.move_to_end(key)
+                    results[i] = vector
+                    self._touch(key, now)
+                else:
+                    missing.append(i)
+
+            if len(missing) == 0 or self.connection is None:
+                self._flush_touched_if_due(now)
+                return results
+
+            if self.dimension is None:
+                # Another process may have stored the first vector
+                self.dimension = self._get_meta('dimension')
+
+            if self.dimension is None:
+                return results
+
+            for i in missing:
+                row = self.connection.execute("SELECT slot FROM entries WHERE key = ?", (keys[i],)).fetchone()
+                if row is None:
+                    continue
+
+                vectors = self._get_vectors(row[0])
+                if vectors is None:
+                    continue
+
+                record = vectors[row[0]]
+                vector = np.array(record['vector'])
+                # The slot may have been reused for another text
+                if bytes(record['tag']) != keys[i][:TAG_SIZE]:
+                    continue
+
+                results[i] = vector
+                self._touch(keys[i], now)
+                self._remember(keys[i], vector)
+
+            self._flush_touched_if_due(now)
+
+        return results
+
+    def _touch(self, key: bytes, now: float) -> None:
+        """This function records a hit, whose last use is written to the disk tier with the next batch."""
+
+        if self.connection is None:
+            return
+
+        self._touched[key] = now
+        if self._touched_since is None:
+            self._touched_since = now
+
+    def _flush_touched_if_due(self, now: float) -> None:
+        """This function writes the last uses of the hits once a batch is full or old enough."""
+
+        if len(self._touched) < TOUCH_BATCH_SIZE and \
+                (self._touched_since is None or now - self._touched_since < TOUCH_INTERVAL):
+            return
+
+        try:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._write_touched()
+                self.connection.execute("COMMIT")
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            # Only the eviction order suffers, the hits are dropped so that they do not pile up
+            logger.warning(f"Cannot update the last uses of the embeddings in '{self.folder_path}': {e}")
+            self._touched = {}
+            self._touched_since = None
+
+    def _write_touched(self) -> None:
+        """This function writes the last uses of the hits, in the current transaction."""
+
+        touched, self._touched, self._touched_since = self._touched, {}, None
+        self.connection.executemany("UPDATE entries SET last_used = ? WHERE key = ?", [(used, key) for key, used in touched.items()])
+
+    def put(self, keys: List[bytes], vectors: List[np.ndarray]) -> None:
+        """This function stores embeddings.
+
+        Args:
+            keys: the digests of the texts
+            vectors: the embeddings
+        Returns:
+            none
+        """
+
+        if len(keys) == 0:
+            return
+
+        with self.lock:
+            for key, vector in zip(keys, vectors):
+                self._remember(key, vector)
+
+            if self.connection is None:
+                return
+
+            try:
+                self._store(keys, vectors)
+            except (sqlite3.Error, OSError) as e:
+                # The memory tier still holds the embeddings
+                logger.warning(f"Cannot store embeddings in '{self.folder_path}': {e}")
+
+    def _remember(self, key: bytes, vector: np.ndarray) -> None:
+        """This function adds an embedding to the memory tier, evicting the least recently used one."""
+
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_items:
+            self.memory.popitem(last=False)
+
+    def _store(self, keys: List[bytes], vectors: List[np.ndarray]) -> None:
+        """This function writes embeddings to the disk tier, in one transaction."""
+
+        now = time.time()
+
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            if self.dimension is None:
+                self.dimension = self._get_meta('dimension') or len(vectors[0])
+                self.connection.execute("INSERT OR IGNORE INTO meta VALUES ('dimension', ?)", (self.dimension,))
+
+            self._write_touched()
+
+            new_entries = {}
+            for key, vector in zip(keys, vectors):
+                if len(vector) == self.dimension and key not in new_entries:
+                    new_entries[key] = vector
+
+            existing = set()
+            for key in new_entries:
+                if self.connection.execute("SELECT 1 FROM entries WHERE key = ?", (key,)).fetchone() is not None:
+                    existing.add(key)
+            self.connection.executemany("UPDATE entries SET last_used = ? WHERE key = ?", [(now, key) for key in existing])
+
+            # Only the last entries are kept if there are more than the cache holds
+            new_entries = dict([(key, vector) for key, vector in new_entries.items() if key not in existing][-self.max_slots:])
+            slots = self._allocate_slots(len(new_entries))
+
+            records = np.zeros(1, dtype=self.record_dtype)
+            for (key, vector), slot in zip(new_entries.items(), slots):
+                records['tag'] = np.void(key[:TAG_SIZE])
+                records['vector'] = vector
+                os.pwrite(self.fd, records.tobytes(), slot * self.record_dtype.itemsize)
+
+            # The vectors are written before the entries pointing at them
+            self.connection.executemany("INSERT INTO entries VALUES (?, ?, ?)", [(key, slot, now) for key, slot in zip(new_entries, slots)])
+            self.connection.execute("COMMIT")
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+
+    def _allocate_slots(self, count: int) -> List[int]:
+        """This function returns free slots of the vector file, evicting the least recently used entries if it is full."""
+
+        max_slots = self.max_slots
+
+        slots = self._take_free_slots(count)
+
+        next_slot = self._get_meta('next_slot') or 0
+        while len(slots) < count and next_slot < max_slots:
+            slots.append(next_slot)
+            next_slot += 1
+        self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('next_slot', ?)", (next_slot,))
+
+        if len(slots) < count:
+            # Evict a hundredth of the cache at least, so that eviction is not needed for every entry stored
+            evicted = self.connection.execute(
+                "SELECT key, slot FROM entries ORDER BY last_used LIMIT ?",
+                (max(count - len(slots), max_slots // 100),)
+            ).fetchall()
+            self.connection.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted])
+            self.connection.executemany("INSERT OR IGNORE INTO free_slots VALUES (?)", [(slot,) for _, slot in evicted])
+
+            logger.debug(f"Evicted {len(evicted)} embeddings from '{self.folder_path}'")
+
+            slots += self._take_free_slots(count - len(slots))
+
+        return slots
+
+    def _take_free_slots(self, count: int) -> List[int]:
+        """This function removes up to count slots from the free slots and returns them."""
+
+        slots = [row[0] for row in self.connection.execute("SELECT slot FROM free_slots LIMIT ?", (count,))]
+        self.connection.executemany("DELETE FROM free_slots WHERE slot = ?", [(slot,) for slot in slots])
+
+        return slots
+
+    def clear(self) -> None:
+        """This function removes every embedding of the cache."""
+
+        with self.lock:
+            self.memory.clear()
+            self._touched.clear()
+            self._touched_since = None
+            if self.connection is None:
+                return
+
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.execute("DELETE FROM entries")
+            self.connection.execute("DELETE FROM free_slots")
+            self.connection.execute("DELETE FROM meta")
+            os.ftruncate(self.fd, 0)
+            self.connection.execute("COMMIT")
+            self.dimension = None
+            self._vectors = None
+
+def get_embedding_cache(folder_path: str, model: str, max_size: int, memory_items: int) -> EmbeddingCache:
+    """This function returns the embedding cache of a model, shared by the process.
+
+    Args:
+        folder_path: the folder of the caches, every model gets a folder of its own
+        model: the model or deployment name
+        max_size: the largest size of the vector file, in bytes
+        memory_items: the number of embeddings kept in memory
+    Returns:
+        the embedding cache
+    """
+
+    cache_path = os.path.join(folder_path, re.sub(r'[^\w.-]', '_', model))
+
+    with _embedding_caches_lock:
+        cache = _embedding_caches.get(cache_path)
+        if cache is None:
+            cache = _embedding_caches[cache_path] = EmbeddingCache(cache_path, max_size, memory_items)
+
+        return cache
+
+class CachedEmbeddings(Embeddings):
+    """This class represents an embeddings model looking up the embeddings of a cache first.
+
+    Queries and documents share the cache, so a question asked again, or a text
+    indexed again, is not sent to the model.
+    """
+
+    def __init__(self, embeddings: Embeddings, cache: EmbeddingCache):
+        """
+        Initialize the Cached Embeddings.
+
+        Args:
+            embeddings: the embeddings model embedding the texts not cached
+            cache: the cache of the embeddings of the model
+        """
+
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """This function embeds texts, only sending the texts not cached to the model.
+
+        Args:
+            texts: the texts
+        Returns:
+            the embeddings, in the order of the texts
+        """
+
+        keys = [get_text_hash(text) for text in texts]
+        vectors = self.cache.get(keys)
+
+        missing: Dict[bytes, str] = {}
+        for key, text, vector in zip(keys, texts, vectors):
+            if vector is None:
+                missing[key] = text
+
+        if len(missing) > 0:
+            logger.debug(f"Embedding {len(missing)} of {len(texts)} texts, the others are cached")
+
+            # Rounded like the cached vectors, so that a text always gets the same embedding
+            new_vectors = np.asarray(self.embeddings.embed_documents(list(missing.values())), dtype=np.float32)
+            self.cache.put(list(missing), list(new_vectors))
+
+            new_vectors = dict(zip(missing, new_vectors))
+            vectors = [vector if vector is not None else new_vectors[key] for key, vector in zip(keys, vectors)]
+
+        return [vector.tolist() for vector in vectors]
+
+    def embed_query(self, text: str) -> List[float]:
+        """This function embeds a query, unless it is cached.
+
+        Args:
+            text: the query
+        Returns:
+            the embedding
+        """
+
+        key = get_text_hash(text)
+        vector = self.cache.get([key])[0]
+
+        if vector is None:
+            vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+            self.cache.put([key], [vector])
+
+        return vector.tolist()
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """This function embeds texts without blocking the event loop.
+
+        Args:
+            texts: the texts
+        Returns:
+            the embeddings, in the order of the texts
+        """
+
+        return await asyncio.get_running_loop().run_in_executor(None, self.embed_documents, texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """This function embeds a query without blocking the event loop.
+
+        Args:
+            text: the query
+        Returns:
+            the embedding
+        """
+
+        key = get_text_hash(text)
+        vector = self.cache.get([key])[0]
+
+        if vector is None:
+            try:
+                embedding = await self.embeddings.aembed_query(text)
+            except NotImplementedError:
+                embedding = await asyncio.get_running_loop().run_in_executor(None, self.embeddings.embed_query, text)
+
+            vector = np.asarray(embedding, dtype=np.float32)
+            self.cache.put([key], [vector])
+
+        return vector.tolist()
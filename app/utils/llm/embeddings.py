@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from langchain.embeddings.base import Embeddings
+
+logger = logging.getLogger(__name__)
+
+# The batches of every BatchedEmbeddings of the process run on this pool, so that
+# concurrent ingestions together never send more than max_concurrency requests
+_embedding_executor: Optional[ThreadPoolExecutor] = None
+_embedding_executor_lock = threading.Lock()
+
+def get_embedding_executor(max_concurrency: int) -> ThreadPoolExecutor:
+    """This function returns the thread pool running the embedding batches.
+
+    Args:
+        max_concurrency: the number of threads, only used by the first call
+    Returns:
+        the thread pool
+    """
+
+    global _embedding_executor
+
+    with _embedding_executor_lock:
+        if _embedding_executor is None:
+            _embedding_executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='embeddings')
+
+        return _embedding_executor
+
+def estimate_tokens(text: str) -> int:
+    """This function estimates the number of tokens of a text, about four characters per token.
+
+    Args:
+        text: the text
+    Returns:
+        the number of tokens
+    """
+
+    return len(text) // 4 + 1
+
+def get_token_counter(encoding_name: str = 'cl100k_base') -> Callable[[str], int]:
+    """This function returns a function counting the tokens of a text.
+
+    Args:
+        encoding_name: the tiktoken encoding of the embedding model
+    Returns:
+        the token counter, which estimates the tokens if the encoding cannot be loaded
+    """
+
+    try:
+        import tiktoken
+
+        encoding = tiktoken.get_encoding(encoding_name)
+    except Exception as e:
+        logger.warning(f"Cannot load the tiktoken encoding '{encoding_name}', estimating the tokens instead: {e}")
+        return estimate_tokens
+
+    return lambda text: len(encoding.encode(text, disallowed_special=()))
+
+class BatchedEmbeddings(Embeddings):
+    """This class represents an embeddings model sending the texts in batches.
+
+    The texts are split into batches of at most batch_size texts and max_batch_tokens
+    tokens, in order. A text longer than the budget goes into a batch of its own. The
+    batches are embedded concurrently and the embeddings returned in the order of
+    the texts.
+    """
+
+    def __init__(
+            self,
+            embeddings: Embeddings,
+            batch_size: int = 16,
+            max_batch_tokens: int = 32768,
+            max_concurrency: int = 4,
+            count_tokens: Optional[Callable[[str], int]] = None
+        ):
+        """
+        Initialize the Batched Embeddings.
+
+        Args:
+            embeddings: the embeddings model sending one request per batch
+            batch_size: the largest number of texts of a batch
+            max_batch_tokens: the largest number of tokens of a batch
+            max_concurrency: the largest number of batches sent at the same time by the process
+            count_tokens: the function counting the tokens of a text, tiktoken by default
+        """
+
+        if batch_size < 1 or max_batch_tokens < 1 or max_concurrency < 1:
+            raise ValueError('The batch size, the token budget and the concurrency must be positive')
+
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_concurrency = max_concurrency
+        self.count_tokens = count_tokens or get_token_counter()
+
+    def get_batches(self, texts: List[str]) -> List[List[str]]:
+        """This function splits texts into batches.
+
+        Args:
+            texts: the texts
+        Returns:
+            the batches, in the order of the texts
+        """
+
+        batches = []
+        batch, batch_tokens = [], 0
+        for text in texts:
+            tokens = self.count_tokens(text)
+            if len(batch) > 0 and (len(batch) >= self.batch_size or batch_tokens + tokens > self.max_batch_tokens):
+                batches.append(batch)
+                batch, batch_tokens = [], 0
+
+            batch.append(text)
+            batch_tokens += tokens
+
+        if len(batch) > 0:
+            batches.append(batch)
+
+        return batches
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """This function embeds texts in batches.
+
+        Args:
+            texts: the texts
+        Returns:
+            the embeddings, in the order of the texts
+        """
+
+        batches = self.get_batches(list(texts))
+
+        logger.debug(f"Embedding {len(texts)} texts in {len(batches)} batches")
+
+        if len(batches) <= 1 or self.max_concurrency == 1:
+            results = [self.embeddings.embed_documents(batch) for batch in batches]
+        else:
+            # map returns the results in the order of the batches
+            results = get_embedding_executor(self.max_concurrency).map(self.embeddings.embed_documents, batches)
+
+        return [embedding for result in results for embedding in result]
+
+    def embed_query(self, text: str) -> List[float]:
+        """This function embeds a query.
+
+        Args:
+            text: the query
+        Returns:
+            the embedding
+        """
+
+        return self.embeddings.embed_query(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """This function embeds texts in batches without blocking the event loop.
+
+        Args:
+            texts: the texts
+        Returns:
+            the embeddings, in the order of the texts
+        """
+
+        return await asyncio.get_running_loop().run_in_executor(None, self.embed_documents, texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """This function embeds a query without blocking the event loop.
+
+        Args:
+            text: the query
+        Returns:
+            the embedding
+        """
+
+        try:
+            return await self.embeddings.aembed_query(text)
+        except NotImplementedError:
+            return await asyncio.get_running_loop().run_in_executor(None, self.embeddings.embed_query, text)
@@ -0,0 +1,210 @@
+import time
+import hashlib
+import logging
+from typing import Any, Iterator, List, Optional
+
+import numpy as np
+
+from langchain.callbacks.manager import CallbackManagerForLLMRun
+from langchain.chat_models.base import BaseChatModel
+from langchain.embeddings.base import Embeddings
+from langchain.schema.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain.schema.output import ChatGeneration, ChatGenerationChunk, ChatResult
+
+logger = logging.getLogger(__name__)
+
+class LocalEmbeddings(Embeddings):
+    """This class represents a deterministic embeddings model running on the CPU, for tests and benchmarks.
+
+    The words of a text and the character n-grams of every word are hashed into the
+    dimensions of the vector, with a sign also given by the hash, and the vector is
+    normalized. Texts sharing words or parts of words get similar vectors, and a
+    text always gets the same vector, in every process.
+    """
+
+    def __init__(self, size: int = 1536, ngram_size: int = 3):
+        """
+        Initialize the Local Embeddings.
+
+        Args:
+            size: the size of the vectors
+            ngram_size: the number of characters of the n-grams
+        """
+
+        self.size = size
+        self.ngram_size = ngram_size
+
+    def get_features(self, text: str) -> List[str]:
+        """This function returns the words and the character n-grams of a text.
+
+        Args:
+            text: the text
+        Returns:
+            the features
+        """
+
+        features = []
+        for word in text.lower().split():
+            features.append(word)
+
+            padded = f"<{word}>"
+            features += [padded[i:i + self.ngram_size] for i in range(len(padded) - self.ngram_size + 1)]
+
+        return features
+
+    def embed_text(self, text: str) -> np.ndarray:
+        """This function embeds a text.
+
+        Args:
+            text: the text
+        Returns:
+            the normalized vector
+        """
+
+        vector = np.zeros(self.size, dtype=np.float32)
+        for feature in self.get_features(text):
+            # Python's hash is salted per process, the vectors must not change
+            hash_value = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+            vector[hash_value % self.size] += 1.0 if hash_value >> 63 else -1.0
+
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            # Cosine distances are not defined for zero vectors
+            vector[0] = 1.0
+            return vector
+
+        return vector / norm
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """This function embeds texts.
+
+        Args:
+            texts: the texts
+        Returns:
+            the embeddings
+        """
+
+        return [self.embed_text(text).tolist() for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        """This function embeds a query.
+
+        Args:
+            text: the query
+        Returns:
+            the embedding
+        """
+
+        return self.embed_text(text).tolist()
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """This function embeds texts."""
+
+        return self.embed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """This function embeds a query."""
+
+        return self.embed_query(text)
+
+class LocalChatModel(BaseChatModel):
+    """This class represents a stub chat model, for tests and benchmarks.
+
+    The model answers with the words of the last message, up to response_tokens words,
+    a word standing for a token. It waits latency seconds before the first token and
+    then produces tokens_per_second tokens per second, like a deployed model would.
+    """
+
+    # The seconds before the first token
+    latency: float = 0.0
+    # The tokens produced per second, 0 for no delay
+    tokens_per_second: float = 0.0
+    # The largest number of tokens of an answer
+    response_tokens: int = 64
+
+    @property
+    def _llm_type(self) -> str:
+        """The type of the model."""
+
+        return 'local'
+
+    def get_tokens(self, messages: List[BaseMessage], stop: Optional[List[str]] = None) -> List[str]:
+        """This function returns the tokens of the answer to messages.
+
+        Args:
+            messages: the messages
+            stop: the words stopping the answer
+        Returns:
+            the tokens
+        """
+
+        words = messages[-1].content.split() if len(messages) > 0 else []
+
+        tokens = []
+        for word in words[:self.response_tokens]:
+            if stop and word in stop:
+                break
+            tokens.append(word)
+
+        return tokens
+
+    def _wait(self, seconds: float) -> None:
+        """This function simulates the time taken by the model."""
+
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def _generate(
+            self,
+            messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[CallbackManagerForLLMRun] = None,
+            **kwargs: Any
+        ) -> ChatResult:
+        """This function answers messages.
+
+        Args:
+            messages: the messages
+            stop: the words stopping the answer
+            run_manager: the callbacks of the run
+        Returns:
+            the answer
+        """
+
+        tokens = self.get_tokens(messages, stop)
+
+        self._wait(self.latency + (len(tokens) / self.tokens_per_second if self.tokens_per_second > 0 else 0))
+
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=" ".join(tokens)))],
+            llm_output={'token_usage': {'completion_tokens': len(tokens)}}
+        )
+
+    def _stream(
+            self,
+            messages: List[BaseMessage],
+            stop: Optional[List[str]] = None,
+            run_manager: Optional[CallbackManagerForLLMRun] = None,
+            **kwargs: Any
+        ) -> Iterator[ChatGenerationChunk]:
+        """This function streams the answer to messages, one token at a time.
+
+        Args:
+            messages: the messages
+            stop: the words stopping the answer
+            run_manager: the callbacks of the run
+        Returns:
+            the chunks of the answer
+        """
+
+        self._wait(self.latency)
+
+        for i, token in enumerate(self.get_tokens(messages, stop)):
+            if self.tokens_per_second > 0:
+                self._wait(1 / self.tokens_per_second)
+
+            token = token if i == 0 else f" {token}"
+            if run_manager:
+                run_manager.on_llm_new_token(token)
+
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
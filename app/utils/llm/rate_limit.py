@@ -0,0 +1,559 @@
+import time
+import random
+import asyncio
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+import openai
+
+logger = logging.getLogger(__name__)
+
+# The rate limiters of the process, one per deployment, shared by the chat and embeddings models
+_rate_limiters: Dict[str, "RateLimiter"] = {}
+_rate_limiters_lock = threading.Lock()
+
+# The seconds an asyncio caller sleeps before checking again for a free concurrency slot
+ASYNC_POLL_INTERVAL = 0.05
+
+class RateLimitExceeded(Exception):
+    """This exception is raised when a request would wait longer than the rate limiter allows."""
+
+class TokenBucket:
+    """This class represents a token bucket refilled at a fixed rate.
+
+    The bucket holds the budget of ten seconds, the window the quotas are enforced
+    over. A request larger than the bucket is let through once the bucket is full,
+    leaving the bucket in debt.
+    """
+
+    def __init__(self, per_minute: float):
+        """
+        Initialize the Token Bucket.
+
+        Args:
+            per_minute: the refill rate per minute
+        """
+
+        self.rate = per_minute / 60
+        self.capacity = max(per_minute / 6, 1.0)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        """This function adds the tokens refilled since the last update."""
+
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def get_wait(self, amount: float) -> float:
+        """This function returns the seconds before the bucket holds an amount, 0 if it holds it."""
+
+        needed = min(amount, self.capacity)
+
+        return 0.0 if self.level >= needed else (needed - self.level) / self.rate
+
+class RateLimiter:
+    """This class represents the scheduler of the requests to a deployment.
+
+    Every request waits for a slot under the requests-per-minute and tokens-per-minute
+    budgets and under a concurrency limit. The concurrency limit grows by one slot per
+    round of successful requests and halves when the deployment throttles, and the
+    requests are then paused for the retry-after time of the response. The requests
+    throttled or failing transiently are retried. A streamed response holds its slot
+    until it is read to the end or closed.
+
+    The Flask app is synchronous, so call blocks its worker thread while the request 
+    waits for a slot and between retries. Waiting and backing off together never take
+    longer than max_wait: a request that would wait longer raises RateLimitExceeded, 
+    which the API answers with a 429. acall waits on the event loop instead.
+    """
+
+    def __init__(
+            self,
+            deployment: str,
+            requests_per_minute: int = 0,
+            tokens_per_minute: int = 0,
+            max_concurrency: int = 16,
+            max_retries: int = 6,
+            max_wait: float = 60.0
+        ):
+        """
+        Initialize the Rate Limiter.
+
+        Args:
+            deployment: the deployment name
+            requests_per_minute: the requests per minute of the deployment, 0 for no limit
+            tokens_per_minute: the tokens per minute of the deployment, 0 for no limit
+            max_concurrency: the largest number of requests in flight
+            max_retries: the number of times a request is retried
+            max_wait: the longest a request waits for a slot and between its retries before RateLimitExceeded is raised
+        """
+
+        self.deployment = deployment
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute > 0 else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute > 0 else None
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.max_wait = max_wait
+
+        self.condition = threading.Condition()
+        self.concurrency_limit = float(max_concurrency)
+        self.in_flight = 0
+        self.queue_depth = 0
+        self.paused_until = 0.0
+        self.num_throttled = 0
+
+    def _try_acquire(self, tokens: int) -> Optional[float]:
+        """This function takes a slot for a request if one is free, with the condition held.
+
+        Args:
+            tokens: the estimated tokens of the request
+        Returns:
+            None if the slot was taken, otherwise the seconds to wait, or 0 to wait for a request to finish
+        """
+
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+
+        if self.in_flight >= max(int(self.concurrency_limit), 1):
+            return 0.0
+
+        wait = 0.0
+        for bucket, amount in [(self.requests, 1), (self.tokens, tokens)]:
+            if bucket is not None:
+                bucket.refill(now)
+                wait = max(wait, bucket.get_wait(amount))
+        if wait > 0:
+            return wait
+
+        if self.requests is not None:
+            self.requests.level -= 1
+        if self.tokens is not None:
+            self.tokens.level -= tokens
+        self.in_flight += 1
+
+        return None
+
+    def acquire(self, tokens: int = 0, deadline: Optional[float] = None) -> None:
+        """This function waits for a slot for a request, blocking the calling thread.
+
+        Args:
+            tokens: the estimated tokens of the request
+            deadline: the monotonic time after which RateLimitExceeded is raised, None for max_wait from now
+        Returns:
+            none
+        """
+
+        deadline = deadline if deadline is not None else time.monotonic() + self.max_wait
+
+        with self.condition:
+            self.queue_depth += 1
+            try:
+                while True:
+                    wait = self._try_acquire(tokens)
+                    if wait is None:
+                        return
+
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 or wait > remaining:
+                        raise RateLimitExceeded(f"Deployment '{self.deployment}' is over its rate limit, the request would wait too long")
+
+                    # A finishing request notifies the waiting ones
+                    self.condition.wait(wait if wait > 0 else remaining)
+            finally:
+                self.queue_depth -= 1
+
+    async def aacquire(self, tokens: int = 0, deadline: Optional[float] = None) -> None:
+        """This function waits for a slot for a request without blocking the event loop.
+
+        Args:
+            tokens: the estimated tokens of the request
+            deadline: the monotonic time after which RateLimitExceeded is raised, None for max_wait from now
+        Returns:
+            none
+        """
+
+        deadline = deadline if deadline is not None else time.monotonic() + self.max_wait
+
+        with self.condition:
+            self.queue_depth += 1
+        try:
+            while True:
+                with self.condition:
+                    wait = self._try_acquire(tokens)
+                if wait is None:
+                    return
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or wait > remaining:
+                    raise RateLimitExceeded(f"Deployment '{self.deployment}' is over its rate limit, the request would wait too long")
+
+                await asyncio.sleep(wait if wait > 0 else min(ASYNC_POLL_INTERVAL, remaining))
+        finally:
+            with self.condition:
+                self.queue_depth -= 1
+
+    def release(self, tokens: int = 0, used_tokens: Optional[int] = None, throttled: bool = False, retry_after: Optional[float] = None) -> None:
+        """This function frees the slot of a finished request and adapts the concurrency limit.
+
+        Args:
+            tokens: the estimated tokens of the request
+            used_tokens: the tokens the response reports, to correct the estimate
+            throttled: whether the deployment throttled the request
+            retry_after: the seconds the deployment asked to wait
+        Returns:
+            none
+        """
+
+        with self.condition:
+            self.in_flight -= 1
+
+            if self.tokens is not None and used_tokens is not None:
+                self.tokens.level = min(self.tokens.capacity, self.tokens.level + tokens - used_tokens)
+
+            now = time.monotonic()
+            if throttled:
+                self.num_throttled += 1
+                # The requests in flight when the deployment started throttling only decrease the limit once
+                if now >= self.paused_until:
+                    self.concurrency_limit = max(self.concurrency_limit / 2, 1.0)
+                    logger.warning(f"Deployment '{self.deployment}' throttled, concurrency limit lowered to {int(self.concurrency_limit)}")
+                self.paused_until = max(self.paused_until, now + (retry_after if retry_after is not None else 1.0))
+            else:
+                self.concurrency_limit = min(self.concurrency_limit + 1 / self.concurrency_limit, float(self.max_concurrency))
+
+            self.condition.notify_all()
+
+    def call(self, function: Callable[[], Any], tokens: int = 0, stream: bool = False) -> Any:
+        """This function sends a request when a slot is free, and retries it if it fails transiently.
+
+        The calling thread is blocked while it waits, see RateLimiter.
+
+        Args:
+            function: the function sending the request
+            tokens: the estimated tokens of the request
+            stream: whether the response is streamed, in which case it holds its slot until it is read or closed
+        Returns:
+            the response
+        """
+
+        deadline = time.monotonic() + self.max_wait
+
+        for attempt in range(self.max_retries + 1):
+            self.acquire(tokens, deadline)
+            try:
+                response = function()
+            except Exception as e:
+                delay = self._on_error(e, tokens, attempt, deadline)
+                if delay > 0:
+                    time.sleep(delay)
+                continue
+
+            if stream:
+                return RateLimitedStream(response, self, tokens)
+
+            self.release(tokens, get_used_tokens(response))
+            return response
+
+    async def acall(self, function: Callable[[], Any], tokens: int = 0, stream: bool = False) -> Any:
+        """This function sends an asyncio request when a slot is free, see call.
+
+        Args:
+            function: the function returning the awaitable request
+            tokens: the estimated tokens of the request
+            stream: whether the response is streamed, in which case it holds its slot until it is read or closed
+        Returns:
+            the response
+        """
+
+        deadline = time.monotonic() + self.max_wait
+
+        for attempt in range(self.max_retries + 1):
+            await self.aacquire(tokens, deadline)
+            try:
+                response = await function()
+            except Exception as e:
+                delay = self._on_error(e, tokens, attempt, deadline)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                continue
+
+            if stream:
+                return RateLimitedStream(response, self, tokens)
+
+            self.release(tokens, get_used_tokens(response))
+            return response
+
+    def _on_error(self, error: Exception, tokens: int, attempt: int, deadline: float) -> float:
+        """This function frees the slot of a failed request and raises the error unless the request is retried.
+
+        Args:
+            error: the error
+            tokens: the estimated tokens of the request
+            attempt: the number of times the request was retried
+            deadline: the monotonic time after which the request is not retried
+        Returns:
+            the seconds to wait before retrying, besides the pause of a throttled deployment
+        """
+
+        throttled, retryable, retry_after = classify_error(error)
+        self.release(tokens, throttled=throttled, retry_after=retry_after)
+
+        if not retryable or attempt >= self.max_retries:
+            raise error
+
+        # Throttled requests wait for the pause, the others back off exponentially with jitter
+        delay = 0.0 if throttled else random.uniform(0, min(2 ** attempt, 30))
+        if time.monotonic() + delay > deadline:
+            raise RateLimitExceeded(f"Deployment '{self.deployment}' keeps failing, the request would wait too long") from error
+
+        logger.info(f"Request to deployment '{self.deployment}' failed with '{error}', retrying")
+
+        return delay
+
+    def get_stats(self) -> Dict[str, Any]:
+        """This function returns the metrics of the rate limiter.
+
+        Returns:
+            the queue depth, the requests in flight, the concurrency limit and the number of throttled requests
+        """
+
+        with self.condition:
+            return {
+                'queue_depth': self.queue_depth,
+                'in_flight': self.in_flight,
+                'concurrency_limit': int(self.concurrency_limit),
+                'paused_for': max(self.paused_until - time.monotonic(), 0.0),
+                'num_throttled': self.num_throttled
+            }
+
+class RateLimitedStream:
+    """This class represents a streamed response holding the slot of its request.
+
+    The slot is freed once the response is read to the end, fails, or is closed, 
+    so the concurrency limit also covers the requests still streaming. A response
+    dropped without being closed frees its slot when it is garbage collected.
+    """
+
+    def __init__(self, response: Any, rate_limiter: RateLimiter, tokens: int):
+        """
+        Initialize the Rate Limited Stream.
+
+        Args:
+            response: the streamed response, an iterator or an asyncio iterator of chunks
+            rate_limiter: the rate limiter holding the slot
+            tokens: the estimated tokens of the request
+        """
+
+        self.response = response
+        self.rate_limiter = rate_limiter
+        self.tokens = tokens
+        self.released = False
+        self.lock = threading.Lock()
+
+    def __iter__(self) -> Iterator[Any]:
+        return self
+
+    def __next__(self) -> Any:
+        try:
+            return next(self.response)
+        except StopIteration:
+            self.close()
+            raise
+        except Exception as e:
+            self.close(e)
+            raise
+
+    def __aiter__(self) -> "RateLimitedStream":
+        return self
+
+    async def __anext__(self) -> Any:
+        try:
+            return await self.response.__anext__()
+        except StopAsyncIteration:
+            self.close()
+            raise
+        except Exception as e:
+            self.close(e)
+            raise
+
+    def close(self, error: Optional[Exception] = None) -> None:
+        """This function frees the slot of the request, once.
+
+        Args:
+            error: the error the response failed with, None if it did not fail
+        Returns:
+            none
+        """
+
+        with self.lock:
+            if self.released:
+                return
+            self.released = True
+
+        throttled, _, retry_after = classify_error(error) if error is not None else (False, False, None)
+        self.rate_limiter.release(self.tokens, throttled=throttled, retry_after=retry_after)
+
+        if error is None and hasattr(self.response, 'close'):
+            self.response.close()
+
+    def __del__(self) -> None:
+        self.close()
+
+def classify_error(error: Exception) -> Tuple[bool, bool, Optional[float]]:
+    """This function tells how to handle an error of the OpenAI API.
+
+    Args:
+        error: the error
+    Returns:
+        whether the deployment throttled the request, whether to retry it, and the seconds the deployment asked to wait
+    """
+
+    if isinstance(error, (openai.error.RateLimitError, openai.error.ServiceUnavailableError)):
+        return True, True, get_retry_after(getattr(error, 'headers', None))
+
+    if isinstance(error, (openai.error.Timeout, openai.error.APIConnectionError)):
+        return False, True, None
+
+    if isinstance(error, openai.error.APIError) and (error.http_status or 0) >= 500:
+        return False, True, None
+
+    return False, False, None
+
+def get_retry_after(headers: Optional[Dict[str, str]]) -> Optional[float]:
+    """This function reads the seconds to wait from the headers of a response.
+
+    Args:
+        headers: the headers
+    Returns:
+        the seconds, or None if the headers do not tell
+    """
+
+    if not headers:
+        return None
+
+    headers = {key.lower(): value for key, value in headers.items()}
+    for key, scale in [('retry-after-ms', 0.001), ('retry-after', 1.0)]:
+        try:
+            return float(headers[key]) * scale
+        except (KeyError, TypeError, ValueError):
+            continue
+
+    return None
+
+def get_used_tokens(response: Any) -> Optional[int]:
+    """This function reads the tokens used by a request from its response.
+
+    Args:
+        response: the response, streamed responses do not report their usage
+    Returns:
+        the tokens, or None if the response does not tell
+    """
+
+    try:
+        return int(response['usage']['total_tokens'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def get_rate_limiter(
+        deployment: str,
+        requests_per_minute: int = 0,
+        tokens_per_minute: int = 0,
+        max_concurrency: int = 16,
+        max_retries: int = 6,
+        max_wait: float = 60.0
+    ) -> RateLimiter:
+    """This function returns the rate limiter of a deployment, shared by the process.
+
+    Args:
+        deployment: the deployment name
+        requests_per_minute: the requests per minute of the deployment, only used by the first call
+        tokens_per_minute: the tokens per minute of the deployment, only used by the first call
+        max_concurrency: the largest number of requests in flight, only used by the first call
+        max_retries: the number of times a request is retried, only used by the first call
+        max_wait: the longest a request waits for a slot, only used by the first call
+    Returns:
+        the rate limiter
+    """
+
+    with _rate_limiters_lock:
+        rate_limiter = _rate_limiters.get(deployment)
+        if rate_limiter is None:
+            rate_limiter = _rate_limiters[deployment] = RateLimiter(
+                deployment, requests_per_minute, tokens_per_minute, max_concurrency, max_retries, max_wait
+            )
+
+        return rate_limiter
+
+def get_rate_limiter_stats() -> Dict[str, Dict[str, Any]]:
+    """This function returns the metrics of the rate limiter of every deployment.
+
+    Returns:
+        the metrics, by deployment
+    """
+
+    with _rate_limiters_lock:
+        rate_limiters = list(_rate_limiters.values())
+
+    return {rate_limiter.deployment: rate_limiter.get_stats() for rate_limiter in rate_limiters}
+
+class RateLimitedClient:
+    """This class represents an OpenAI API resource, such as openai.Embedding, sending its requests through a rate limiter.
+
+    It replaces the client of the langchain models, whose own retries are then disabled.
+    """
+
+    def __init__(self, client: Any, rate_limiter: RateLimiter, count_tokens: Callable[[str], int]):
+        """
+        Initialize the Rate Limited Client.
+
+        Args:
+            client: the OpenAI API resource
+            rate_limiter: the rate limiter of the deployment
+            count_tokens: the function counting the tokens of a text
+        """
+
+        self.client = client
+        self.rate_limiter = rate_limiter
+        self.count_tokens = count_tokens
+
+    def estimate_tokens(self, **kwargs: Any) -> int:
+        """This function estimates the tokens of a request, its input and the tokens it may generate.
+
+        Args:
+            kwargs: the arguments of the request
+        Returns:
+            the tokens
+        """
+
+        texts = [message.get('content') or '' for message in kwargs.get('messages', [])]
+
+        inputs = kwargs.get('input', [])
+        for item in inputs if isinstance(inputs, list) else [inputs]:
+            if isinstance(item, str):
+                texts.append(item)
+            elif isinstance(item, int):
+                # A single list of tokens
+                return len(inputs)
+            else:
+                texts.append(item)
+
+        tokens = sum(len(text) if isinstance(text, list) else self.count_tokens(text) for text in texts)
+
+        return tokens + int(kwargs.get('max_tokens') or 0)
+
+    def create(self, **kwargs: Any) -> Any:
+        """This function sends a request."""
+
+        return self.rate_limiter.call(
+            lambda: self.client.create(**kwargs), self.estimate_tokens(**kwargs), stream=bool(kwargs.get('stream'))
+        )
+
+    async def acreate(self, **kwargs: Any) -> Any:
+        """This function sends an asyncio request."""
+
+        return await self.rate_limiter.acall(
+            lambda: self.client.acreate(**kwargs), self.estimate_tokens(**kwargs), stream=bool(kwargs.get('stream'))
+        )
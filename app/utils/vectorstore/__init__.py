@@ -2,15 +2,16 @@ from typing import List
 
 from app.utils.vectorstore.base import BaseVectorStore
 from app.utils.vectorstore.faiss import FAISSExtended
-from app.utils.vectorstore.redis import RedisExtended
+from app.utils.vectorstore.redis import RedisExtended, AsyncRedisExtended
 from app.utils.llm import LLMHelper
 from app.config import Config
 
-def get_vector_store(config: Config) -> BaseVectorStore:
+def get_vector_store(config: Config, asynchronous: bool = False) -> BaseVectorStore:
     """This function Returns the vector store based on the config.
     
     Args:
         config: the config object
+        asynchronous: whether to return a store with asyncio searches, only for redis
     Returns:
         the vector store
     """
@@ -23,7 +24,7 @@ def get_vector_store(config: Config) -> BaseVectorStore:
         vector_store = FAISSExtended(config, embeddings)
 
     elif config.VECTOR_STORE_TYPE == 'redis':
-        vector_store = RedisExtended(config, embeddings)
+        vector_store = AsyncRedisExtended(config, embeddings) if asynchronous else RedisExtended(config, embeddings)
 
     else:
         raise ValueError('Vector store type not supported')
@@ -1,4 +1,5 @@
 import os
+import json
 import logging
 from typing import List, Optional, Dict, Any, Tuple
 import faiss
@@ -7,15 +8,44 @@ from langchain.docstore.document import Document
 from langchain.embeddings.base import Embeddings
 from langchain.docstore import InMemoryDocstore
 from langchain.vectorstores.azuresearch import AzureSearch as AzureSearch_TYPE
+from langchain.vectorstores.azuresearch import FIELDS_ID, FIELDS_CONTENT, FIELDS_METADATA, MAX_UPLOAD_BATCH_SIZE
 from langchain.vectorstores.base import VectorStoreRetriever
 
 from app.utils.vectorstore.base import BaseVectorStore
+from app.utils.vectorstore.metadata_index import get_sort_key, match_filter
 from app.config import Config
 
 logger = logging.getLogger(__name__)
 
 
+def get_search_text(filter: Dict[str, Any]) -> str:
+    """This function returns the full text query narrowing a search to the documents that may match a filter.
+
+    Langchain keeps the metadata of the documents as a JSON string in a single
+    searchable field, so the string values of the filter are searched, JSON-encoded
+    like the field, as phrases of that field. The other conditions are checked on 
+    the documents found.
+
+    Args:
+        filter: the filter, see MetadataIndex.search for its format
+    Returns:
+        the query in the simple query syntax
+    """
+
+    phrases = []
+    for condition in filter.values():
+        conditions = condition if isinstance(condition, list) else [condition]
+        if not conditions or not all(isinstance(value, str) and value.strip() for value in conditions):
+            continue
+
+        encoded = [json.dumps(value)[1:-1] for value in conditions]
+        quoted = ['"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"' for value in encoded]
+        phrases.append(quoted[0] if len(quoted) == 1 else f"({' | '.join(quoted)})")
+
+    return ' + '.join(phrases) if phrases else '*'
+
 class AzureSearch(BaseVectorStore):
+    """This class represents an Azure Search Vector Store."""
 
     def __init__(self, config: Config, embeddings: Embeddings):
         """This function initializes the Azure Search Vector Store."""
@@ -26,10 +56,32 @@ class AzureSearch(BaseVectorStore):
         self.azure_search_api_key = config.AZURE_SEARCH_API_KEY
 
 
-    def _get_langchain_azuresearch(self, index_name: str) -> AzureSearch_TYPE:
-        """This function returns a langchain azuresearch object."""
+    def _get_search_client(self, index_name: str):
+        """This function returns a search client of an index, which does not embed anything.
+
+        Args:
+            index_name: the index name
+        Returns:
+            the search client
+        """
+
+        from azure.core.credentials import AzureKeyCredential
+        from azure.identity import DefaultAzureCredential
+        from azure.search.documents import SearchClient
+
+        credential = AzureKeyCredential(self.azure_search_api_key) if self.azure_search_api_key else DefaultAzureCredential()
+        return SearchClient(endpoint=self.azure_search_endpoint, index_name=index_name, credential=credential)
+
+    def _get_langchain_azuresearch(self, index_name: str, embeddings: Optional[Dict[str, List[float]]] = None) -> AzureSearch_TYPE:
+        """This function returns a langchain azuresearch object.
+        
+        Langchain embeds the texts it adds one by one, so the embeddings of the texts 
+        can be given beforehand, computed in batches.
+        """
 
         embedding_fn = self.embeddings.embed_query
+        if embeddings:
+            embedding_fn = lambda text: embeddings[text] if text in embeddings else self.embeddings.embed_query(text)
         return AzureSearch_TYPE(
             azure_search_endpoint=self.azure_search_endpoint, 
             azure_search_key=self.azure_search_api_key, 
@@ -52,8 +104,11 @@ class AzureSearch(BaseVectorStore):
             none
         """
 
+        texts = [document.page_content for document in documents]
+        embeddings = dict(zip(texts, self.embeddings.embed_documents(texts)))
+
         # Get langchain azuresearch object
-        azure_search = self._get_langchain_azuresearch(index_name)
+        azure_search = self._get_langchain_azuresearch(index_name, embeddings)
 
         # Add documents
         azure_search.add_documents(documents)
@@ -64,7 +119,8 @@ class AzureSearch(BaseVectorStore):
             query: str, 
             k: int = 4, 
             filter: Optional[Dict[str, Any]] = None,
-            index_name: Optional[str] = None
+            index_name: Optional[str] = None,
+            score_threshold: Optional[float] = None
         ) -> List[Tuple[Document, float]]:
         """This function performs a similarity search.
         
@@ -72,6 +128,8 @@ class AzureSearch(BaseVectorStore):
             query: the query
             k: the number of results
             filter: the filter
+            index_name: the index name
+            score_threshold: the smallest relevance score of the docs, None for no threshold
         Returns:
             docs and relevance scores in the range [0, 1].
         """
@@ -80,5 +138,120 @@ class AzureSearch(BaseVectorStore):
         azure_search = self._get_langchain_azuresearch(index_name)
 
         # Perform similarity search
-        return azure_search.similarity_search_with_relevance_scores(query, k, filter=filter)
+        return azure_search.similarity_search_with_relevance_scores(query, k, filter=filter, score_threshold=score_threshold)
+
+    def query_by_filter(
+            self,
+            filter: Optional[Dict[str, Any]] = None,
+            sort_by: Optional[str] = None,
+            limit: Optional[int] = None,
+            descending: bool = False,
+            index_name: Optional[str] = None
+        ) -> List[Document]:
+        """This function returns the documents matching a filter, without embedding anything.
+
+        The documents are found with a full text search of the metadata field, see 
+        get_search_text, and compared with the filter, since the metadata of the 
+        documents cannot be filtered by Azure Search.
+        
+        Args:
+            filter: the filter, see MetadataIndex.search for its format
+            sort_by: the metadata key to sort the documents by
+            limit: the number of documents, None for all of them
+            descending: whether to sort in descending order
+            index_name: the index name
+        Returns:
+            the documents, with their key in the id metadata
+        """
+
+        from azure.core.exceptions import ResourceNotFoundError
+
+        results = self._get_search_client(index_name).search(
+            search_text=get_search_text(filter or {}),
+            search_fields=[FIELDS_METADATA],
+            search_mode="all",
+            select=[FIELDS_ID, FIELDS_CONTENT, FIELDS_METADATA]
+        )
+
+        documents = []
+        try:
+            for result in results:
+                metadata = json.loads(result[FIELDS_METADATA]) if result[FIELDS_METADATA] else {}
+                if filter and not match_filter(metadata, filter):
+                    continue
+
+                metadata["id"] = result[FIELDS_ID]
+                documents.append(Document(page_content=result[FIELDS_CONTENT], metadata=metadata))
+
+                # Without sorting, the search stops once the limit is reached
+                if sort_by is None and limit is not None and len(documents) == limit:
+                    return documents
+        except ResourceNotFoundError:
+            # Langchain creates an index when the first documents are added to it
+            logger.info(f"Index '{index_name}' does not exist yet, it has no documents")
+            return []
+
+        if sort_by is not None:
+            documents.sort(key=lambda doc: get_sort_key(doc.metadata.get(sort_by)), reverse=descending)
+            # Documents without the key come last in both orders
+            if descending:
+                documents.sort(key=lambda doc: get_sort_key(doc.metadata.get(sort_by))[0] == 2)
+
+        return documents[:limit] if limit is not None else documents
+
+    def delete_documents(
+            self, 
+            ids: Optional[List[str]] = None, 
+            filter: Optional[Dict[str, Any]] = None, 
+            index_name: Optional[str] = None
+        ) -> List[str]:
+        """This function deletes documents by key, or the documents matching a filter.
+
+        The keys of the documents matching the filter are found with query_by_filter, 
+        and the documents are deleted in batches.
+        
+        Args:
+            ids: the document keys, as returned in the id metadata by query_by_filter
+            filter: the filter, see MetadataIndex.search for its format
+            index_name: the index name
+        Returns:
+            the keys of the deleted documents
+        """
+
+        keys = list(ids or [])
+        if filter:
+            keys += [document.metadata["id"] for document in self.query_by_filter(filter, index_name=index_name)]
+
+        if len(keys) == 0:
+            return []
+
+        client = self._get_search_client(index_name)
+        deleted = []
+        for start in range(0, len(keys), MAX_UPLOAD_BATCH_SIZE):
+            results = client.delete_documents(documents=[{FIELDS_ID: key} for key in keys[start:start + MAX_UPLOAD_BATCH_SIZE]])
+            deleted += [result.key for result in results if result.succeeded]
+
+        return deleted
+
+    def get_index_stats(self, index_name: Optional[str] = None) -> Dict[str, int]:
+        """This function returns the size of an index.
+
+        Azure Search only counts the documents in the index, so the number of 
+        documents ever added to it is that count too, and the removed documents 
+        are not reported.
+        
+        Args:
+            index_name: the index name
+        Returns:
+            the number of documents in the index (num_docs), and the number of 
+            documents ever added to it (num_added)
+        """
+
+        from azure.core.exceptions import ResourceNotFoundError
+
+        try:
+            num_docs = self._get_search_client(index_name).get_document_count()
+        except ResourceNotFoundError:
+            num_docs = 0
 
+        return {'num_docs': num_docs, 'num_added': num_docs}
@@ -62,7 +62,8 @@ class BaseVectorStore:
             query: str, 
             k: int = 4, 
             filter: Optional[Dict[str, Any]] = None,
-            index_name: Optional[str] = None
+            index_name: Optional[str] = None,
+            score_threshold: Optional[float] = None
         ) -> List[Tuple[Document, float]]:
         """This function performs a similarity search.
         
@@ -70,10 +71,61 @@ class BaseVectorStore:
             query: the query
             k: the number of results
             filter: the filter
+            index_name: the index name
+            score_threshold: the smallest relevance score of the docs, None for no threshold
         Returns:
             docs and relevance scores in the range [0, 1].
         """
     
+    @abstractmethod
+    def query_by_filter(
+            self,
+            filter: Optional[Dict[str, Any]] = None,
+            sort_by: Optional[str] = None,
+            limit: Optional[int] = None,
+            descending: bool = False,
+            index_name: Optional[str] = None
+        ) -> List[Document]:
+        """This function returns the documents matching a filter, without embedding anything.
+        
+        Args:
+            filter: the filter
+            sort_by: the metadata key to sort the documents by
+            limit: the number of documents, None for all of them
+            descending: whether to sort in descending order
+            index_name: the index name
+        Returns:
+            the documents
+        """
+    
+    @abstractmethod
+    def delete_documents(
+            self, 
+            ids: Optional[List[str]] = None, 
+            filter: Optional[Dict[str, Any]] = None, 
+            index_name: Optional[str] = None
+        ) -> List[str]:
+        """This function deletes documents by id, or the documents matching a filter.
+        
+        Args:
+            ids: the document ids
+            filter: the filter
+            index_name: the index name
+        Returns:
+            the ids of the deleted documents
+        """
+    
+    @abstractmethod
+    def get_index_stats(self, index_name: Optional[str] = None) -> Dict[str, int]:
+        """This function returns the size of an index.
+        
+        Args:
+            index_name: the index name
+        Returns:
+            the number of documents in the index (num_docs), and the number of 
+            documents ever added to it (num_added)
+        """
+    
     @abstractmethod
     def check_existing_index(self, index_name: str = None) -> bool:
         """This function checks if the index exists.
@@ -0,0 +1,278 @@
+import os
+import json
+import mmap
+import array
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+
+from langchain.docstore.base import Docstore
+from langchain.docstore.document import Document
+
+logger = logging.getLogger(__name__)
+
+# Metadata keys stored in their own columns, the other metadata is stored as JSON
+SOURCE_KEY = 'source'
+CHUNK_ID_KEY = 'chunk_id'
+
+def mmap_file(file_path: str) -> Union[mmap.mmap, bytes]:
+    """This function memory-maps a file read-only.
+
+    Args:
+        file_path: the file
+    Returns:
+        the memory-mapped file, or empty bytes for an empty file, which cannot be memory-mapped
+    """
+
+    if os.path.getsize(file_path) == 0:
+        return b''
+
+    with open(file_path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+class MmapDocstore(Docstore):
+    """This class represents a columnar docstore backed by memory-mapped files.
+
+    The texts of the documents are stored in a blob file and their offsets in a second
+    file. The source of a document is an index into a table of the distinct sources,
+    its chunk id is an integer column, and the rest of its metadata is stored as JSON
+    in another blob. A document costs a few bytes besides its text, and loading only
+    maps the files.
+
+    The ids of the documents are their row numbers, so they match the positions in the
+    FAISS index they were saved with. Documents appended after loading are kept in
+    memory until the docstore is written again.
+    """
+
+    def __init__(
+            self,
+            texts: Union[mmap.mmap, bytes] = b'',
+            metadatas: Union[mmap.mmap, bytes] = b'',
+            offsets: Optional[np.ndarray] = None,
+            columns: Optional[np.ndarray] = None,
+            sources: Optional[List[str]] = None
+        ):
+        """
+        Initialize the Mmap Docstore.
+
+        Args:
+            texts: the UTF-8 texts
+            metadatas: the JSON metadata
+            offsets: the offsets of the texts and of the metadata, one more row than the number of documents
+            columns: the source index and the chunk id of every document, -1 if it has none
+            sources: the distinct sources
+        """
+
+        self.texts = texts
+        self.metadatas = metadatas
+        self.offsets = offsets if offsets is not None else np.zeros((1, 2), dtype=np.int64)
+        self.columns = columns if columns is not None else np.empty((0, 2), dtype=np.int64)
+        self.sources = list(sources or [])
+        self._source_ids = {source: i for i, source in enumerate(self.sources)}
+
+        # The documents appended since loading
+        self._appended_texts: List[str] = []
+        self._appended_metadatas: List[bytes] = []
+        self._appended_columns = array.array('q')
+
+    def __len__(self) -> int:
+        """The number of documents."""
+
+        return len(self.offsets) - 1 + len(self._appended_texts)
+
+    def search(self, search: Union[int, str]) -> Union[str, Document]:
+        """This function returns the document with the given row number.
+
+        Args:
+            search: the row number
+        Returns:
+            the document, or an error message if it does not exist
+        """
+
+        row = int(search)
+        if row < 0 or row >= len(self):
+            return f"ID {search} not found."
+
+        num_saved = len(self.offsets) - 1
+
+        if row >= num_saved:
+            row -= num_saved
+            text = self._appended_texts[row]
+            metadata = self._appended_metadatas[row]
+            source_id, chunk_id = self._appended_columns[2 * row], self._appended_columns[2 * row + 1]
+
+        elif self.offsets.ndim == 1:
+            # Older versions stored every document as a JSON record
+            record = json.loads(self.texts[self.offsets[row]:self.offsets[row + 1]])
+            return Document(page_content=record['page_content'], metadata=record['metadata'])
+
+        else:
+            (text_start, metadata_start), (text_end, metadata_end) = self.offsets[row], self.offsets[row + 1]
+            text = self.texts[text_start:text_end].decode('utf-8')
+            metadata = self.metadatas[metadata_start:metadata_end]
+            source_id, chunk_id = self.columns[row]
+
+        return Document(page_content=text, metadata=self._get_metadata(source_id, chunk_id, metadata))
+
+    def _get_metadata(self, source_id: int, chunk_id: int, metadata: bytes) -> Dict[str, Any]:
+        """This function puts the metadata of a document back together from its columns."""
+
+        document_metadata = {}
+        if source_id >= 0:
+            document_metadata[SOURCE_KEY] = self.sources[source_id]
+        if chunk_id >= 0:
+            document_metadata[CHUNK_ID_KEY] = int(chunk_id)
+        if metadata:
+            document_metadata.update(json.loads(metadata))
+
+        return document_metadata
+
+    def _split_metadata(self, metadata: Optional[Dict[str, Any]]) -> Tuple[int, int, bytes]:
+        """This function splits the metadata of a document into its columns, interning its source.
+
+        Args:
+            metadata: the metadata
+        Returns:
+            the source index, the chunk id and the JSON of the other metadata
+        """
+
+        metadata = dict(metadata or {})
+
+        source_id = -1
+        if isinstance(metadata.get(SOURCE_KEY), str):
+            source = metadata.pop(SOURCE_KEY)
+            source_id = self._source_ids.get(source)
+            if source_id is None:
+                source_id = self._source_ids[source] = len(self.sources)
+                self.sources.append(source)
+
+        chunk_id = -1
+        if type(metadata.get(CHUNK_ID_KEY)) is int and metadata[CHUNK_ID_KEY] >= 0:
+            chunk_id = metadata.pop(CHUNK_ID_KEY)
+
+        return source_id, chunk_id, json.dumps(metadata, ensure_ascii=False).encode('utf-8') if metadata else b''
+
+    def append(self, documents: Iterable[Document]) -> None:
+        """This function appends documents, which get the next row numbers.
+
+        Args:
+            documents: the documents
+        Returns:
+            none
+        """
+
+        for document in documents:
+            source_id, chunk_id, metadata = self._split_metadata(document.metadata)
+
+            self._appended_texts.append(document.page_content)
+            self._appended_metadatas.append(metadata)
+            self._appended_columns.extend((source_id, chunk_id))
+
+    @classmethod
+    def from_documents(cls, documents: Iterable[Document]) -> "MmapDocstore":
+        """This function returns a docstore holding documents in memory.
+
+        Args:
+            documents: the documents, in row order
+        Returns:
+            the docstore
+        """
+
+        docstore = cls()
+        docstore.append(documents)
+
+        return docstore
+
+    @classmethod
+    def load(cls, folder_path: str, name: str) -> "MmapDocstore":
+        """This function memory-maps a docstore saved in a folder.
+
+        Docstores saved by older versions, as one JSON record per document, are
+        read too.
+
+        Args:
+            folder_path: the folder
+            name: the name the docstore was saved with
+        Returns:
+            the docstore
+        """
+
+        texts = mmap_file(os.path.join(folder_path, f"{name}.docs"))
+        offsets = np.load(os.path.join(folder_path, f"{name}.docs.offsets.npy"), mmap_mode='r')
+
+        sources_file = os.path.join(folder_path, f"{name}.docs.sources.json")
+        if not os.path.exists(sources_file):
+            return cls(texts, offsets=offsets)
+
+        with open(sources_file) as f:
+            sources = json.load(f)
+
+        return cls(
+            texts,
+            mmap_file(os.path.join(folder_path, f"{name}.docs.meta")),
+            offsets=offsets,
+            columns=np.load(os.path.join(folder_path, f"{name}.docs.columns.npy"), mmap_mode='r'),
+            sources=sources
+        )
+
+    @staticmethod
+    def exists(folder_path: str, name: str) -> bool:
+        """This function checks if a docstore was saved in a folder.
+
+        Args:
+            folder_path: the folder
+            name: the name the docstore was saved with
+        Returns:
+            whether the docstore exists
+        """
+
+        return os.path.exists(os.path.join(folder_path, f"{name}.docs.offsets.npy"))
+
+    @classmethod
+    def write(cls, folder_path: str, name: str, documents: Iterable[Document]) -> None:
+        """This function writes documents to a folder in the docstore format.
+
+        The files are written next to the current ones and then moved over them,
+        so docstores that are already memory-mapped keep reading the old files.
+
+        Args:
+            folder_path: the folder
+            name: the name to save the docstore with
+            documents: the documents, in row order
+        Returns:
+            none
+        """
+
+        files = {
+            suffix: os.path.join(folder_path, f"{name}{suffix}")
+            for suffix in ['.docs', '.docs.meta', '.docs.offsets.npy', '.docs.columns.npy', '.docs.sources.json']
+        }
+
+        # Only used to intern the sources
+        docstore = cls()
+
+        offsets = array.array('q', [0, 0])
+        columns = array.array('q')
+        with open(f"{files['.docs']}.tmp", 'wb') as texts_file, open(f"{files['.docs.meta']}.tmp", 'wb') as metadatas_file:
+            for document in documents:
+                text = document.page_content.encode('utf-8')
+                source_id, chunk_id, metadata = docstore._split_metadata(document.metadata)
+
+                texts_file.write(text)
+                metadatas_file.write(metadata)
+                offsets.extend((offsets[-2] + len(text), offsets[-1] + len(metadata)))
+                columns.extend((source_id, chunk_id))
+
+        with open(f"{files['.docs.offsets.npy']}.tmp", 'wb') as f:
+            np.save(f, np.frombuffer(offsets, dtype=np.int64).reshape(-1, 2))
+
+        with open(f"{files['.docs.columns.npy']}.tmp", 'wb') as f:
+            np.save(f, np.frombuffer(columns, dtype=np.int64).reshape(-1, 2))
+
+        with open(f"{files['.docs.sources.json']}.tmp", 'w') as f:
+            json.dump(docstore.sources, f, ensure_ascii=False)
+
+        # The offsets are moved last, they mark the docstore as saved
+        for suffix in ['.docs', '.docs.meta', '.docs.columns.npy', '.docs.sources.json', '.docs.offsets.npy']:
+            os.replace(f"{files[suffix]}.tmp", files[suffix])
@@ -1,21 +1,1262 @@
 import os
+import re
+import json
+import copy
+import time
+import uuid
+import pickle
 import logging
-from typing import List, Optional, Dict, Any, Tuple
+import functools
+import threading
+from contextlib import contextmanager
+from typing import List, Optional, Dict, Any, Tuple, Iterable, Iterator, Callable
 import faiss
+import numpy as np
 
 from langchain.docstore.document import Document
 from langchain.embeddings.base import Embeddings
-from langchain.docstore import InMemoryDocstore
 from langchain.vectorstores import FAISS as FAISS_TYPE
 from langchain.vectorstores.base import VectorStoreRetriever
+from langchain.vectorstores.utils import DistanceStrategy
 
 from app.utils.vectorstore.base import BaseVectorStore
+from app.utils.vectorstore.docstore import MmapDocstore
+from app.utils.vectorstore.metadata_index import MetadataIndex, get_sort_key
+from app.utils.vectorstore.wal import WriteAheadLog
 from app.config import Config
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_INDEX_NAME = "index"
+GENERATION_FILE_SUFFIX = ".generation"
+
+# FAISS indexes do not expire texts by themselves, the time a text added with a TTL
+# expires at is kept in its metadata under this key, so that it can be deleted by filter
+EXPIRES_AT_KEY = "expires_at"
+
+# The files saved for an index are named after the index with these suffixes
+INDEX_FILE_SUFFIXES = [
+    ".faiss", ".pkl", ".docs", ".docs.meta", ".docs.offsets.npy", ".docs.columns.npy", ".docs.sources.json", 
+    ".vectors.npy", ".meta.json", ".meta.npy", ".settings.json", ".tombstones.npy", ".wal", GENERATION_FILE_SUFFIX
+]
+
+# The FAISS metric of each distance metric, and whether vectors are normalized when they are added
+DISTANCE_METRICS = {
+    'L2': (faiss.METRIC_L2, False),
+    'IP': (faiss.METRIC_INNER_PRODUCT, False),
+    'COSINE': (faiss.METRIC_INNER_PRODUCT, True),
+}
+
+# Indexes loaded from disk are shared by every FAISSExtended in the process. The key is
+# (absolute folder path, index name, memory-mapped) and the value is the FAISSIndex, whose
+# generation tells which files it is in sync with. Texts added to a writable resident index
+# are seen by every FAISSExtended using it, even before they are saved.
+_resident_indexes: Dict[Tuple[str, str, bool], "FAISSIndex"] = {}
+_resident_indexes_lock = threading.RLock()
+
+# The background compactions running, keyed by folder and index name
+_compactions: Dict[Tuple[str, str], threading.Thread] = {}
+
+# The lock of each index, keyed by folder and index name, see get_index_lock
+_index_locks: Dict[Tuple[str, str], threading.RLock] = {}
+
+def get_index_lock(file_path: str, index_name: str) -> threading.RLock:
+    """This function returns the lock held to change an index or to load it from disk.
+
+    Adding, deleting, saving, rebuilding and compacting an index hold its lock, so 
+    they only wait for each other and never for the other indexes. The process-wide 
+    _resident_indexes_lock is only held to look up and swap the resident indexes.
+
+    Args:
+        file_path: the folder of the FAISS files
+        index_name: the index name
+    Returns:
+        the lock
+    """
+
+    with _resident_indexes_lock:
+        return _index_locks.setdefault((os.path.abspath(file_path), index_name), threading.RLock())
+
+def get_index_name(index_name: Optional[str] = None) -> str:
+    """This function validates an index name, which is also used to name its files.
+
+    Args:
+        index_name: the index name, None for the default index
+    Returns:
+        the index name
+    """
+
+    if index_name is None:
+        return DEFAULT_INDEX_NAME
+
+    if not re.fullmatch(r'[\w\-]+', index_name):
+        raise ValueError(f"Index name '{index_name}' may only contain letters, digits, '_' and '-'.")
+
+    return index_name
+
+def index_exists(file_path: str, index_name: str) -> bool:
+    """This function checks if an index was saved in a folder.
+
+    Args:
+        file_path: the folder of the FAISS files
+        index_name: the index name
+    Returns:
+        whether the index exists
+    """
+
+    return os.path.exists(os.path.join(file_path, f"{index_name}.faiss"))
+
+def get_generation(file_path: str, index_name: str) -> Optional[str]:
+    """This function returns the generation of the files of an index.
+
+    The generation is the random stamp written by every snapshot, followed by the 
+    size of the write-ahead log. Indexes saved without a stamp fall back to the 
+    modification time and size of the index file.
+
+    Args:
+        file_path: the folder of the FAISS files
+        index_name: the index name
+    Returns:
+        the generation, or None if the folder has no index
+    """
+
+    wal_size = WriteAheadLog(file_path, index_name).size()
+
+    generation_file = os.path.join(file_path, f"{index_name}{GENERATION_FILE_SUFFIX}")
+    if os.path.exists(generation_file):
+        with open(generation_file, 'r') as f:
+            return f"{f.read().strip()}:{wal_size}"
+
+    index_file = os.path.join(file_path, f"{index_name}.faiss")
+    if os.path.exists(index_file):
+        stat = os.stat(index_file)
+        return f"{stat.st_mtime_ns}-{stat.st_size}:{wal_size}"
+
+    return None
+
+def get_distance_metric(distance_metric: str) -> Tuple[int, bool]:
+    """This function returns the FAISS metric of a distance metric.
+
+    COSINE indexes use inner product on vectors normalized when they are added, 
+    so their scores are the cosine similarities.
+
+    Args:
+        distance_metric: the distance metric, one of L2, IP and COSINE
+    Returns:
+        the FAISS metric type and whether vectors need to be normalized
+    """
+
+    if distance_metric.upper() not in DISTANCE_METRICS:
+        raise ValueError(f"Distance metric '{distance_metric}' not supported, use one of {list(DISTANCE_METRICS)}")
+
+    return DISTANCE_METRICS[distance_metric.upper()]
+
+def get_ivf_nlist(config: Config, num_vectors: int) -> int:
+    """This function returns the number of IVF lists to train for a number of vectors.
+
+    FAISS needs about 39 training vectors per list, so small indexes get fewer
+    lists than FAISS_IVF_NLIST.
+
+    Args:
+        config: the config object
+        num_vectors: the number of vectors in the index
+    Returns:
+        the number of IVF lists
+    """
+
+    return max(1, min(config.FAISS_IVF_NLIST, num_vectors // 39))
+
+def get_vector_encoding(config: Config) -> str:
+    """This function returns how the configured index encodes its vectors.
+    
+    Args:
+        config: the config object
+    Returns:
+        one of float32, fp16, sq8 or pq
+    """
+
+    if config.FAISS_INDEX_TYPE == 'ivfpq':
+        return 'pq'
+
+    return config.FAISS_VECTOR_ENCODING
+
+def build_faiss_index(
+        config: Config, 
+        dimension: int, 
+        num_vectors: int = 0, 
+        metric: int = faiss.METRIC_L2
+    ) -> faiss.Index:
+    """This function builds an empty FAISS index of the configured FAISS_INDEX_TYPE.
+
+    The vectors are stored as configured by FAISS_VECTOR_ENCODING. Indexes that 
+    need training (ivf, ivfpq, sq8 and pq) are returned untrained.
+
+    Args:
+        config: the config object
+        dimension: the embedding size
+        num_vectors: the number of vectors the index will be trained with
+        metric: the FAISS metric type
+    Returns:
+        the FAISS index
+    """
+
+    index_type = config.FAISS_INDEX_TYPE
+    vector_encoding = get_vector_encoding(config)
+
+    if vector_encoding == 'float32':
+        encoding_description = 'Flat'
+    elif vector_encoding == 'fp16':
+        encoding_description = 'SQfp16'
+    elif vector_encoding == 'sq8':
+        encoding_description = 'SQ8'
+    elif vector_encoding == 'pq':
+        encoding_description = f'PQ{config.FAISS_PQ_M}x{config.FAISS_PQ_NBITS}'
+    else:
+        raise ValueError(f"FAISS vector encoding '{vector_encoding}' is not supported.")
+
+    if index_type == 'flat':
+        description = encoding_description
+    elif index_type in ['ivf', 'ivfpq']:
+        description = f'IVF{get_ivf_nlist(config, num_vectors)},{encoding_description}'
+    elif index_type == 'hnsw':
+        # HNSW only supports 8 bit PQ codes
+        if vector_encoding == 'pq':
+            encoding_description = f'PQ{config.FAISS_PQ_M}'
+        description = f'HNSW{config.FAISS_HNSW_M},{encoding_description}'
+    else:
+        raise ValueError(f"FAISS index type '{index_type}' is not supported.")
+
+    index = faiss.index_factory(dimension, description, metric)
+
+    if index_type == 'hnsw':
+        faiss.downcast_index(index).hnsw.efConstruction = config.FAISS_HNSW_EF_CONSTRUCTION
+
+    set_search_parameters(config, index)
+
+    return index
+
+def get_inner_index(index: faiss.Index) -> faiss.Index:
+    """This function returns the index an IndexIDMap2 wraps, or the index itself if it is not wrapped.
+
+    The inner index addresses vectors by their position, which is what search
+    parameters and reconstruction need.
+
+    Args:
+        index: the FAISS index
+    Returns:
+        the inner index
+    """
+
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.downcast_index(index.index)
+
+    return index
+
+def get_labels(index: faiss.Index) -> np.ndarray:
+    """This function returns the label of every vector of an index, in insertion order.
+
+    Indexes saved by older versions are not wrapped in an IndexIDMap2, their 
+    labels are the positions of the vectors.
+
+    Args:
+        index: the FAISS index
+    Returns:
+        the labels
+    """
+
+    if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        return faiss.vector_to_array(index.id_map).astype(np.int64)
+
+    return np.arange(index.ntotal, dtype=np.int64)
+
+def set_search_parameters(config: Config, index: faiss.Index) -> None:
+    """This function sets the configured nprobe or efSearch on an index.
+    
+    Args:
+        config: the config object
+        index: the FAISS index
+    Returns:
+        none
+    """
+
+    ivf_index = faiss.try_extract_index_ivf(index)
+    if ivf_index is not None:
+        ivf_index.nprobe = min(config.FAISS_IVF_NPROBE, ivf_index.nlist)
+
+    downcasted_index = faiss.downcast_index(get_inner_index(index))
+    if isinstance(downcasted_index, faiss.IndexHNSW):
+        downcasted_index.hnsw.efSearch = config.FAISS_HNSW_EF_SEARCH
+
+def reconstruct_vectors(index: faiss.Index) -> np.ndarray:
+    """This function returns all the vectors stored in an index, in insertion order.
+
+    Vectors are decoded from the index codes, so they are approximate for 
+    quantized indexes.
+
+    Args:
+        index: the FAISS index
+    Returns:
+        the vectors
+    """
+
+    index = get_inner_index(index)
+
+    ivf_index = faiss.try_extract_index_ivf(index)
+    if ivf_index is not None:
+        ivf_index.make_direct_map()
+
+    return index.reconstruct_n(0, index.ntotal)
+
+def evaluate_vector_encodings(
+        config: Config,
+        vectors: np.ndarray,
+        queries: np.ndarray,
+        k: int = 10,
+        encodings: Iterable[str] = ('float32', 'fp16', 'sq8', 'pq'),
+        metric: int = faiss.METRIC_L2,
+        rerank_factor: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+    """This function reports the memory used and the recall lost by each vector encoding.
+
+    Every encoding is built with the configured index type and compared against an 
+    exact search over the same vectors. The recall is also measured after re-ranking
+    rerank_factor times k candidates with float16 vectors. Encodings that cannot be
+    trained on so few vectors are left out.
+
+    Args:
+        config: the config object
+        vectors: the vectors to index
+        queries: the query vectors
+        k: the number of results per query
+        encodings: the vector encodings to compare
+        metric: the FAISS metric type
+        rerank_factor: the number of candidates per result, defaults to FAISS_RERANK_FACTOR or 4
+    Returns:
+        one row per encoding with bytes_per_vector, memory_ratio, recall and recall_reranked
+    """
+
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    num_vectors, dimension = vectors.shape
+
+    exact_index = faiss.IndexFlat(dimension, metric)
+    exact_index.add(vectors)
+    _, ground_truth = exact_index.search(queries, k)
+
+    if rerank_factor is None:
+        rerank_factor = config.FAISS_RERANK_FACTOR if config.FAISS_RERANK_FACTOR > 0 else 4
+    rerank_vectors = vectors.astype(np.float16).astype(np.float32)
+
+    def get_recall(results: np.ndarray) -> float:
+        hits = sum(len(set(result[:k]) & set(truth)) for result, truth in zip(results, ground_truth))
+        return hits / (k * len(queries))
+
+    report = []
+    for encoding in encodings:
+        encoding_config = copy.copy(config)
+        encoding_config.FAISS_VECTOR_ENCODING = encoding
+        if config.FAISS_INDEX_TYPE == 'ivfpq':
+            encoding_config.FAISS_INDEX_TYPE = 'ivf'
+
+        index = build_faiss_index(encoding_config, dimension, num_vectors, metric=metric)
+        try:
+            if not index.is_trained:
+                index.train(vectors)
+        except RuntimeError as e:
+            logger.warning(f"Skipping FAISS vector encoding '{encoding}': {e}")
+            continue
+        index.add(vectors)
+
+        _, results = index.search(queries, k)
+        _, candidates = index.search(queries, k * rerank_factor)
+
+        reranked_results = []
+        for query, candidate in zip(queries, candidates):
+            candidate = candidate[candidate != -1]
+            if metric == faiss.METRIC_INNER_PRODUCT:
+                order = np.argsort(-(rerank_vectors[candidate] @ query))
+            else:
+                order = np.argsort(((rerank_vectors[candidate] - query) ** 2).sum(axis=1))
+            reranked_results.append(candidate[order])
+
+        bytes_per_vector = len(faiss.serialize_index(index)) / num_vectors
+
+        report.append({
+            'encoding': encoding,
+            'bytes_per_vector': bytes_per_vector,
+            'memory_ratio': bytes_per_vector / (dimension * 4),
+            'recall': get_recall(results),
+            'recall_reranked': get_recall(reranked_results)
+        })
+
+    return report
+
+class ReadWriteLock:
+    """This class represents a lock held by many readers or by a single writer.
+
+    The writer may take the lock again, or read while it writes. Readers never
+    wait for each other, so a thread may read while it already reads.
+    """
+
+    def __init__(self):
+        """
+        Initialize the Read Write Lock.
+        """
+
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer: Optional[int] = None
+        self._writes = 0
+
+    @contextmanager
+    def read(self) -> Iterator[None]:
+        """This function holds the lock for reading."""
+
+        thread = threading.get_ident()
+        with self._condition:
+            while self._writer is not None and self._writer != thread:
+                self._condition.wait()
+            self._readers += 1
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                self._condition.notify_all()
+
+    @contextmanager
+    def write(self) -> Iterator[None]:
+        """This function holds the lock for writing, once the readers are done."""
+
+        thread = threading.get_ident()
+        with self._condition:
+            if self._writer != thread:
+                while self._writer is not None or self._readers > 0:
+                    self._condition.wait()
+                self._writer = thread
+            self._writes += 1
+
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writes -= 1
+                if self._writes == 0:
+                    self._writer = None
+                self._condition.notify_all()
+
+def read_locked(method: Callable) -> Callable:
+    """This decorator runs a method of an index holding the lock of the index for reading."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args: Any, **kwargs: Any) -> Any:
+        with self.lock.read():
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+def write_locked(method: Callable) -> Callable:
+    """This decorator runs a method of an index holding the lock of the index for writing."""
+
+    @functools.wraps(method)
+    def wrapper(self, *args: Any, **kwargs: Any) -> Any:
+        with self.lock.write():
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+class FAISSIndex(FAISS_TYPE):
+    """This class represents a single FAISS index with its docstore.
+    
+    It extends the langchain FAISS vector store with an optional side store of float16 
+    vectors, which is saved next to the index and memory-mapped when loaded. When the 
+    index is quantized, search fetches rerank_factor times more candidates and re-ranks 
+    them with exact distances computed from the side store.
+
+    Filters are resolved with an inverted metadata index before searching. Small 
+    matching subsets are scored exactly, larger ones restrict the index search 
+    through a FAISS id selector.
+
+    Inner product indexes return their scores as relevance scores, without converting them.
+
+    Vectors are wrapped in an IndexIDMap2, so every vector keeps the label it was
+    added with. The docstore, the side store and the metadata index address vectors
+    by their position in the inner index. Deleted vectors are tombstoned and left
+    out of searches until the index is compacted.
+
+    Resident indexes are shared by the threads of the process, so texts are added
+    and deleted holding the lock of the index for writing, and searches, rebuilds
+    and saves hold it for reading.
+
+    On disk, an index is a snapshot plus a write-ahead log of the changes made since.
+    Writable indexes replay the log into themselves. Read-only indexes cannot be 
+    added to, so they replay it into a small in-memory delta index, which is
+    searched along with them.
+    """
+
+    def __init__(
+            self, 
+            *args: Any, 
+            rerank_vectors: Optional[np.ndarray] = None, 
+            rerank_factor: int = 0, 
+            metadata_index: Optional[MetadataIndex] = None,
+            exact_filter_limit: int = 0,
+            read_only: bool = False,
+            tombstones: Optional[np.ndarray] = None,
+            next_id: Optional[int] = None,
+            **kwargs: Any
+        ):
+        """
+        Initialize the FAISS Index.
+
+        Args:
+            rerank_vectors: the side store vectors, or None to not keep a side store
+            rerank_factor: the number of candidates to re-rank per result, 0 disables re-ranking
+            metadata_index: the metadata index, or None to build it from the docstore
+            exact_filter_limit: the largest number of filtered vectors scored exactly
+            read_only: whether the index was loaded read-only
+            tombstones: the sorted positions of the deleted vectors
+            next_id: the label of the next vector added, None for one past the largest label
+        """
+
+        super().__init__(*args, **kwargs)
+
+        self.lock = ReadWriteLock()
+
+        # Added vectors are kept in chunks and only concatenated when they are needed
+        self._rerank_vectors = [rerank_vectors] if rerank_vectors is not None else None
+        self.rerank_factor = rerank_factor
+        self._metadata_index = metadata_index
+        self.exact_filter_limit = exact_filter_limit
+
+        # Set after initializing, langchain warns about normalized inner product indexes
+        if self.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            self.distance_strategy = DistanceStrategy.MAX_INNER_PRODUCT
+
+        self.read_only = read_only
+        self.delta: Optional[FAISSIndex] = None
+
+        self._labels: Optional[np.ndarray] = None
+        self.tombstones = tombstones if tombstones is not None else np.empty(0, dtype=np.int64)
+        if next_id is None:
+            labels = self.labels
+            next_id = int(labels[-1]) + 1 if len(labels) > 0 else 0
+        self.next_id = next_id
+
+        # The files the index is in sync with, and the write-ahead log records made since
+        self.snapshot_id: Optional[str] = None
+        self.wal_size = 0
+        self.unsaved: List[Dict[str, Any]] = []
+        self.snapshot_needed = False
+
+        # The index rebuilt from this one, which every FAISSExtended holding this one moves to
+        self.replaced_by: Optional[FAISSIndex] = None
+
+    @property
+    def generation(self) -> Optional[str]:
+        """The generation of the files the index is in sync with, see get_generation."""
+
+        if self.snapshot_id is None:
+            return None
+
+        return f"{self.snapshot_id}:{self.wal_size}"
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        """This function returns the function turning the scores of the index into relevance scores."""
+
+        if self.override_relevance_score_fn is None and self.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            return lambda score: score
+
+        return super()._select_relevance_score_fn()
+
+    @property
+    def rerank_vectors(self) -> Optional[np.ndarray]:
+        """The side store vectors, in the same order as the index."""
+
+        if self._rerank_vectors is None:
+            return None
+
+        if len(self._rerank_vectors) > 1:
+            self._rerank_vectors = [np.concatenate(self._rerank_vectors)]
+
+        return self._rerank_vectors[0]
+
+    @property
+    def metadata_index(self) -> MetadataIndex:
+        """The metadata index of the vectors, built from the docstore the first time it is needed."""
+
+        if self._metadata_index is None:
+            self._metadata_index = MetadataIndex()
+            self._metadata_index.add(
+                0, 
+                (self.docstore.search(self.index_to_docstore_id[i]).metadata for i in range(self.index.ntotal))
+            )
+
+        return self._metadata_index
+
+    @property
+    def labels(self) -> np.ndarray:
+        """The label of every vector, in the same order as the index. Labels only ever increase."""
+
+        if self._labels is None or len(self._labels) != self.index.ntotal:
+            self._labels = get_labels(self.index)
+
+        return self._labels
+
+    @property
+    def tombstone_ratio(self) -> float:
+        """The share of the vectors of the index that are deleted."""
+
+        return len(self.tombstones) / self.index.ntotal if self.index.ntotal > 0 else 0.0
+
+    def add_texts(
+            self,
+            texts: Iterable[str],
+            metadatas: Optional[List[dict]] = None,
+            ids: Optional[List[str]] = None,
+            **kwargs: Any,
+        ) -> List[str]:
+        """This function embeds and adds texts, making sure they also go into the side store."""
+
+        texts = list(texts)
+
+        # The embedding function is the embed_query of the embeddings model, embed_documents sends batches
+        embeddings_model = getattr(self.embedding_function, '__self__', None)
+        if isinstance(embeddings_model, Embeddings):
+            embeddings = embeddings_model.embed_documents(texts)
+        else:
+            embeddings = [self.embedding_function(text) for text in texts]
+        return self.add_embeddings(zip(texts, embeddings), metadatas=metadatas, ids=ids)
+
+    @write_locked
+    def add_embeddings(
+            self,
+            text_embeddings: Iterable[Tuple[str, List[float]]],
+            metadatas: Optional[List[dict]] = None,
+            ids: Optional[List[str]] = None,
+            **kwargs: Any,
+        ) -> List[str]:
+        """This function adds texts with their embeddings, keeping them for the write-ahead log if the index is saved.
+
+        The index assigns the ids, which are the labels of the vectors.
+        """
+
+        if ids is not None:
+            raise ValueError("FAISS indexes assign the ids of the texts they add.")
+
+        text_embeddings = list(text_embeddings)
+        metadatas = metadatas or [{} for _ in text_embeddings]
+
+        ids = self._add_embeddings(text_embeddings, metadatas=metadatas)
+
+        if self.snapshot_id is not None:
+            self.unsaved.append({
+                'op': 'add',
+                'texts': [text for text, _ in text_embeddings],
+                'metadatas': metadatas,
+                'vectors': np.array([embedding for _, embedding in text_embeddings], dtype=np.float32),
+                'ids': [int(id) for id in ids]
+            })
+
+        return ids
+
+    def _add_embeddings(
+            self,
+            text_embeddings: List[Tuple[str, List[float]]],
+            metadatas: List[dict],
+            labels: Optional[List[int]] = None
+        ) -> List[str]:
+        """This function adds texts with their embeddings to the index, the docstore, the side store and the metadata index.
+
+        Args:
+            text_embeddings: the texts and their embeddings
+            metadatas: the metadata of the texts
+            labels: the labels of the vectors, None to assign the next ones
+        Returns:
+            the ids of the texts
+        """
+
+        if len(text_embeddings) == 0:
+            return []
+
+        metadata_index = self.metadata_index
+        start = self.index.ntotal
+
+        vectors = np.array([embedding for _, embedding in text_embeddings], dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(vectors)
+
+        if labels is None:
+            labels = np.arange(self.next_id, self.next_id + len(vectors), dtype=np.int64)
+        labels = np.asarray(labels, dtype=np.int64)
+
+        if isinstance(self.index, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+            self.index.add_with_ids(vectors, labels)
+        else:
+            # Indexes saved by older versions are labelled by position until they are compacted
+            self.index.add(vectors)
+
+        self.docstore.append(
+            Document(page_content=text, metadata=metadata) for (text, _), metadata in zip(text_embeddings, metadatas)
+        )
+        self.index_to_docstore_id = range(len(self.docstore))
+
+        metadata_index.add(start, metadatas)
+
+        if self._rerank_vectors is not None:
+            self._rerank_vectors.append(vectors.astype(np.float16))
+
+        self.next_id = max(self.next_id, int(labels[-1]) + 1)
+
+        return [str(label) for label in labels]
+
+    @write_locked
+    def delete(
+            self,
+            ids: Optional[List[str]] = None,
+            filter: Optional[Dict[str, Any]] = None,
+            **kwargs: Any
+        ) -> List[str]:
+        """This function deletes texts by id, or the texts matching a filter.
+
+        The vectors are tombstoned, they stay in the index until it is compacted.
+
+        Args:
+            ids: the ids returned when the texts were added
+            filter: the filter, see MetadataIndex.search for its format
+        Returns:
+            the ids of the deleted texts
+        """
+
+        if self.read_only:
+            raise ValueError("An index loaded read-only cannot be deleted from, load it writable.")
+
+        labels = np.asarray([int(id) for id in ids or []], dtype=np.int64)
+        if filter:
+            labels = np.union1d(labels, self.labels[self.metadata_index.search(filter)])
+
+        labels = self._delete(labels)
+
+        if len(labels) > 0 and self.snapshot_id is not None:
+            self.unsaved.append({
+                'op': 'delete',
+                'texts': [],
+                'metadatas': [],
+                'vectors': np.empty((0, self.index.d), dtype=np.float32),
+                'ids': labels.tolist()
+            })
+
+        return [str(label) for label in labels]
+
+    def _delete(self, labels: np.ndarray) -> np.ndarray:
+        """This function tombstones the vectors with some labels, ignoring the labels the index does not have.
+
+        Args:
+            labels: the labels
+        Returns:
+            the labels of the vectors tombstoned
+        """
+
+        rows = np.setdiff1d(self._get_rows(labels), self.tombstones)
+        self.tombstones = np.union1d(self.tombstones, rows).astype(np.int64)
+
+        return self.labels[rows]
+
+    def _get_rows(self, labels: np.ndarray) -> np.ndarray:
+        """This function returns the positions of the vectors with some labels.
+
+        Args:
+            labels: the labels
+        Returns:
+            the sorted positions of the labels found
+        """
+
+        all_labels = self.labels
+        labels = np.asarray(labels, dtype=np.int64)
+
+        rows = np.searchsorted(all_labels, labels)
+        found = rows < len(all_labels)
+        found[found] = all_labels[rows[found]] == labels[found]
+
+        return np.unique(rows[found])
+
+    @read_locked
+    def rebuild(self, index: faiss.Index, vectors: np.ndarray, rows: np.ndarray) -> "FAISSIndex":
+        """This function returns a copy of the index holding some of its vectors in a new index, leaving out the others.
+
+        The vectors keep their labels, so their ids do not change. The docstore, the
+        side store and the metadata index are rebuilt for the new positions, and the
+        copy has no tombstones. The index itself is left untouched, so it can still 
+        be searched while the copy is built.
+
+        Args:
+            index: the new empty, trained index
+            vectors: the vectors to add to it
+            rows: the positions of the vectors in the current index
+        Returns:
+            the new index
+        """
+
+        labels = self.labels[rows]
+        documents = [self.docstore.search(self.index_to_docstore_id[row]) for row in rows]
+
+        new_index = faiss.IndexIDMap2(index)
+        new_index.add_with_ids(np.ascontiguousarray(vectors, dtype=np.float32), labels)
+
+        metadata_index = MetadataIndex()
+        metadata_index.add(0, (document.metadata for document in documents))
+
+        vector_store = FAISSIndex(
+            self.embedding_function,
+            new_index,
+            MmapDocstore.from_documents(documents),
+            range(len(documents)),
+            rerank_vectors=np.asarray(vectors, dtype=np.float16) if self._rerank_vectors is not None else None,
+            rerank_factor=self.rerank_factor,
+            metadata_index=metadata_index,
+            exact_filter_limit=self.exact_filter_limit,
+            next_id=self.next_id,
+            relevance_score_fn=self.override_relevance_score_fn,
+            normalize_L2=self._normalize_L2
+        )
+
+        # The records not in the log yet are kept, the next save writes a snapshot with them
+        vector_store.snapshot_id = self.snapshot_id
+        vector_store.wal_size = self.wal_size
+        vector_store.unsaved = list(self.unsaved)
+        vector_store.snapshot_needed = True
+
+        return vector_store
+
+    @write_locked
+    def replay_wal(self, folder_path: str, index_name: str) -> None:
+        """This function applies the records of the write-ahead log the index has not seen yet.
+
+        Args:
+            folder_path: the folder
+            index_name: the name the index was saved with
+        Returns:
+            none
+        """
+
+        wal = WriteAheadLog(folder_path, index_name)
+
+        for record in wal.read(offset=self.wal_size):
+            if record['op'] == 'delete':
+                labels = np.asarray(record['ids'], dtype=np.int64)
+                self._delete(labels)
+                if self.delta is not None:
+                    self.delta._delete(labels)
+                continue
+
+            target = self
+            if self.read_only:
+                if self.delta is None:
+                    self.delta = FAISSIndex(
+                        self.embedding_function, 
+                        faiss.IndexIDMap2(faiss.IndexFlat(self.index.d, self.index.metric_type)),
+                        MmapDocstore(), 
+                        range(0), 
+                        exact_filter_limit=self.exact_filter_limit,
+                        next_id=self.next_id,
+                        normalize_L2=self._normalize_L2
+                    )
+                target = self.delta
+
+            target._add_embeddings(
+                list(zip(record['texts'], record['vectors'])),
+                metadatas=record['metadatas'],
+                labels=record.get('ids')
+            )
+
+        self.wal_size = wal.valid_size
+
+    @read_locked
+    def similarity_search_with_score_by_vector(
+            self,
+            embedding: List[float],
+            k: int = 4,
+            filter: Optional[Dict[str, Any]] = None,
+            fetch_k: int = 20,
+            **kwargs: Any,
+        ) -> List[Tuple[Document, float]]:
+        """This function returns the docs most similar to the embedding with their distance.
+
+        A filter is applied before searching, see MetadataIndex.search for its format. 
+        Candidates are re-ranked with the side store when re-ranking is enabled.
+        The delta index of a read-only index is searched too.
+        """
+
+        docs = self._similarity_search_with_score_by_vector(embedding, k, filter=filter, fetch_k=fetch_k, **kwargs)
+
+        if self.delta is None:
+            return docs
+
+        docs += self.delta.similarity_search_with_score_by_vector(embedding, k, filter=filter, fetch_k=fetch_k, **kwargs)
+        docs.sort(key=lambda doc: doc[1], reverse=self.index.metric_type == faiss.METRIC_INNER_PRODUCT)
+
+        return docs[:k]
+
+    def _similarity_search_with_score_by_vector(
+            self,
+            embedding: List[float],
+            k: int = 4,
+            filter: Optional[Dict[str, Any]] = None,
+            fetch_k: int = 20,
+            **kwargs: Any,
+        ) -> List[Tuple[Document, float]]:
+        """This function searches the index itself, without its delta index.
+
+        The inner index is searched, so the results are positions rather than labels.
+        """
+
+        # Empty indexes loaded memory-mapped return a label for every result
+        if self.index.ntotal == 0:
+            return []
+
+        rerank_vectors = self.rerank_vectors
+        rerank = self.rerank_factor > 0 and rerank_vectors is not None and len(rerank_vectors) == self.index.ntotal
+
+        vector = np.array([embedding], dtype=np.float32)
+        if self._normalize_L2:
+            faiss.normalize_L2(vector)
+
+        num_candidates = k * self.rerank_factor if rerank else k
+
+        if not filter:
+            # The selectors must stay alive for as long as the search
+            tombstones = self.tombstones
+            deleted_selector = selector = None
+            if len(tombstones) > 0:
+                deleted_selector = faiss.IDSelectorBatch(len(tombstones), faiss.swig_ptr(tombstones))
+                selector = faiss.IDSelectorNot(deleted_selector)
+
+            indices, scores = self._search(vector, num_candidates, selector)
+            if rerank:
+                indices, scores = self._score(vector[0], indices)
+
+        else:
+            ids = self.metadata_index.search(filter)
+            if len(self.tombstones) > 0:
+                ids = np.setdiff1d(ids, self.tombstones, assume_unique=True)
+
+            if len(ids) <= self.exact_filter_limit:
+                # Scoring the matching vectors costs less than searching the index
+                indices, scores = self._score(vector[0], ids, k)
+
+            else:
+                selector = faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids))
+                indices, scores = self._search(vector, num_candidates, selector)
+                if rerank:
+                    indices, scores = self._score(vector[0], indices)
+
+        score_threshold = kwargs.get("score_threshold")
+
+        docs = []
+        for i, score in zip(indices, scores):
+            doc = self.docstore.search(self.index_to_docstore_id[i])
+            if not isinstance(doc, Document):
+                raise ValueError(f"Could not find document for index {i}, got {doc}")
+
+            if score_threshold is not None:
+                if self.index.metric_type == faiss.METRIC_INNER_PRODUCT and score < score_threshold:
+                    continue
+                if self.index.metric_type != faiss.METRIC_INNER_PRODUCT and score > score_threshold:
+                    continue
+
+            docs.append((doc, float(score)))
+
+            if len(docs) == k:
+                break
+
+        return docs
+
+    @read_locked
+    def query_by_filter(
+            self,
+            filter: Optional[Dict[str, Any]] = None,
+            sort_by: Optional[str] = None,
+            limit: Optional[int] = None,
+            descending: bool = False
+        ) -> List[Document]:
+        """This function returns the docs matching a filter, without searching the vectors.
+
+        The filter is resolved with the metadata index. A few docs are sorted by
+        their metadata, more are sorted by walking the metadata index. The delta 
+        index of a read-only index is queried too.
+
+        Args:
+            filter: the filter, see MetadataIndex.search for its format, None to match every doc
+            sort_by: the metadata key to sort the docs by, None to keep them in insertion order
+            limit: the number of docs to return, None for all of them
+            descending: whether to sort in descending order
+        Returns:
+            the docs
+        """
+
+        rows = self.metadata_index.search(filter) if filter else np.arange(len(self.docstore), dtype=np.int64)
+        if len(self.tombstones) > 0:
+            rows = np.setdiff1d(rows, self.tombstones, assume_unique=True)
+
+        if sort_by is not None and len(rows) > self.exact_filter_limit:
+            rows = self.metadata_index.sort(rows, sort_by, descending=descending, limit=limit)
+
+        docs = []
+        for row in rows:
+            doc = self.docstore.search(self.index_to_docstore_id[row])
+            if not isinstance(doc, Document):
+                raise ValueError(f"Could not find document for index {row}, got {doc}")
+            docs.append(doc)
+
+        if self.delta is not None:
+            docs += self.delta.query_by_filter(filter, sort_by, limit, descending)
+
+        if sort_by is not None:
+            docs.sort(key=lambda doc: get_sort_key(doc.metadata.get(sort_by)), reverse=descending)
+            # Docs without the key come last in both orders
+            if descending:
+                docs.sort(key=lambda doc: get_sort_key(doc.metadata.get(sort_by))[0] == 2)
+
+        return docs[:limit] if limit is not None else docs
+
+    def _search(
+            self,
+            vector: np.ndarray,
+            k: int,
+            selector: Optional[faiss.IDSelector] = None
+        ) -> Tuple[np.ndarray, np.ndarray]:
+        """This function searches the inner index, restricted to a selector of positions.
+
+        Args:
+            vector: the query vectors, a single row
+            k: the number of results
+            selector: the selector, None to search every vector
+        Returns:
+            the positions found and their scores
+        """
+
+        # The inner index belongs to the index, which must stay alive for as long as the search
+        index = self.index
+        params = self._search_parameters(selector) if selector is not None else None
+        distances, indices = get_inner_index(index).search(vector, k, params=params)
+
+        found = indices[0] != -1
+
+        return indices[0][found], distances[0][found]
+
+    def _score(self, vector: np.ndarray, ids: np.ndarray, k: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """This function scores vectors of the index exactly and sorts them by score.
+
+        The vectors come from the side store when it is complete, otherwise they 
+        are reconstructed from the index.
+
+        Args:
+            vector: the query vector
+            ids: the positions of the vectors
+            k: the number of best vectors to return, None for all of them
+        Returns:
+            the sorted positions and their scores
+        """
+
+        rerank_vectors = self.rerank_vectors
+        if len(ids) == 0:
+            candidates = np.empty((0, self.index.d), dtype=np.float32)
+        elif rerank_vectors is not None and len(rerank_vectors) == self.index.ntotal:
+            candidates = np.asarray(rerank_vectors[ids], dtype=np.float32)
+        else:
+            index = self.index
+            inner_index = get_inner_index(index)
+            ivf_index = faiss.try_extract_index_ivf(inner_index)
+            if ivf_index is not None and ivf_index.direct_map.type == faiss.DirectMap.NoMap:
+                ivf_index.make_direct_map()
+            candidates = inner_index.reconstruct_batch(np.ascontiguousarray(ids, dtype=np.int64))
+
+        if self.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            scores = -(candidates @ vector)
+        else:
+            scores = ((candidates - vector) ** 2).sum(axis=1)
+
+        if k is not None and k < len(scores):
+            best = np.argpartition(scores, k)[:k]
+            order = best[np.argsort(scores[best])]
+        else:
+            order = np.argsort(scores)
+
+        if self.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            scores = -scores
+
+        return ids[order], scores[order]
+
+    def _search_parameters(self, selector: faiss.IDSelector) -> faiss.SearchParameters:
+        """This function returns the search parameters restricting a search of the inner index to a selector.
+
+        The parameters set on the index are carried over, since search parameters
+        replace them.
+        """
+
+        index = get_inner_index(self.index)
+
+        ivf_index = faiss.try_extract_index_ivf(index)
+        if ivf_index is not None:
+            return faiss.SearchParametersIVF(sel=selector, nprobe=ivf_index.nprobe)
+
+        if isinstance(index, faiss.IndexHNSW):
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=index.hnsw.efSearch)
+
+        return faiss.SearchParameters(sel=selector)
+
+    @read_locked
+    def save_local(self, folder_path: str, index_name: str = "index") -> None:
+        """This function saves a snapshot of the index, the docstore and the side store to a folder.
+        
+        Every file is written next to the current one and then moved over it, so 
+        indexes that are already memory-mapped keep reading the old files. The 
+        write-ahead log is removed, since the snapshot holds its records.
+        """
+
+        if self.delta is not None:
+            raise ValueError("An index loaded read-only with a write-ahead log cannot be saved, load it writable.")
+
+        os.makedirs(folder_path, exist_ok=True)
+
+        index_file = os.path.join(folder_path, f"{index_name}.faiss")
+        faiss.write_index(self.index, f"{index_file}.tmp")
+        os.replace(f"{index_file}.tmp", index_file)
+
+        MmapDocstore.write(
+            folder_path, 
+            index_name, 
+            (self.docstore.search(self.index_to_docstore_id[i]) for i in range(self.index.ntotal))
+        )
+        self.metadata_index.save(folder_path, index_name)
+
+        settings_file = os.path.join(folder_path, f"{index_name}.settings.json")
+        with open(f"{settings_file}.tmp", 'w') as f:
+            json.dump({'normalize_L2': self._normalize_L2, 'next_id': self.next_id}, f)
+        os.replace(f"{settings_file}.tmp", settings_file)
+
+        # Remove the pickled docstore written by older versions
+        pickle_file = os.path.join(folder_path, f"{index_name}.pkl")
+        if os.path.exists(pickle_file):
+            os.remove(pickle_file)
+
+        rerank_vectors = self.rerank_vectors
+        if rerank_vectors is not None:
+            vectors_file = os.path.join(folder_path, f"{index_name}.vectors.npy")
+            with open(f"{vectors_file}.tmp", 'wb') as f:
+                np.save(f, rerank_vectors)
+            os.replace(f"{vectors_file}.tmp", vectors_file)
+
+        tombstones_file = os.path.join(folder_path, f"{index_name}.tombstones.npy")
+        if len(self.tombstones) > 0:
+            with open(f"{tombstones_file}.tmp", 'wb') as f:
+                np.save(f, self.tombstones)
+            os.replace(f"{tombstones_file}.tmp", tombstones_file)
+        elif os.path.exists(tombstones_file):
+            os.remove(tombstones_file)
+
+        WriteAheadLog(folder_path, index_name).remove()
+
+        self.wal_size = 0
+        self.unsaved = []
+        self.snapshot_needed = False
+
+    @read_locked
+    def append_wal(self, folder_path: str, index_name: str = "index") -> None:
+        """This function appends the changes made since the index was last saved to the write-ahead log.
+
+        Args:
+            folder_path: the folder
+            index_name: the name the index was saved with
+        Returns:
+            none
+        """
+
+        wal = WriteAheadLog(folder_path, index_name)
+
+        for record in self.unsaved:
+            wal.append(record['texts'], record['metadatas'], record['vectors'], op=record['op'], ids=record['ids'])
+
+        self.wal_size = wal.size()
+        self.unsaved = []
+
+    @classmethod
+    def load_local(
+            cls, 
+            folder_path: str, 
+            embeddings: Embeddings, 
+            index_name: str = "index", 
+            read_only: bool = False,
+            **kwargs: Any
+        ) -> "FAISSIndex":
+        """This function loads the index, the docstore and the side store from a folder, and replays the write-ahead log.
+
+        A read-only index memory-maps its inverted lists, so processes serving the 
+        same files share one copy in the page cache. FAISS can only memory-map IVF 
+        indexes, flat and HNSW indexes are still read into memory. A writable index 
+        reads its vectors into memory so that texts can be added. The docstore is 
+        always memory-mapped.
+
+        Args:
+            folder_path: the folder
+            embeddings: the embeddings model
+            index_name: the name the index was saved with
+            read_only: whether to load the index memory-mapped and read-only
+        Returns:
+            the index
+        """
+
+        index_file = os.path.join(folder_path, f"{index_name}.faiss")
+        if read_only:
+            index = faiss.read_index(index_file, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+        else:
+            index = faiss.read_index(index_file)
+
+        if MmapDocstore.exists(folder_path, index_name):
+            docstore = MmapDocstore.load(folder_path, index_name)
+
+        else:
+            # Older versions pickled the docstore
+            with open(os.path.join(folder_path, f"{index_name}.pkl"), "rb") as f:
+                pickled_docstore, pickled_ids = pickle.load(f)
+            docstore = MmapDocstore.from_documents(pickled_docstore.search(pickled_ids[i]) for i in range(index.ntotal))
+
+        # The docstore ids are the positions in the index
+        index_to_docstore_id = range(len(docstore))
+
+        vectors_file = os.path.join(folder_path, f"{index_name}.vectors.npy")
+        if os.path.exists(vectors_file):
+            kwargs['rerank_vectors'] = np.load(vectors_file, mmap_mode='r')
+
+        if MetadataIndex.exists(folder_path, index_name):
+            kwargs['metadata_index'] = MetadataIndex.load(folder_path, index_name)
+
+        tombstones_file = os.path.join(folder_path, f"{index_name}.tombstones.npy")
+        if os.path.exists(tombstones_file):
+            kwargs['tombstones'] = np.load(tombstones_file)
+
+        settings_file = os.path.join(folder_path, f"{index_name}.settings.json")
+        if os.path.exists(settings_file):
+            with open(settings_file) as f:
+                settings = json.load(f)
+            kwargs['normalize_L2'] = settings['normalize_L2']
+            kwargs['next_id'] = settings.get('next_id')
+
+        vector_store = cls(embeddings.embed_query, index, docstore, index_to_docstore_id, read_only=read_only, **kwargs)
+        vector_store.replay_wal(folder_path, index_name)
+
+        return vector_store
+
 class FAISSExtended(BaseVectorStore):
-    """This class represents a FAISS Vector Store."""
+    """This class represents a FAISS Vector Store.
+    
+    Every index name has its own FAISS index, saved in FAISS_LOCAL_FILE_INDEX as 
+    files named after the index. Indexes are loaded lazily the first time they are used.
+
+    Older versions kept every document in the default index, with a pickled docstore.
+    That index is converted to the current format the first time it is loaded writable.
+    """
 
     def __init__(self, config: Config, embeddings: Embeddings):
         """
@@ -28,31 +1269,252 @@ class FAISSExtended(BaseVectorStore):
 
         super().__init__(config, embeddings)
 
-        # initialize the vector store
-        embedding_size = config.OPENAI_EMBEDDING_SIZE
-        index = faiss.IndexFlatL2(embedding_size)
-        embedding_fn = embeddings.embed_query
-        self.vector_store  = FAISS_TYPE(embedding_fn, index, InMemoryDocstore({}), {})
+        # The indexes in memory, keyed by index name
+        self.vector_stores: Dict[str, FAISSIndex] = {}
 
         # texts = ["FAISS"]
         # self.vector_store = FAISS_TYPE.from_texts(texts, embeddings)
 
-    def load_local(self, file_path: str) -> None:
-        """This function loads the vector store from a local file."""
+    def _new_vector_store(self, distance_metric: Optional[str] = None) -> FAISSIndex:
+        """This function returns a new empty index.
+        
+        Args:
+            distance_metric: the distance metric, None for FAISS_DISTANCE_METRIC
+        Returns:
+            the index
+        """
+
+        metric, normalize_L2 = get_distance_metric(distance_metric or self.config.FAISS_DISTANCE_METRIC)
+
+        # New indexes start flat until they are trained
+        embedding_size = self.config.OPENAI_EMBEDDING_SIZE
+        index = faiss.IndexIDMap2(faiss.IndexFlat(embedding_size, metric))
+        embedding_fn = self.embeddings.embed_query
+
+        # Keep a side store for re-ranking if the vectors are going to be quantized
+        rerank_vectors = None
+        if self.config.FAISS_RERANK_FACTOR > 0 and get_vector_encoding(self.config) != 'float32':
+            rerank_vectors = np.empty((0, embedding_size), dtype=np.float16)
+
+        return FAISSIndex(
+            embedding_fn, 
+            index, 
+            MmapDocstore(), 
+            range(0), 
+            rerank_vectors=rerank_vectors,
+            rerank_factor=self.config.FAISS_RERANK_FACTOR,
+            exact_filter_limit=self.config.FAISS_EXACT_FILTER_LIMIT,
+            normalize_L2=normalize_L2
+        )
+
+    def _get_vector_store(self, index_name: Optional[str] = None, create: bool = False) -> FAISSIndex:
+        """This function returns the index in memory, loading it if needed.
+        
+        Args:
+            index_name: the index name, None for the default index
+            create: whether to create the index if it does not exist
+        Returns:
+            the index
+        """
+
+        index_name = get_index_name(index_name)
+
+        if index_name not in self.vector_stores:
+            if index_exists(self.config.FAISS_LOCAL_FILE_INDEX, index_name):
+                self.load_local(self.config.FAISS_LOCAL_FILE_INDEX, index_name=index_name)
+            elif create:
+                self.vector_stores[index_name] = self._new_vector_store()
+            else:
+                raise ValueError(f"Index '{index_name}' does not exist.")
+
+        # The resident index may have been rebuilt by another FAISSExtended, or by a compaction
+        vector_store = self.vector_stores[index_name]
+        while vector_store.replaced_by is not None:
+            vector_store = vector_store.replaced_by
+        self.vector_stores[index_name] = vector_store
+
+        return vector_store
+
+    def load_local(self, file_path: str, read_only: bool = False, index_name: Optional[str] = None) -> None:
+        """This function loads an index from a local file.
+
+        When FAISS_RESIDENT_INDEX is enabled, the loaded index stays in memory and
+        is only read again when the generation on disk changes. An index that does 
+        not exist is created and saved, unless the caller only searches it, so that
+        searching never writes to the folder.
+
+        Args:
+            file_path: the folder of the FAISS files
+            read_only: whether the caller only searches the index, in which case it
+                is memory-mapped if FAISS_MMAP_INDEX is enabled
+            index_name: the index name, None for the default index
+        """
+
+        index_name = get_index_name(index_name)
 
         # Check if the file exists
-        if os.path.exists(file_path):
-            logger.info(f"FAISS local file '{file_path}' exists, loading it")
-            self.vector_store = FAISS_TYPE.load_local(file_path, self.embeddings)
+        if not index_exists(file_path, index_name) and read_only:
+            logger.info(f"FAISS index '{index_name}' does not exist in '{file_path}', it is searched as an empty index")
+            return
 
-        else:
-            logger.warning(f"FAISS local file '{file_path}' does not exist, creating a new one")
-            self.vector_store.save_local(file_path)
+        if not index_exists(file_path, index_name):
+            logger.warning(f"FAISS index '{index_name}' does not exist in '{file_path}', creating a new one")
+            self._get_vector_store(index_name, create=True)
+            self.save_local(file_path, index_name=index_name)
+            return
+
+        # Older versions pickled the docstore, the index is saved once in the current format
+        if not read_only and os.path.exists(os.path.join(file_path, f"{index_name}.pkl")):
+            with get_index_lock(file_path, index_name):
+                if os.path.exists(os.path.join(file_path, f"{index_name}.pkl")):
+                    logger.info(f"FAISS index '{index_name}' in '{file_path}' was saved by an older version, converting it")
+                    self.vector_stores[index_name] = self._read_local(file_path, index_name)
+                    self.save_local(file_path, index_name=index_name, snapshot=True)
+
+        mmap_index = read_only and self.config.FAISS_MMAP_INDEX
+
+        if not self.config.FAISS_RESIDENT_INDEX:
+            logger.info(f"FAISS index '{index_name}' exists in '{file_path}', loading it")
+            self.vector_stores[index_name] = self._read_local(file_path, index_name, mmap_index)
+            return
+
+        key = (os.path.abspath(file_path), index_name, mmap_index)
+        index_lock = get_index_lock(file_path, index_name)
+
+        if not index_lock.acquire(blocking=False):
+            # Another thread is changing the index, the resident index is searched meanwhile
+            with _resident_indexes_lock:
+                vector_store = _resident_indexes.get(key)
+            if vector_store is not None:
+                logger.debug(f"FAISS index '{index_name}' in '{file_path}' is being changed, using the resident index")
+                self.vector_stores[index_name] = vector_store
+                return
+
+            index_lock.acquire()
+
+        try:
+            generation = get_generation(file_path, index_name)
+            with _resident_indexes_lock:
+                vector_store = _resident_indexes.get(key)
+
+            if vector_store is not None and vector_store.generation != generation \
+                    and vector_store.snapshot_id == generation.split(':')[0] and not vector_store.unsaved:
+                logger.info(f"FAISS index '{index_name}' in '{file_path}' is resident, reading its write-ahead log")
+                vector_store.replay_wal(file_path, index_name)
+
+            if vector_store is not None and vector_store.generation == generation:
+                logger.debug(f"FAISS index '{index_name}' in '{file_path}' is resident, generation {generation}")
+                self.vector_stores[index_name] = vector_store
+                return
+
+            logger.info(f"FAISS index '{index_name}' exists in '{file_path}', loading generation {generation}")
+            self.vector_stores[index_name] = self._read_local(file_path, index_name, mmap_index)
+            with _resident_indexes_lock:
+                _resident_indexes[key] = self.vector_stores[index_name]
+        finally:
+            index_lock.release()
+
+    def _read_local(self, file_path: str, index_name: str, mmap_index: bool = False) -> FAISSIndex:
+        """This function reads an index from a local file and applies the search config."""
+
+        # Read before the files, so that a snapshot written meanwhile is noticed
+        generation = get_generation(file_path, index_name)
+
+        vector_store = FAISSIndex.load_local(
+            file_path, 
+            self.embeddings, 
+            index_name=index_name,
+            read_only=mmap_index, 
+            rerank_factor=self.config.FAISS_RERANK_FACTOR,
+            exact_filter_limit=self.config.FAISS_EXACT_FILTER_LIMIT
+        )
+        set_search_parameters(self.config, vector_store.index)
+        vector_store.snapshot_id = generation.split(':')[0]
+
+        return vector_store
+
+    def save_local(self, file_path: str, index_name: Optional[str] = None, snapshot: bool = False) -> None:
+        """This function saves an index to a local file.
+
+        When FAISS_WAL is enabled and the files are still the ones the index was 
+        loaded from or saved to, only the texts added since are appended to the 
+        write-ahead log. Otherwise a snapshot of the whole index is written, followed 
+        by a new generation stamp, so that other processes holding the index resident 
+        know they need to reload it. Once the log outgrows FAISS_WAL_MAX_SIZE, or 
+        more than FAISS_TOMBSTONE_RATIO of the vectors are deleted, the index is 
+        compacted into a new snapshot in the background, see compact_index.
+
+        Args:
+            file_path: the folder of the FAISS files
+            index_name: the index name, None for the default index
+            snapshot: whether to write a snapshot even if the log could be appended to
+        """
+
+        index_name = get_index_name(index_name)
+        key = (os.path.abspath(file_path), index_name)
+
+        with get_index_lock(file_path, index_name):
+            vector_store = self._get_vector_store(index_name, create=True)
+            append = self.config.FAISS_WAL and not snapshot and not vector_store.snapshot_needed \
+                and vector_store.generation is not None and vector_store.generation == get_generation(file_path, index_name)
+
+            if append:
+                vector_store.append_wal(file_path, index_name)
+
+            else:
+                vector_store.save_local(file_path, index_name)
+
+                vector_store.snapshot_id = uuid.uuid4().hex
+                generation_file = os.path.join(file_path, f"{index_name}{GENERATION_FILE_SUFFIX}")
+                with open(f"{generation_file}.tmp", 'w') as f:
+                    f.write(vector_store.snapshot_id)
+                os.replace(f"{generation_file}.tmp", generation_file)
+
+            if self.config.FAISS_RESIDENT_INDEX and not vector_store.read_only:
+                with _resident_indexes_lock:
+                    _resident_indexes[key + (False,)] = vector_store
+
+            compact = False
+            if append and vector_store.wal_size > self.config.FAISS_WAL_MAX_SIZE:
+                logger.info(f"FAISS index '{index_name}' write-ahead log reached {vector_store.wal_size} bytes, compacting it")
+                compact = True
+            if not vector_store.read_only and vector_store.tombstone_ratio > self.config.FAISS_TOMBSTONE_RATIO:
+                logger.info(f"FAISS index '{index_name}' has {vector_store.tombstone_ratio:.1%} of its vectors deleted, compacting it")
+                compact = True
+
+            with _resident_indexes_lock:
+                compaction = _compactions.get(key)
+                if compact and (compaction is None or not compaction.is_alive()):
+                    _compactions[key] = threading.Thread(
+                        target=self.compact_index, 
+                        args=(file_path, index_name), 
+                        name=f"faiss-compaction-{index_name}"
+                    )
+                    _compactions[key].start()
+
+    def compact_index(self, file_path: str, index_name: Optional[str] = None) -> None:
+        """This function compacts an index into a new snapshot.
 
-    def save_local(self, file_path: str) -> None:
-        """This function saves the vector store to a local file."""
+        Deleted vectors are dropped from the index first if more than 
+        FAISS_TOMBSTONE_RATIO of them are deleted. The index keeps its trained
+        quantizer, so the remaining vectors are only encoded again. Only the lock 
+        of the index is held, so the other indexes are not blocked, and searches
+        of the index keep using its resident copy, see load_local.
 
-        self.vector_store.save_local(file_path)
+        Args:
+            file_path: the folder of the FAISS files
+            index_name: the index name, None for the default index
+        Returns:
+            none
+        """
+
+        with get_index_lock(file_path, get_index_name(index_name)):
+            vector_store = self._get_vector_store(index_name)
+
+            if vector_store.tombstone_ratio > self.config.FAISS_TOMBSTONE_RATIO:
+                self.rebuild_index(index_name, retrain=False)
+
+            self.save_local(file_path, index_name, snapshot=True)
 
     def add_documents(
             self, 
@@ -69,11 +1531,9 @@ class FAISSExtended(BaseVectorStore):
             none
         """
 
-        logger.warning('FAISS does not support index_name parameter')
-
         texts = [document.page_content for document in documents]
         metadatas = [document.metadata for document in documents]
-        self.add_texts(texts=texts, metadatas=metadatas)
+        self.add_texts(texts=texts, metadatas=metadatas, index_name=index_name)
 
     def add_texts(
             self, 
@@ -83,25 +1543,154 @@ class FAISSExtended(BaseVectorStore):
             **kwargs: Any
         ) -> None:
         """This function adds texts to the vector store.
+
+        The index is created if it does not exist yet. Texts added with a TTL get
+        the time they expire at in their EXPIRES_AT_KEY metadata, and stay in the 
+        index until they are deleted with a filter on it.
         
         Args:
             texts: the texts to add
+            metadatas: the metadata of the texts
             index_name: the index name
+            ttl: the seconds after which the texts expire, None to keep them
         Returns:
             none
         """
-        # # Load the local file
-        # self.load_local(self.config.FAISS_LOCAL_FILE_INDEX)
-        self.vector_store.add_texts(texts, metadatas=metadatas)
-        # # Save to local file
-        # self.save_local(self.config.FAISS_LOCAL_FILE_INDEX)
+
+        ttl = kwargs.get('ttl')
+        if ttl is not None:
+            expires_at = time.time() + ttl
+            metadatas = [{**(metadata or {}), EXPIRES_AT_KEY: expires_at} for metadata in (metadatas or [{} for _ in texts])]
+
+        embeddings = self.embeddings.embed_documents(texts)
+
+        # Snapshots and rebuilds run in the background, they must not see half of a batch
+        with get_index_lock(self.config.FAISS_LOCAL_FILE_INDEX, get_index_name(index_name)):
+            vector_store = self._get_vector_store(index_name, create=True)
+            vector_store.add_embeddings(zip(texts, embeddings), metadatas=metadatas)
+
+            self._train_if_needed(index_name)
+
+    def _train_if_needed(self, index_name: Optional[str] = None) -> None:
+        """This function trains or rebuilds the index when it outgrows its current type.
+        
+        New indexes start as flat indexes. Once they hold FAISS_TRAIN_THRESHOLD vectors 
+        they are rebuilt as the configured FAISS_INDEX_TYPE, which trains it on everything
+        loaded so far. IVF indexes are rebuilt again whenever the vectors have grown 
+        enough to support twice as many lists.
+        """
+
+        if self.config.FAISS_INDEX_TYPE == 'flat' and get_vector_encoding(self.config) == 'float32':
+            return
+
+        index = self._get_vector_store(index_name).index
+        ivf_index = faiss.try_extract_index_ivf(index)
+
+        if isinstance(faiss.downcast_index(get_inner_index(index)), faiss.IndexFlat):
+            if index.ntotal >= self.config.FAISS_TRAIN_THRESHOLD:
+                logger.info(f"FAISS index reached {index.ntotal} vectors, building a '{self.config.FAISS_INDEX_TYPE}' index with {get_vector_encoding(self.config)} vectors")
+                self.rebuild_index(index_name)
+
+        elif ivf_index is not None:
+            if get_ivf_nlist(self.config, index.ntotal) >= 2 * ivf_index.nlist:
+                logger.info(f"FAISS index outgrew {ivf_index.nlist} IVF lists with {index.ntotal} vectors, rebuilding it")
+                self.rebuild_index(index_name)
+
+    def _get_vectors(self, vector_store: FAISSIndex) -> np.ndarray:
+        """This function returns the vectors of an index, from the side store if it is complete."""
+
+        rerank_vectors = vector_store.rerank_vectors
+
+        if rerank_vectors is not None and len(rerank_vectors) == vector_store.index.ntotal:
+            return np.asarray(rerank_vectors, dtype=np.float32)
+
+        return reconstruct_vectors(vector_store.index)
+
+    def rebuild_index(self, index_name: Optional[str] = None, retrain: bool = True) -> None:
+        """This function rebuilds an index, leaving out its deleted vectors.
+        
+        The vectors that are not deleted are read back from the current index and 
+        added to the new index in the same order, keeping their labels. The vectors 
+        come from the side store when there is one, otherwise rebuilding a quantized 
+        index uses the decoded vectors. The rebuilt index replaces the current one 
+        in memory, for every FAISSExtended holding it, so searches running meanwhile 
+        finish on the current one. The rebuild holds the lock of the index, see
+        get_index_lock, so texts added or deleted meanwhile wait for it and go to
+        the rebuilt index. The process-wide lock is only held to swap the indexes.
+
+        Args:
+            index_name: the index name
+            retrain: whether to build the configured FAISS_INDEX_TYPE and train it on
+                the vectors, rather than reuse the current index emptied of its vectors
+        Returns:
+            none
+        """
+
+        # Texts added meanwhile would be left out of the rebuilt index
+        with get_index_lock(self.config.FAISS_LOCAL_FILE_INDEX, get_index_name(index_name)):
+            vector_store = self._get_vector_store(index_name)
+            index = vector_store.index
+            rows = np.setdiff1d(np.arange(index.ntotal, dtype=np.int64), vector_store.tombstones)
+            vectors = self._get_vectors(vector_store)[rows]
+
+            if retrain:
+                new_index = build_faiss_index(self.config, index.d, len(rows), metric=index.metric_type)
+                if not new_index.is_trained:
+                    new_index.train(vectors)
+            else:
+                new_index = faiss.clone_index(get_inner_index(index))
+                new_index.reset()
+                set_search_parameters(self.config, new_index)
+
+            new_vector_store = vector_store.rebuild(new_index, vectors, rows)
+
+            with _resident_indexes_lock:
+                self.vector_stores[get_index_name(index_name)] = new_vector_store
+                vector_store.replaced_by = new_vector_store
+                for key in [key for key, resident in _resident_indexes.items() if resident is vector_store]:
+                    _resident_indexes[key] = new_vector_store
+
+    def quantization_report(
+            self, 
+            index_name: Optional[str] = None, 
+            k: int = 10, 
+            num_queries: int = 100
+        ) -> List[Dict[str, Any]]:
+        """This function reports the memory saved and the recall lost by each vector encoding
+        on the vectors of an index, using a sample of them as queries.
+        
+        Args:
+            index_name: the index name
+            k: the number of results per query
+            num_queries: the number of vectors sampled as queries
+        Returns:
+            the report rows, see evaluate_vector_encodings
+        """
+
+        vector_store = self._get_vector_store(index_name)
+        vectors = self._get_vectors(vector_store)
+
+        rng = np.random.default_rng(0)
+        queries = vectors[rng.choice(len(vectors), size=min(num_queries, len(vectors)), replace=False)]
+
+        report = evaluate_vector_encodings(self.config, vectors, queries, k=k, metric=vector_store.index.metric_type)
+
+        for row in report:
+            logger.info(
+                f"FAISS {row['encoding']}: {row['bytes_per_vector']:.0f} bytes per vector "
+                f"({row['memory_ratio']:.1%} of float32), recall@{k} {row['recall']:.3f}, "
+                f"re-ranked {row['recall_reranked']:.3f}"
+            )
+
+        return report
 
     def similarity_search( 
             self, 
             query: str, 
             k: int = 4, 
             filter: Optional[Dict[str, Any]] = None,
-            index_name: Optional[str] = None
+            index_name: Optional[str] = None,
+            score_threshold: Optional[float] = None
         ) -> List[Tuple[Document, float]]:
         """This function performs a similarity search.
         
@@ -109,29 +1698,88 @@ class FAISSExtended(BaseVectorStore):
             query: the query
             k: the number of results
             filter: the filter
+            index_name: the index name
+            score_threshold: the smallest relevance score of the docs, None for no threshold
         Returns:
             docs and relevance scores in the range [0, 1].
         """
 
-        return self.vector_store.similarity_search_with_relevance_scores(query, k, filter=filter)
+        # An index that was never added to is searched as an empty index
+        vector_store = self._get_vector_store(index_name, create=True)
+
+        return vector_store.similarity_search_with_relevance_scores(query, k, filter=filter, score_threshold=score_threshold)
+
+    def query_by_filter(
+            self,
+            filter: Optional[Dict[str, Any]] = None,
+            sort_by: Optional[str] = None,
+            limit: Optional[int] = None,
+            descending: bool = False,
+            index_name: Optional[str] = None
+        ) -> List[Document]:
+        """This function returns the documents matching a filter, without embedding anything.
+        
+        Args:
+            filter: the filter, see MetadataIndex.search for its format
+            sort_by: the metadata key to sort the documents by
+            limit: the number of documents, None for all of them
+            descending: whether to sort in descending order
+            index_name: the index name
+        Returns:
+            the documents
+        """
+
+        # An index that was never added to is queried as an empty index
+        vector_store = self._get_vector_store(index_name, create=True)
+
+        return vector_store.query_by_filter(filter, sort_by=sort_by, limit=limit, descending=descending)
+
+    def delete_documents(
+            self, 
+            ids: Optional[List[str]] = None, 
+            filter: Optional[Dict[str, Any]] = None, 
+            index_name: Optional[str] = None
+        ) -> List[str]:
+        """This function deletes documents by id, or the documents matching a filter.
+
+        The documents are tombstoned until the index is compacted, see save_local.
+        
+        Args:
+            ids: the ids the documents were added with
+            filter: the filter, see MetadataIndex.search for its format
+            index_name: the index name
+        Returns:
+            the ids of the deleted documents
+        """
+
+        with get_index_lock(self.config.FAISS_LOCAL_FILE_INDEX, get_index_name(index_name)):
+            return self._get_vector_store(index_name).delete(ids=ids, filter=filter)
 
     def create_index(self, 
                      index_name: str, 
                      metadata_schema: Dict[str, str]=None, 
                      distance_metric: Optional[str]="COSINE"
                      ) -> None:
-        """This function creates an index.
+        """This function creates an empty index and saves it in FAISS_LOCAL_FILE_INDEX.
+
+        FAISS indexes do not need a metadata schema. COSINE and IP indexes use 
+        inner product, so their relevance scores are the similarities themselves.
         
         Args:
             index_name: the index name
+            distance_metric: the distance metric, one of L2, IP and COSINE
         Returns:
             none
         """
 
-        logger.warning('FAISS does not support creating indexes')
+        if get_index_name(index_name) in self.vector_stores or index_exists(self.config.FAISS_LOCAL_FILE_INDEX, get_index_name(index_name)):
+            raise ValueError(f"Index '{index_name}' already exists.")
+
+        self.vector_stores[get_index_name(index_name)] = self._new_vector_store(distance_metric)
+        self.save_local(self.config.FAISS_LOCAL_FILE_INDEX, index_name=index_name)
 
     def drop_index(self, index_name: str) -> None:
-        """This function drops an index.
+        """This function drops an index and removes its files.
         
         Args:
             index_name: the index name
@@ -139,28 +1787,66 @@ class FAISSExtended(BaseVectorStore):
             none
         """
 
-        logger.warning('FAISS does not support dropping indexes')
+        index_name = get_index_name(index_name)
+        file_path = self.config.FAISS_LOCAL_FILE_INDEX
+
+        # A compaction would write the files again
+        with _resident_indexes_lock:
+            compaction = _compactions.pop((os.path.abspath(file_path), index_name), None)
+        if compaction is not None:
+            compaction.join()
 
+        self.vector_stores.pop(index_name, None)
+
+        with get_index_lock(file_path, index_name):
+            with _resident_indexes_lock:
+                for key in [key for key in _resident_indexes if key[:2] == (os.path.abspath(file_path), index_name)]:
+                    del _resident_indexes[key]
+
+            for suffix in INDEX_FILE_SUFFIXES:
+                index_file = os.path.join(file_path, f"{index_name}{suffix}")
+                if os.path.exists(index_file):
+                    os.remove(index_file)
 
     def get_retriever(self, index_name: Optional[str] = None) -> VectorStoreRetriever:
         """This function returns a retriever object."""
 
-        logger.warning('FAISS does not support index name parameter')
-
         # Make sure we load it before using it
-        self.load_local(self.config.FAISS_LOCAL_FILE_INDEX)
-        return self.vector_store.as_retriever()
+        self.load_local(self.config.FAISS_LOCAL_FILE_INDEX, read_only=True, index_name=index_name)
+        return self._get_vector_store(index_name).as_retriever()
     
-    def check_existing_index(self, index_name: str = None) -> bool:
-        """This function checks if the index exists.
+    def get_index_stats(self, index_name: Optional[str] = None) -> Dict[str, int]:
+        """This function returns the size of an index.
+
+        Deleted documents are not counted until the index is compacted.
         
         Args:
             index_name: the index name
         Returns:
+            the number of documents in the index (num_docs), and the number of 
+            documents ever added to it (num_added)
+        """
+
+        vector_store = self._get_vector_store(index_name, create=True)
 
+        stats = {'num_docs': 0, 'num_added': vector_store.next_id}
+        for store in [vector_store, vector_store.delta]:
+            if store is not None:
+                stats['num_docs'] += store.index.ntotal - len(store.tombstones)
+                stats['num_added'] = max(stats['num_added'], store.next_id)
+
+        return stats
+
+    def check_existing_index(self, index_name: str = None) -> bool:
+        """This function checks if the index exists in memory or in FAISS_LOCAL_FILE_INDEX.
+        
+        Args:
+            index_name: the index name
+        Returns:
+            whether the index exists
         """
-            
-        logger.warning('FAISS does not support index name parameter')
 
-        return True
+        index_name = get_index_name(index_name)
+        file_path = self.config.FAISS_LOCAL_FILE_INDEX
 
+        return index_name in self.vector_stores or index_exists(file_path, index_name)
@@ -0,0 +1,280 @@
+import os
+import json
+import logging
+from numbers import Number
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+RANGE_OPERATORS = {
+    'gt': lambda value, bound: value > bound,
+    'gte': lambda value, bound: value >= bound,
+    'lt': lambda value, bound: value < bound,
+    'lte': lambda value, bound: value <= bound,
+}
+
+def get_sort_key(value: Any) -> Tuple[int, Any]:
+    """This function returns the key a metadata value is sorted by.
+
+    Numbers sort before strings, and booleans, missing or other values sort last.
+
+    Args:
+        value: the metadata value
+    Returns:
+        the sort key
+    """
+
+    if isinstance(value, Number) and not isinstance(value, bool):
+        return (0, value)
+    if isinstance(value, str):
+        return (1, value)
+
+    return (2, 0)
+
+def get_posting_value(value: Any) -> Any:
+    """This function returns the value a posting list of the metadata index is keyed by.
+
+    True and False are equal to 1 and 0 in Python, so booleans are keyed by a tuple
+    and get posting lists of their own.
+
+    Args:
+        value: the metadata value
+    Returns:
+        the key of its posting list
+    """
+
+    return ('bool', value) if isinstance(value, bool) else value
+
+def match_filter(metadata: Optional[Dict[str, Any]], filter: Dict[str, Any]) -> bool:
+    """This function checks if metadata matches a filter, see MetadataIndex.search for its format.
+
+    Args:
+        metadata: the metadata
+        filter: the filter
+    Returns:
+        whether the metadata matches every key of the filter
+    """
+
+    metadata = metadata or {}
+    for key, condition in filter.items():
+        if key not in metadata:
+            return False
+        value = metadata[key]
+
+        if isinstance(condition, dict):
+            unknown_operators = set(condition) - set(RANGE_OPERATORS)
+            if unknown_operators:
+                raise ValueError(f"Unsupported range operators {sorted(unknown_operators)} for '{key}'")
+
+            if not isinstance(value, Number) or isinstance(value, bool) or not all(
+                RANGE_OPERATORS[operator](value, bound) for operator, bound in condition.items()
+            ):
+                return False
+        else:
+            conditions = condition if isinstance(condition, list) else [condition]
+            # True and 1 are equal in Python, but they are different metadata values
+            if not any(value == expected and isinstance(value, bool) == isinstance(expected, bool) for expected in conditions):
+                return False
+
+    return True
+
+class MetadataIndex:
+    """This class represents an inverted index from metadata values to vector ids.
+
+    Every scalar metadata value (string, number or boolean) has a posting list of
+    the ids of the vectors whose metadata holds it, so filters are resolved without
+    looking at the documents. Booleans never share the posting lists of numbers,
+    see get_posting_value. Postings loaded from disk stay memory-mapped until
+    an id is added to them.
+    """
+
+    def __init__(self, postings: Optional[Dict[str, Dict[Any, Union[List[int], np.ndarray]]]] = None):
+        """
+        Initialize the Metadata Index.
+
+        Args:
+            postings: the sorted ids of the vectors, keyed by metadata key and value
+        """
+
+        self.postings = postings if postings is not None else {}
+
+    def add(self, start_id: int, metadatas: Iterable[Optional[Dict[str, Any]]]) -> None:
+        """This function adds the metadata of vectors with consecutive ids.
+
+        Args:
+            start_id: the id of the first vector
+            metadatas: the metadata of the vectors
+        Returns:
+            none
+        """
+
+        for id, metadata in enumerate(metadatas, start=start_id):
+            for key, value in (metadata or {}).items():
+                if not isinstance(value, (str, Number)):
+                    continue
+
+                value = get_posting_value(value)
+                values = self.postings.setdefault(key, {})
+                posting = values.get(value)
+                if posting is None:
+                    posting = values[value] = []
+                elif isinstance(posting, np.ndarray):
+                    posting = values[value] = posting.tolist()
+
+                posting.append(id)
+
+    def search(self, filter: Dict[str, Any]) -> np.ndarray:
+        """This function returns the ids of the vectors matching a filter.
+
+        A filter maps metadata keys to a value, a list of values, or a range given
+        as a dict of the operators gt, gte, lt and lte. A vector matches if it
+        matches every key.
+
+        Args:
+            filter: the filter
+        Returns:
+            the sorted ids
+        """
+
+        ids = None
+        for key, condition in filter.items():
+            values = self.postings.get(key, {})
+
+            if isinstance(condition, dict):
+                unknown_operators = set(condition) - set(RANGE_OPERATORS)
+                if unknown_operators:
+                    raise ValueError(f"Unsupported range operators {sorted(unknown_operators)} for '{key}'")
+
+                postings = [
+                    posting for value, posting in values.items()
+                    if isinstance(value, Number) and all(
+                        RANGE_OPERATORS[operator](value, bound) for operator, bound in condition.items()
+                    )
+                ]
+            else:
+                conditions = condition if isinstance(condition, list) else [condition]
+                conditions = [get_posting_value(value) for value in conditions]
+                postings = [values[value] for value in conditions if value in values]
+
+            key_ids = np.unique(np.concatenate([np.asarray(posting, dtype=np.int64) for posting in postings])) \
+                if postings else np.empty(0, dtype=np.int64)
+
+            ids = key_ids if ids is None else np.intersect1d(ids, key_ids, assume_unique=True)
+
+            if len(ids) == 0:
+                break
+
+        return ids if ids is not None else np.empty(0, dtype=np.int64)
+
+    def sort(
+            self, 
+            ids: np.ndarray, 
+            key: str, 
+            descending: bool = False, 
+            limit: Optional[int] = None
+        ) -> np.ndarray:
+        """This function orders ids by their metadata value of a key.
+
+        The posting lists of the key are walked in value order, so only the values
+        up to the limit are visited. The ids without a value for the key come last,
+        and ids with the same value stay in ascending order.
+
+        Args:
+            ids: the sorted ids
+            key: the metadata key
+            descending: whether to sort the values in descending order
+            limit: the number of ids to return, None for all of them
+        Returns:
+            the ordered ids
+        """
+
+        limit = len(ids) if limit is None else min(limit, len(ids))
+
+        values = self.postings.get(key, {})
+        ordered = []
+        num_ordered = 0
+        for value in sorted(values, key=get_sort_key, reverse=descending):
+            if num_ordered >= limit:
+                break
+
+            value_ids = np.intersect1d(ids, np.asarray(values[value], dtype=np.int64), assume_unique=True)
+            ordered.append(value_ids)
+            num_ordered += len(value_ids)
+
+        if num_ordered < limit:
+            ordered.append(np.setdiff1d(ids, np.concatenate(ordered) if ordered else [], assume_unique=True))
+
+        return np.concatenate(ordered)[:limit] if ordered else np.empty(0, dtype=np.int64)
+
+    def save(self, folder_path: str, name: str) -> None:
+        """This function saves the index to a folder.
+
+        The posting lists are concatenated in a numpy file, and a JSON file holds
+        the keys, values and offsets of the lists.
+
+        Args:
+            folder_path: the folder
+            name: the name to save the index with
+        Returns:
+            none
+        """
+
+        keys_file = os.path.join(folder_path, f"{name}.meta.json")
+        ids_file = os.path.join(folder_path, f"{name}.meta.npy")
+
+        entries = []
+        postings = []
+        offset = 0
+        for key, values in self.postings.items():
+            for value, posting in values.items():
+                entries.append([key, value, offset, len(posting)])
+                postings.append(np.asarray(posting, dtype=np.int64))
+                offset += len(posting)
+
+        with open(f"{ids_file}.tmp", 'wb') as f:
+            np.save(f, np.concatenate(postings) if postings else np.empty(0, dtype=np.int64))
+
+        with open(f"{keys_file}.tmp", 'w') as f:
+            json.dump(entries, f, ensure_ascii=False)
+
+        os.replace(f"{ids_file}.tmp", ids_file)
+        os.replace(f"{keys_file}.tmp", keys_file)
+
+    @classmethod
+    def load(cls, folder_path: str, name: str) -> "MetadataIndex":
+        """This function loads an index saved in a folder, memory-mapping the posting lists.
+
+        Args:
+            folder_path: the folder
+            name: the name the index was saved with
+        Returns:
+            the index
+        """
+
+        with open(os.path.join(folder_path, f"{name}.meta.json")) as f:
+            entries = json.load(f)
+
+        ids = np.load(os.path.join(folder_path, f"{name}.meta.npy"), mmap_mode='r')
+
+        postings = {}
+        for key, value, offset, length in entries:
+            # JSON turns the tuple keys of booleans into lists
+            value = tuple(value) if isinstance(value, list) else get_posting_value(value)
+            postings.setdefault(key, {})[value] = ids[offset:offset + length]
+
+        return cls(postings)
+
+    @staticmethod
+    def exists(folder_path: str, name: str) -> bool:
+        """This function checks if an index was saved in a folder.
+
+        Args:
+            folder_path: the folder
+            name: the name the index was saved with
+        Returns:
+            whether the index exists
+        """
+
+        return os.path.exists(os.path.join(folder_path, f"{name}.meta.json"))
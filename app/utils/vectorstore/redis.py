@@ -4,13 +4,18 @@ from langchain.vectorstores.redis import Redis as Redis_TYPE
 from langchain.embeddings.base import Embeddings
 from langchain.vectorstores.redis import RedisText
 
+import asyncio
 import logging
+import threading
 import numpy as np
 from app.config import Config
 from app.utils.vectorstore import BaseVectorStore
+from app.utils.vectorstore.redis_filter import compile_filter, match_text_conditions
 
+import math
 import hashlib
 from redis.client import Redis
+from redis.exceptions import ResponseError
 from redis.commands.search.query import Query
 from redis.commands.search.indexDefinition import IndexDefinition, IndexType
 from redis.commands.search.field import VectorField, TagField, TextField, NumericField
@@ -21,6 +26,62 @@ logger = logging.getLogger(__name__)
 
 format_index_name = lambda index_name: f"{index_name}"
 
+# The clients shared by every RedisExtended in the process, keyed by redis url. A client holds
+# a thread-safe connection pool, and whether the server is a cluster is only checked once per url.
+_redis_clients: Dict[str, Redis] = {}
+_redis_async_clients: Dict[str, Any] = {}
+_redis_clusters: Dict[str, bool] = {}
+_redis_clients_lock = threading.Lock()
+
+# The schemas of the indexes, shared by every RedisExtended in the process. The key is (redis url, index name).
+_redis_schemas: Dict[Tuple[str, str], Dict[str, str]] = {}
+# The vector type and the distance metric of the indexes, cached with their schemas
+_redis_vector_fields: Dict[Tuple[str, str], Tuple[str, str]] = {}
+
+# The numpy type of each vector type
+VECTOR_TYPES = {
+    'FLOAT32': np.float32,
+    'FLOAT16': np.float16,
+}
+
+# The first RediSearch version supporting FLOAT16 vectors, 2.10.0
+FLOAT16_MIN_SEARCH_VERSION = 21000
+
+def get_relevance_score(distance: float, distance_metric: str) -> float:
+    """This function converts a distance of an index into a relevance score, like the FAISS vector store does.
+
+    COSINE and IP distances are one minus the similarity. L2 distances are squared,
+    like the ones of FAISS, and scored like langchain scores FAISS L2 distances.
+
+    Args:
+        distance: the distance
+        distance_metric: the distance metric of the index
+    Returns:
+        the relevance score, in the range [0, 1] for normalized embeddings
+    """
+
+    if distance_metric == 'L2':
+        return 1.0 - distance / math.sqrt(2)
+
+    return 1.0 - distance
+
+def filter_by_score(docs_with_scores: List[Tuple[Document, float]], score_threshold: Optional[float] = None) -> List[Tuple[Document, float]]:
+    """This function drops the documents scored below a threshold.
+
+    Range queries already drop them, except on L2 indexes, which are searched with KNN queries.
+
+    Args:
+        docs_with_scores: the documents and their relevance scores
+        score_threshold: the smallest relevance score, None for no threshold
+    Returns:
+        the documents scored at least the threshold
+    """
+
+    if score_threshold is None:
+        return docs_with_scores
+
+    return [(doc, score) for doc, score in docs_with_scores if score >= score_threshold]
+
 class RedisExtended(BaseVectorStore):
     """This class represents a Redis Vector Store."""
 
@@ -47,6 +108,10 @@ class RedisExtended(BaseVectorStore):
         Before creating a connection the existence of the database driver is checked
         an and ValueError raised otherwise
 
+        The client is shared by every vector store of the process using the same url,
+        so the connection pool and the cluster check are only set up once. The keyword 
+        arguments are only used by the first call.
+
         To use, you should have the ``redis`` python package installed.
 
         Example:
@@ -78,6 +143,24 @@ class RedisExtended(BaseVectorStore):
                 )
         """
 
+        with _redis_clients_lock:
+            redis_client = _redis_clients.get(redis_url)
+            if redis_client is None:
+                kwargs.setdefault('max_connections', self.config.REDIS_MAX_CONNECTIONS)
+                redis_client = _redis_clients[redis_url] = self._connect(redis_url, **kwargs)
+
+        return redis_client
+
+    def _connect(self, redis_url: str, **kwargs: Any) -> Redis:
+        """This function connects to a redis server, or to a redis cluster.
+        
+        Args:
+            redis_url: the redis url
+            kwargs: the keyword arguments of the client
+        Returns:
+            the redis client
+        """
+
         # Initialize with necessary components.
         try:
             import redis
@@ -99,7 +182,8 @@ class RedisExtended(BaseVectorStore):
         else:
             # connect to redis server from url, reconnect with cluster client if needed
             redis_client = redis.from_url(redis_url, **kwargs)
-            if self._check_for_cluster(redis_client):
+            _redis_clusters[redis_url] = self._check_for_cluster(redis_client)
+            if _redis_clusters[redis_url]:
                 redis_client.close()
                 redis_client = self._redis_cluster_client(redis_url, **kwargs)
         return redis_client
@@ -130,24 +214,50 @@ class RedisExtended(BaseVectorStore):
     def create_index(self, 
                      index_name: str, 
                      metadata_schema: Dict[str, str]=None, 
-                     distance_metric: Optional[str]="COSINE"
+                     distance_metric: Optional[str]="COSINE",
+                     vector_type: Optional[str]=None,
+                     m: Optional[int]=None,
+                     ef_construction: Optional[int]=None,
+                     ef_runtime: Optional[int]=None,
+                     initial_cap: Optional[int]=None
                      ) -> None:
         """This function creates an index.
+
+        The HNSW parameters and the vector type default to the REDIS_HNSW_* and
+        REDIS_VECTOR_TYPE settings. A higher M or EF_CONSTRUCTION builds a better 
+        graph, and a higher EF_RUNTIME searches more of it, with a better recall 
+        but a higher latency.
         
         Args:
             index_name: the index name
             distance_metric: the distance metric
+            vector_type: FLOAT32 or FLOAT16
+            m: the number of neighbours of a node of the graph
+            ef_construction: the number of candidates considered when a vector is added
+            ef_runtime: the number of candidates considered when searching
+            initial_cap: the number of vectors the index is allocated for
         Returns:
             none
         """
 
+        vector_type = (vector_type or self.config.REDIS_VECTOR_TYPE).upper()
+        if vector_type not in VECTOR_TYPES:
+            raise ValueError(f"Vector type '{vector_type}' is not supported.")
+
+        if vector_type == 'FLOAT16' and not self._supports_float16():
+            logger.warning(f"The Redis server does not support FLOAT16 vectors, index '{index_name}' uses FLOAT32 vectors")
+            vector_type = 'FLOAT32'
+
         content = TextField(name="content")
         content_vector = VectorField("content_vector",
                     "HNSW", {
-                        "TYPE": "FLOAT32",
+                        "TYPE": vector_type,
                         "DIM": self.config.OPENAI_EMBEDDING_SIZE,
                         "DISTANCE_METRIC": distance_metric,
-                        "INITIAL_CAP": 1000,
+                        "INITIAL_CAP": initial_cap or self.config.REDIS_HNSW_INITIAL_CAP,
+                        "M": m or self.config.REDIS_HNSW_M,
+                        "EF_CONSTRUCTION": ef_construction or self.config.REDIS_HNSW_EF_CONSTRUCTION,
+                        "EF_RUNTIME": ef_runtime or self.config.REDIS_HNSW_EF_RUNTIME,
                     })
         
         fields = [content, content_vector]
@@ -158,6 +268,8 @@ class RedisExtended(BaseVectorStore):
                     fields.append(TextField(name=key))
                 elif value.lower() == 'numeric':
                     fields.append(NumericField(name=key))
+                elif value.lower() == 'tag':
+                    fields.append(TagField(name=key))
                 else:
                     raise ValueError(f"Metadata schema value '{value}' is not supported.")
         
@@ -168,6 +280,25 @@ class RedisExtended(BaseVectorStore):
             definition = IndexDefinition(prefix=[format_index_name(index_name)], index_type=IndexType.HASH)
         )
 
+        _redis_schemas.pop((self.redis_url, index_name), None)
+        _redis_vector_fields.pop((self.redis_url, index_name), None)
+
+    def _supports_float16(self) -> bool:
+        """This function checks if the RediSearch module of the server supports FLOAT16 vectors."""
+
+        try:
+            modules = self.redis_client.module_list()
+        except ResponseError:
+            return False
+
+        for module in modules:
+            name = module.get(b'name', module.get('name'))
+            version = module.get(b'ver', module.get('ver'))
+            if name in (b'search', 'search', b'searchlight', 'searchlight'):
+                return int(version) >= FLOAT16_MIN_SEARCH_VERSION
+
+        return False
+
     def drop_index(self, index_name: str) -> None:
         """This function drops an index.
         
@@ -177,6 +308,9 @@ class RedisExtended(BaseVectorStore):
             none
         """
 
+        _redis_schemas.pop((self.redis_url, index_name), None)
+        _redis_vector_fields.pop((self.redis_url, index_name), None)
+
         self.redis_client.ft(format_index_name(index_name)).dropindex(True)
 
     def check_existing_index(self, index_name: str = None) -> bool:
@@ -194,21 +328,47 @@ class RedisExtended(BaseVectorStore):
         except:
             return False
 
-    def _get_redis_schema(self, index_name: str = None) -> Dict[str, str]:
+    def get_index_stats(self, index_name: Optional[str] = None) -> Dict[str, int]:
+        """This function returns the size of an index with FT.INFO.
+
+        Expired keys leave the index, so their documents are not counted.
+        
+        Args:
+            index_name: the index name
+        Returns:
+            the number of documents in the index (num_docs), and the number of 
+            documents ever added to it (num_added)
+        """
+
+        info = self.redis_client.ft(format_index_name(index_name)).info()
+
+        return {'num_docs': int(info['num_docs']), 'num_added': int(info['max_doc_id'])}
+
+    def _get_redis_schema(self, index_name: str = None, refresh: bool = False) -> Dict[str, str]:
         """This function gets the redis schema.
+
+        Schemas are cached per index, so FT.INFO only runs the first time an index 
+        is used, after it is created or dropped, or when it is refreshed.
         
         Args:
             index_name: the index name
+            refresh: whether to read the schema again even if it is cached
         Returns:
             the redis schema
         
         """    
 
-        # Check if the index exists
-        if not self.check_existing_index(index_name):
+        key = (self.redis_url, index_name)
+        if not refresh and key in _redis_schemas:
+            return _redis_schemas[key]
+
+        try:
+            index_info = self.redis_client.ft(format_index_name(index_name)).info()
+        except ResponseError:
+            _redis_schemas.pop(key, None)
+            _redis_vector_fields.pop(key, None)
             raise ValueError(f"Index '{index_name}' does not exist.")
-        
-        index_info = self.redis_client.ft(format_index_name(index_name)).info()
+
         logger.debug(f"Index info: {index_info}")
 
         schema = {}
@@ -217,22 +377,102 @@ class RedisExtended(BaseVectorStore):
             
             identifier = None
             data_type = None
+            vector_type = None
+            distance_metric = None
 
             for i in range(len(attribute) - 1):
                 if attribute[i] == b'identifier':
                     identifier = attribute[i+1].decode("utf-8")
                 elif attribute[i] == b'type':
                     data_type = attribute[i+1].decode("utf-8")
+                elif attribute[i] == b'data_type':
+                    vector_type = attribute[i+1].decode("utf-8")
+                elif attribute[i] == b'distance_metric':
+                    distance_metric = attribute[i+1].decode("utf-8")
 
             assert identifier is not None
             assert data_type is not None
 
             schema[identifier] = data_type
+
+            # Older servers do not report the vector type, which can only be FLOAT32 or FLOAT64
+            if data_type == 'VECTOR':
+                _redis_vector_fields[key] = ((vector_type or 'FLOAT32').upper(), (distance_metric or 'COSINE').upper())
         
         logger.debug(f"Schema: {schema}")
 
+        _redis_schemas[key] = schema
+
         return schema
 
+    def _get_vector_type(self, index_name: str = None) -> np.dtype:
+        """This function returns the numpy type of the vectors of an index.
+        
+        Args:
+            index_name: the index name
+        Returns:
+            the numpy type
+        """
+
+        self._get_redis_schema(index_name)
+
+        vector_type, _ = _redis_vector_fields.get((self.redis_url, index_name), ('FLOAT32', 'COSINE'))
+        if vector_type not in VECTOR_TYPES:
+            raise ValueError(f"Vector type '{vector_type}' of index '{index_name}' is not supported.")
+
+        return VECTOR_TYPES[vector_type]
+
+    def _get_distance_metric(self, index_name: str = None) -> str:
+        """This function returns the distance metric of the vectors of an index.
+        
+        Args:
+            index_name: the index name
+        Returns:
+            the distance metric, COSINE, IP or L2
+        """
+
+        self._get_redis_schema(index_name)
+
+        _, distance_metric = _redis_vector_fields.get((self.redis_url, index_name), ('FLOAT32', 'COSINE'))
+
+        return distance_metric
+
+    def _get_radius(self, score_threshold: float, index_name: str = None) -> Optional[float]:
+        """This function converts a relevance score threshold into the largest distance of the index matching it.
+
+        COSINE and IP distances are one minus the similarity, so relevance scores
+        are similarities. L2 indexes are not searched by range, their results are 
+        filtered by score instead.
+        
+        Args:
+            score_threshold: the smallest relevance score, between 0 and 1
+            index_name: the index name
+        Returns:
+            the radius, or None if the index cannot be searched by range
+        """
+
+        if self._get_distance_metric(index_name) not in ('COSINE', 'IP'):
+            return None
+
+        return 1 - score_threshold
+
+    def _get_search_radius(self, score_threshold: Optional[float], radius: Optional[float], index_name: str = None) -> Optional[float]:
+        """This function returns the radius of a search, the smaller of a radius and of the one of a score threshold.
+        
+        Args:
+            score_threshold: the smallest relevance score, None for no threshold
+            radius: the largest distance, None for no radius
+            index_name: the index name
+        Returns:
+            the radius, None for a KNN query
+        """
+
+        score_radius = self._get_radius(score_threshold, index_name) if score_threshold is not None else None
+        if score_radius is None:
+            return radius
+
+        return score_radius if radius is None else min(radius, score_radius)
+
     
     def _get_langchain_redis(self, index_name: str = None) -> Redis_TYPE:
         """This function gets the langchain redis.
@@ -269,24 +509,17 @@ class RedisExtended(BaseVectorStore):
             index_name: the index name
 
         Returns:
-            none
+            the keys of the documents
         """
         # TODO: using langchain redis add_documents is too buggy, may remove it completely
         # redis_langchain = self._get_langchain_redis(index_name)
         # logger.debug(f"Schemas: {redis_langchain.schema}")
 
-        keys = []
-        if 'keys' in kwargs:
-            keys = kwargs['keys']
-        else:
-            for document in documents:
-                key = hashlib.sha256(document.page_content.encode("utf-8")).hexdigest()
-                keys.append(f"{format_index_name(index_name)}:{key}")
-
         texts = [document.page_content for document in documents]
         metadatas = [document.metadata for document in documents]
 
-        self.add_texts(texts, metadatas=metadatas, index_name=index_name, keys=keys)
+        # The documents are keyed by the hashes of their texts unless keys are given
+        return self.add_texts(texts, metadatas=metadatas, index_name=index_name, **kwargs)
 
         # Add documents to the index
         # redis_langchain.add_documents(documents, keys=keys)
@@ -297,14 +530,24 @@ class RedisExtended(BaseVectorStore):
             metadatas: Optional[List[Dict[str, Any]]] = None, 
             index_name: str = None, 
             **kwargs: Any
-        ) -> None:
+        ) -> List[str]:
         """This function adds texts to the vector store.
+
+        The texts are embedded in batches by the embeddings model, and written with 
+        non-transactional pipelines of about REDIS_PIPELINE_MAX_BYTES bytes, so a 
+        document takes a few round trips rather than one per chunk.
+
+        Texts keyed by their hashes are only embedded if their keys do not exist yet,
+        which one pipeline of EXISTS checks. Only the metadata of the others is written,
+        so adding a document again embeds its changed chunks only.
         
         Args:
             texts: the texts to add
             index_name: the index name
+            keys: the keys of the texts, the hashes of the texts by default
+            ttl: the seconds after which the texts expire, None to keep them
         Returns:
-            none
+            the keys of the texts
         """
 
         # TODO: using langchain redis add_texts is too buggy, may remove it completely
@@ -318,32 +561,236 @@ class RedisExtended(BaseVectorStore):
                 key = hashlib.sha256(text.encode("utf-8")).hexdigest()
                 keys.append(f"{format_index_name(index_name)}:{key}")
 
-        for key, text, metadata in zip(keys, texts, metadatas):
-            
-            metadata['content'] = text
+        if len(texts) == 0:
+            return keys
 
-            emdeded_text = self.embeddings.embed_query(text)
-            emdeded_text = np.array(emdeded_text).astype(np.float32).tobytes()
-            metadata['content_vector'] = emdeded_text
+        metadatas = metadatas or [{} for _ in texts]
+        ttl = kwargs.get('ttl')
 
-            self.redis_client.hset(key, mapping=metadata)
+        if 'keys' in kwargs:
+            # Texts with given keys may have changed
+            is_new = [True for _ in keys]
+        else:
+            pipeline = self.redis_client.pipeline(transaction=False)
+            for key in keys:
+                pipeline.exists(key)
+
+            seen = set()
+            is_new = []
+            for key, exists in zip(keys, pipeline.execute()):
+                is_new.append(not exists and key not in seen)
+                seen.add(key)
+
+        new_texts = [text for text, new in zip(texts, is_new) if new]
+        logger.debug(f"Embedding {len(new_texts)} of {len(texts)} texts, the others are unchanged")
+
+        vectors = iter(np.asarray(self.embeddings.embed_documents(new_texts), dtype=self._get_vector_type(index_name))) \
+            if len(new_texts) > 0 else iter([])
+
+        pipeline = self.redis_client.pipeline(transaction=False)
+        pipeline_size = 0
+        for key, text, metadata, new in zip(keys, texts, metadatas, is_new):
+            mapping = dict(metadata)
+            if new:
+                vector = next(vectors)
+                mapping['content'] = text
+                mapping['content_vector'] = vector.tobytes()
+                pipeline_size += len(text.encode("utf-8")) + vector.nbytes
+
+            if len(mapping) > 0:
+                pipeline.hset(key, mapping=mapping)
+            if ttl is not None:
+                pipeline.expire(key, ttl)
+
+            if pipeline_size >= self.config.REDIS_PIPELINE_MAX_BYTES:
+                pipeline.execute()
+                pipeline_size = 0
+
+        if len(pipeline) > 0:
+            pipeline.execute()
+
+        return keys
 
         # Add texts to the index
         # redis_langchain.add_texts(texts, metadatas=metadatas, keys=keys)
 
+    def delete_documents(
+            self, 
+            ids: Optional[List[str]] = None, 
+            filter: Optional[Dict[str, Any]] = None, 
+            index_name: Optional[str] = None
+        ) -> List[str]:
+        """This function deletes documents by key, or the documents matching a filter.
+
+        Deleting a hash removes it from the index.
+        
+        Args:
+            ids: the document keys, as returned in the id metadata by similarity_search
+            filter: the metadata values the documents must have
+            index_name: the index name
+        Returns:
+            the keys of the deleted documents
+        """
+
+        keys = list(ids or [])
+        if filter:
+            keys += self._get_keys_by_filter(filter, index_name)
+
+        if len(keys) == 0:
+            return []
+
+        # Keys are deleted one by one, since they may live on different cluster nodes
+        pipeline = self.redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.delete(key)
+        deleted = pipeline.execute()
+
+        return [key for key, count in zip(keys, deleted) if count > 0]
+
+    def _get_keys_by_filter(self, filter: Dict[str, Any], index_name: str = None, page_size: int = 1000) -> List[str]:
+        """This function returns the keys of the documents matching a filter.
+
+        TEXT fields are matched as phrases by the index, so the values of the 
+        documents found are compared with the filter before they are returned.
+        
+        Args:
+            filter: the filter, see compile_filter for its format
+            index_name: the index name
+            page_size: the number of documents fetched per search
+        Returns:
+            the keys
+        """
+
+        schema = self._get_redis_schema(index_name)
+        filter_expression = compile_filter(filter, schema)
+
+        keys = []
+        offset = 0
+        while True:
+            query = Query(filter_expression).return_fields(*filter.keys()).paging(offset, page_size).dialect(2)
+            results = self.redis_client.ft(format_index_name(index_name)).search(query)
+
+            for result in results.docs:
+                if match_text_conditions(vars(result), filter, schema):
+                    keys.append(result.id)
+
+            offset += page_size
+            if offset >= results.total:
+                return keys
+
+    def query_by_filter(
+            self,
+            filter: Optional[Dict[str, Any]] = None,
+            sort_by: Optional[str] = None,
+            limit: Optional[int] = None,
+            descending: bool = False,
+            index_name: Optional[str] = None
+        ) -> List[Document]:
+        """This function returns the documents matching a filter, without embedding anything.
+
+        The documents are found with FT.SEARCH and sorted by Redis with SORTBY.
+        
+        Args:
+            filter: the filter, see compile_filter for its format
+            sort_by: the metadata field to sort the documents by
+            limit: the number of documents, None for all of them
+            descending: whether to sort in descending order
+            index_name: the index name
+        Returns:
+            the documents
+        """
+
+        try:
+            return self._query_by_filter(filter, sort_by, limit, descending, self._get_redis_schema(index_name), index_name)
+        except ResponseError as e:
+            # The index may have been created again with another schema
+            logger.info(f"Query of index '{index_name}' failed with '{e}', refreshing its schema")
+            return self._query_by_filter(filter, sort_by, limit, descending, self._get_redis_schema(index_name, refresh=True), index_name)
+
+    def _query_by_filter(
+            self,
+            filter: Optional[Dict[str, Any]],
+            sort_by: Optional[str],
+            limit: Optional[int],
+            descending: bool,
+            schema: Dict[str, str],
+            index_name: Optional[str] = None,
+            page_size: int = 1000
+        ) -> List[Document]:
+        """This function pages through the documents matching a filter.
+
+        TEXT fields are matched as phrases by the index, so the documents found
+        are compared with the filter and searching goes on until the limit is reached.
+        
+        Args:
+            filter: the filter
+            sort_by: the metadata field to sort by
+            limit: the number of documents
+            descending: whether to sort in descending order
+            schema: the redis schema of the index
+            index_name: the index name
+            page_size: the largest number of documents fetched per search
+        Returns:
+            the documents
+        """
+
+        metadata_fields = [key for key in schema.keys() if key != "content_vector" and key != "content"]
+        page_size = min(limit, page_size) if limit else page_size
+        filter_expression = compile_filter(filter or {}, schema)
+
+        documents = []
+        offset = 0
+        while True:
+            query = Query(filter_expression) \
+                .return_fields(*metadata_fields, "content").paging(offset, page_size).dialect(2)
+            if sort_by is not None:
+                query = query.sort_by(sort_by, asc=not descending)
+
+            results = self.redis_client.ft(format_index_name(index_name)).search(query)
+
+            for result in results.docs:
+                if filter and not match_text_conditions(vars(result), filter, schema):
+                    continue
+
+                metadata = {"id": result.id}
+                for key in metadata_fields:
+                    metadata[key] = result.__getattribute__(key)
+                documents.append(Document(page_content=result.content, metadata=metadata))
+
+                if limit is not None and len(documents) == limit:
+                    return documents
+
+            offset += page_size
+            if offset >= results.total:
+                return documents
+
     def similarity_search( 
             self, 
             query: str, 
             k: int = 4, 
             filter: Optional[Dict[str, Any]] = None,
-            index_name: Optional[str] = None
+            index_name: Optional[str] = None,
+            return_content: bool = True,
+            ef_runtime: Optional[int] = None,
+            score_threshold: Optional[float] = None,
+            radius: Optional[float] = None
         ) -> List[Tuple[Document, float]]:
         """This function performs a similarity search.
+
+        Only the metadata fields of the schema are fetched, never the vectors.
+        With a score threshold or a radius, a VECTOR_RANGE query returns the k 
+        nearest documents within the radius, so Redis drops the other candidates.
+        L2 indexes run a KNN query, whose results are then filtered by score.
         
         Args:
             query: the query
             k: the number of results
             filter: the filter
+            index_name: the index name
+            return_content: whether to fetch the texts, the documents are empty otherwise
+            ef_runtime: the EF_RUNTIME of this search, None for the one of the index
+            score_threshold: the smallest relevance score of the documents
+            radius: the largest distance of the documents, in the distance metric of the index
         Returns:
             docs and relevance scores in the range [0, 1].
         """
@@ -366,51 +813,168 @@ class RedisExtended(BaseVectorStore):
 
         # return redis_langchain.similarity_search_with_relevance_scores(query, k, filter=filter_expression)
 
-        schema = self._get_redis_schema(index_name)
+        radius = self._get_search_radius(score_threshold, radius, index_name)
+
+        # Embedded once, a search retried with a refreshed schema reuses the embedding
+        embedding = self.embeddings.embed_query(query)
+
+        try:
+            docs_with_scores = self._search(query, k, filter, self._get_redis_schema(index_name), index_name, return_content, ef_runtime, radius, embedding)
+        except ResponseError as e:
+            # The index may have been created again with another schema
+            logger.info(f"Search of index '{index_name}' failed with '{e}', refreshing its schema")
+            docs_with_scores = self._search(query, k, filter, self._get_redis_schema(index_name, refresh=True), index_name, return_content, ef_runtime, radius, embedding)
+
+        return filter_by_score(docs_with_scores, score_threshold)
+
+    def _search(
+            self, 
+            question: str, 
+            k: int, 
+            filter: Optional[Dict[str, Any]], 
+            schema: Dict[str, str], 
+            index_name: Optional[str] = None,
+            return_content: bool = True,
+            ef_runtime: Optional[int] = None,
+            radius: Optional[float] = None,
+            embedding: Optional[List[float]] = None
+        ) -> List[Tuple[Document, float]]:
+        """This function runs a KNN or range query and turns the results into documents.
         
-        query, query_params = self._contruct_redis_query(question=query, k=k, filter=filter)
+        Args:
+            question: the question
+            k: the number of results
+            filter: the filter
+            schema: the redis schema of the index
+            index_name: the index name
+            return_content: whether to fetch the texts
+            ef_runtime: the EF_RUNTIME of the query
+            radius: the largest distance of the results, None for a KNN query
+            embedding: the embedding of the question, None to embed it
+        Returns:
+            docs and scores
+        """
+
+        metadata_fields = [key for key in schema.keys() if key != "content_vector" and key != "content"]
+        return_fields = metadata_fields + ["content"] if return_content else metadata_fields
+
+        query, query_params = self._contruct_redis_query(
+            question=question, 
+            k=k, 
+            filter=filter, 
+            return_fields=return_fields,
+            ef_runtime=ef_runtime,
+            vector_type=self._get_vector_type(index_name),
+            schema=schema,
+            radius=radius,
+            embedding=embedding
+        )
 
         results = self.redis_client.ft(format_index_name(index_name)).search(query, query_params = query_params)
 
+        return self._to_documents(results, metadata_fields, self._get_distance_metric(index_name), return_content, filter, schema)
+
+    def _to_documents(
+            self, 
+            results: Any, 
+            metadata_fields: List[str], 
+            distance_metric: str, 
+            return_content: bool = True,
+            filter: Optional[Dict[str, Any]] = None,
+            schema: Optional[Dict[str, str]] = None
+        ) -> List[Tuple[Document, float]]:
+        """This function turns the results of a KNN or range query into documents.
+
+        TEXT fields are matched as phrases by the index, so the results are compared
+        with the filter, like query_by_filter does. Indexes created before a field 
+        became a TAG field still match it as TEXT.
+        
+        Args:
+            results: the results
+            metadata_fields: the metadata fields returned
+            distance_metric: the distance metric of the index, to turn the distances into relevance scores
+            return_content: whether the texts were returned
+            filter: the filter of the query
+            schema: the redis schema of the index
+        Returns:
+            docs and relevance scores
+        """
+
         docs_with_scores: List[Tuple[Document, float]] = []
         for result in results.docs:
+            if filter and not match_text_conditions(vars(result), filter, schema or {key: 'TEXT' for key in filter}):
+                continue
+
             metadata = {}
             metadata = {"id": result.id}
             
-            for key in schema.keys():
-                # TODO: Dont return the content and content vector, currently it is hard coded
-                if key != "content_vector" and key != "content":
-                    metadata[key] = result.__getattribute__(key)
-            doc = Document(page_content=result.content, metadata=metadata)
+            for key in metadata_fields:
+                metadata[key] = result.__getattribute__(key)
+            doc = Document(page_content=result.content if return_content else "", metadata=metadata)
 
-            docs_with_scores.append((doc, float(result.score)))
+            docs_with_scores.append((doc, get_relevance_score(float(result.score), distance_metric)))
 
         logger.debug(f"docs_with_scores: {docs_with_scores}")
 
         return docs_with_scores
 
-    def _contruct_redis_query(self, question: str, k: int = 4, filter: Optional[Dict[str, Any]] = None) -> Tuple[Query, Dict[str, Any]]:
+    def _contruct_redis_query(
+            self, 
+            question: str, 
+            k: int = 4, 
+            filter: Optional[Dict[str, Any]] = None,
+            return_fields: Optional[List[str]] = None,
+            ef_runtime: Optional[int] = None,
+            vector_type: np.dtype = np.float32,
+            schema: Optional[Dict[str, str]] = None,
+            radius: Optional[float] = None,
+            embedding: Optional[List[float]] = None
+        ) -> Tuple[Query, Dict[str, Any]]:
         """This function constructs a redis query.
+
+        Redis returns every field of the hashes found, including their vectors, 
+        unless the fields are listed. The score is always returned.
+
+        With a radius, the query is a VECTOR_RANGE query sorted by distance and 
+        limited to k results. HNSW range queries are tuned by EPSILON rather than 
+        EF_RUNTIME, so ef_runtime is not used.
         
         Args:
             question: the question
             filter: the filter
+            return_fields: the fields to return, None for all of them
+            ef_runtime: the EF_RUNTIME of the query, None for the one of the index
+            vector_type: the numpy type of the vectors of the index
+            schema: the redis schema of the index, the fields of the filter are TEXT fields by default
+            radius: the largest distance of the results, None for a KNN query
+            embedding: the embedding of the question, None to embed it
         Returns:
             the redis query
         """
 
-        emdeded_question = self.embeddings.embed_query(question)
+        emdeded_question = embedding if embedding is not None else self.embeddings.embed_query(question)
 
-        if filter is not None:
-            filter_expression = []
-            for key, value in filter.items():
-                filter_expression.append(f"@{key}:{value}")
+        knn_clause = f"KNN {k} @content_vector $vec EF_RUNTIME $ef_runtime" if ef_runtime is not None else f"KNN {k} @content_vector $vec"
 
-            filter_expression = " ".join(filter_expression)
+        if radius is not None:
+            # The filter and the range are intersected, the results are the k nearest in the range
+            range_clause = "@content_vector:[VECTOR_RANGE $radius $vec]=>{$YIELD_DISTANCE_AS: score}"
+            if filter:
+                range_clause = f"{range_clause} {compile_filter(filter, schema or {key: 'TEXT' for key in filter})}"
+
+            query = (
+                Query(range_clause)
+                .sort_by("score")
+                .dialect(2)
+            )
+
+        elif filter:
+            # The filter is applied before the KNN search
+            filter_expression = compile_filter(filter, schema or {key: 'TEXT' for key in filter})
 
             # Langchain use content_vector as the default vector name
             query = (
-                Query(f"({filter_expression})=>[KNN {k} @content_vector $vec as score]")
+                Query(f"({filter_expression})=>[{knn_clause} as score]")
                 .sort_by("score")
                 .dialect(2)
             )
@@ -418,12 +982,22 @@ class RedisExtended(BaseVectorStore):
         else:
             # Langchain use content_vector as the default vector name
             query = (
-                Query(f"*=>[KNN {k} @content_vector $vec as score]")
+                Query(f"*=>[{knn_clause} as score]")
                 .sort_by("score")
                 .dialect(2)
             )
 
-        query_params = {'vec': np.array(emdeded_question).astype(np.float32).tobytes()}
+        # Searches return 10 results unless they are paged
+        query = query.paging(0, k)
+
+        if return_fields is not None:
+            query = query.return_fields(*return_fields, "score")
+
+        query_params = {'vec': np.array(emdeded_question).astype(vector_type).tobytes()}
+        if radius is not None:
+            query_params['radius'] = radius
+        elif ef_runtime is not None:
+            query_params['ef_runtime'] = ef_runtime
             
         return query, query_params
 
@@ -438,4 +1012,151 @@ class RedisExtended(BaseVectorStore):
         """
 
         redis_langchain = self._get_langchain_redis(index_name)
-        return redis_langchain.as_retriever()
\ No newline at end of file
+        return redis_langchain.as_retriever()
+class AsyncRedisExtended(RedisExtended):
+    """This class represents a Redis Vector Store for asyncio callers.
+
+    The searches run on a redis.asyncio client, shared by every store of the process
+    using the same url like the synchronous client. The schemas are read once with the 
+    synchronous client and then come from the cache, so a search only awaits the 
+    embedding of the question and the query.
+    """
+
+    def __init__(self, config: Config, embeddings: Embeddings):
+        """
+        Initialize the Async Redis Vector Store.
+
+        Args:
+            config: the config object
+            embeddings: the embeddings model
+        """
+
+        super().__init__(config, embeddings)
+        self.async_redis_client = self.get_async_client(self.redis_url)
+
+    def get_async_client(self, redis_url: str, **kwargs: Any) -> Any:
+        """This function returns the redis.asyncio client of a redis url.
+
+        The client is created once per url, with a cluster client if the synchronous 
+        connection found a cluster. Its connections belong to the event loop that 
+        first uses them, so a process should serve its asyncio callers from one loop.
+        
+        Args:
+            redis_url: the redis url
+            kwargs: the keyword arguments of the client, only used by the first call
+        Returns:
+            the redis.asyncio client
+        """
+
+        import redis.asyncio
+
+        with _redis_clients_lock:
+            redis_client = _redis_async_clients.get(redis_url)
+            if redis_client is None:
+                kwargs.setdefault('max_connections', self.config.REDIS_MAX_CONNECTIONS)
+                if _redis_clusters.get(redis_url, False):
+                    redis_client = redis.asyncio.RedisCluster.from_url(redis_url, **kwargs)
+                else:
+                    redis_client = redis.asyncio.from_url(redis_url, **kwargs)
+                _redis_async_clients[redis_url] = redis_client
+
+        return redis_client
+
+    async def _aembed_query(self, question: str) -> List[float]:
+        """This function embeds a question without blocking the event loop.
+        
+        Args:
+            question: the question
+        Returns:
+            the embedding
+        """
+
+        try:
+            return await self.embeddings.aembed_query(question)
+        except NotImplementedError:
+            # Not every embeddings model is asynchronous
+            return await asyncio.get_running_loop().run_in_executor(None, self.embeddings.embed_query, question)
+
+    async def asimilarity_search( 
+            self, 
+            query: str, 
+            k: int = 4, 
+            filter: Optional[Dict[str, Any]] = None,
+            index_name: Optional[str] = None,
+            return_content: bool = True,
+            ef_runtime: Optional[int] = None,
+            score_threshold: Optional[float] = None,
+            radius: Optional[float] = None
+        ) -> List[Tuple[Document, float]]:
+        """This function performs a similarity search, see similarity_search.
+        
+        Args:
+            query: the query
+            k: the number of results
+            filter: the filter
+            index_name: the index name
+            return_content: whether to fetch the texts, the documents are empty otherwise
+            ef_runtime: the EF_RUNTIME of this search, None for the one of the index
+            score_threshold: the smallest relevance score of the documents
+            radius: the largest distance of the documents, in the distance metric of the index
+        Returns:
+            docs and relevance scores in the range [0, 1].
+        """
+
+        radius = self._get_search_radius(score_threshold, radius, index_name)
+
+        embedding = await self._aembed_query(query)
+
+        try:
+            docs_with_scores = await self._asearch(embedding, k, filter, self._get_redis_schema(index_name), index_name, return_content, ef_runtime, radius)
+        except ResponseError as e:
+            # The index may have been created again with another schema
+            logger.info(f"Search of index '{index_name}' failed with '{e}', refreshing its schema")
+            docs_with_scores = await self._asearch(embedding, k, filter, self._get_redis_schema(index_name, refresh=True), index_name, return_content, ef_runtime, radius)
+
+        return filter_by_score(docs_with_scores, score_threshold)
+
+    async def _asearch(
+            self, 
+            embedding: List[float], 
+            k: int, 
+            filter: Optional[Dict[str, Any]], 
+            schema: Dict[str, str], 
+            index_name: Optional[str] = None,
+            return_content: bool = True,
+            ef_runtime: Optional[int] = None,
+            radius: Optional[float] = None
+        ) -> List[Tuple[Document, float]]:
+        """This function runs a KNN or range query on the asyncio client.
+        
+        Args:
+            embedding: the embedding of the question
+            k: the number of results
+            filter: the filter
+            schema: the redis schema of the index
+            index_name: the index name
+            return_content: whether to fetch the texts
+            ef_runtime: the EF_RUNTIME of the query
+            radius: the largest distance of the results, None for a KNN query
+        Returns:
+            docs and scores
+        """
+
+        metadata_fields = [key for key in schema.keys() if key != "content_vector" and key != "content"]
+        return_fields = metadata_fields + ["content"] if return_content else metadata_fields
+
+        query, query_params = self._contruct_redis_query(
+            question=None, 
+            k=k, 
+            filter=filter, 
+            return_fields=return_fields,
+            ef_runtime=ef_runtime,
+            vector_type=self._get_vector_type(index_name),
+            schema=schema,
+            radius=radius,
+            embedding=embedding
+        )
+
+        results = await self.async_redis_client.ft(format_index_name(index_name)).search(query, query_params = query_params)
+
+        return self._to_documents(results, metadata_fields, self._get_distance_metric(index_name), return_content, filter, schema)
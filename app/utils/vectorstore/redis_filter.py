@@ -0,0 +1,155 @@
+import re
+import logging
+from numbers import Number
+from typing import Any, Dict, List
+
+from app.utils.vectorstore.metadata_index import RANGE_OPERATORS
+
+logger = logging.getLogger(__name__)
+
+# Every character of a TAG value that is not a letter, digit or underscore is escaped,
+# since punctuation and spaces have a meaning in the query syntax
+TAG_SPECIAL_CHARACTERS = re.compile(r"(\W)")
+
+def escape_tag_value(value: Any) -> str:
+    """This function escapes a value to be matched exactly by a TAG field.
+
+    Args:
+        value: the value
+    Returns:
+        the escaped value
+    """
+
+    return TAG_SPECIAL_CHARACTERS.sub(r"\\\1", str(value))
+
+def escape_text_value(value: Any) -> str:
+    """This function escapes a value to be matched as a phrase by a TEXT field.
+
+    Args:
+        value: the value
+    Returns:
+        the escaped phrase, in double quotes
+    """
+
+    value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+
+    return f'"{value}"'
+
+def format_number(value: Any) -> str:
+    """This function formats a value to be matched by a NUMERIC field.
+
+    Args:
+        value: the value, a number or a string holding one
+    Returns:
+        the number
+    """
+
+    try:
+        return repr(float(value))
+    except (TypeError, ValueError):
+        raise ValueError(f"'{value}' is not a number")
+
+def compile_filter(filter: Dict[str, Any], schema: Dict[str, str]) -> str:
+    """This function compiles a filter into a RediSearch query.
+
+    A filter maps fields to a condition, and a document matches if it matches the
+    condition of every field. A condition is one of:
+    - a value, matched exactly by TAG and NUMERIC fields, and as a phrase by TEXT fields
+    - a list of values, matching any of them
+    - a range of a NUMERIC field, as a dict of the operators gt, gte, lt and lte
+    - a dict {'not': condition}, matching the documents that do not match the condition
+
+    The values are escaped, and the fields must be in the schema of the index, so
+    a filter cannot change the query.
+
+    Args:
+        filter: the filter
+        schema: the redis schema of the index, the type of each field
+    Returns:
+        the query, * for an empty filter
+    """
+
+    clauses = []
+    for key, condition in filter.items():
+        field_type = schema.get(key)
+        if field_type not in ('TAG', 'TEXT', 'NUMERIC'):
+            raise ValueError(f"Cannot filter on field '{key}' of the index")
+
+        clauses.append(compile_condition(key, condition, field_type))
+
+    return " ".join(clauses) if len(clauses) > 0 else "*"
+
+def compile_condition(key: str, condition: Any, field_type: str) -> str:
+    """This function compiles the condition of a field into a RediSearch query.
+
+    Args:
+        key: the field
+        condition: the condition, see compile_filter
+        field_type: the type of the field, TAG, TEXT or NUMERIC
+    Returns:
+        the query
+    """
+
+    if isinstance(condition, dict) and 'not' in condition:
+        if len(condition) > 1:
+            raise ValueError(f"The condition 'not' of '{key}' cannot be combined with other operators")
+
+        return f"-{compile_condition(key, condition['not'], field_type)}"
+
+    if isinstance(condition, dict):
+        unknown_operators = set(condition) - set(RANGE_OPERATORS)
+        if unknown_operators:
+            raise ValueError(f"Unsupported range operators {sorted(unknown_operators)} for '{key}'")
+        if field_type != 'NUMERIC':
+            raise ValueError(f"Cannot filter the {field_type} field '{key}' by range")
+
+        low, high = '-inf', '+inf'
+        for operator, bound in condition.items():
+            exclusive = '(' if operator in ('gt', 'lt') else ''
+            if operator in ('gt', 'gte'):
+                low = f"{exclusive}{format_number(bound)}"
+            else:
+                high = f"{exclusive}{format_number(bound)}"
+
+        return f"@{key}:[{low} {high}]"
+
+    values = condition if isinstance(condition, list) else [condition]
+    if len(values) == 0:
+        raise ValueError(f"The list of values of '{key}' is empty")
+
+    if field_type == 'TAG':
+        return f"@{key}:{{{' | '.join(escape_tag_value(value) for value in values)}}}"
+
+    if field_type == 'NUMERIC':
+        ranges = [f"@{key}:[{format_number(value)} {format_number(value)}]" for value in values]
+        return ranges[0] if len(ranges) == 1 else f"({' | '.join(ranges)})"
+
+    phrases = [escape_text_value(value) for value in values]
+    return f"@{key}:{phrases[0]}" if len(phrases) == 1 else f"@{key}:({' | '.join(phrases)})"
+
+def match_text_conditions(values: Dict[str, Any], filter: Dict[str, Any], schema: Dict[str, str]) -> bool:
+    """This function checks the conditions of the TEXT fields of a filter on a document.
+
+    TEXT fields match phrases, so a document found may hold more than the values
+    of a filter. The other fields match exactly.
+
+    Args:
+        values: the values of the fields of the document
+        filter: the filter, see compile_filter
+        schema: the redis schema of the index
+    Returns:
+        whether the document holds exactly the values
+    """
+
+    def match(value: Any, condition: Any) -> bool:
+        if isinstance(condition, dict) and 'not' in condition:
+            return not match(value, condition['not'])
+
+        conditions = condition if isinstance(condition, list) else [condition]
+
+        return str(value) in [str(condition) for condition in conditions]
+
+    return all(
+        match(values.get(key), condition) for key, condition in filter.items()
+        if schema.get(key) == 'TEXT'
+    )
@@ -0,0 +1,130 @@
+import os
+import json
+import zlib
+import struct
+import logging
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Checksum and length of the payload of a record
+RECORD_HEADER = struct.Struct('<IQ')
+# Length of the JSON part of a payload
+PAYLOAD_HEADER = struct.Struct('<I')
+
+class WriteAheadLog:
+    """This class represents the append-only log of the changes made to a FAISS index since its last snapshot.
+
+    Every record is an operation on a batch: either texts added with their metadata,
+    their vectors and their ids, or the ids of deleted texts. A record is a checksum 
+    and a length, followed by a JSON header and the float32 vectors. A record cut 
+    short by a crash fails its checksum and ends the log.
+    """
+
+    def __init__(self, folder_path: str, name: str):
+        """
+        Initialize the Write Ahead Log.
+
+        Args:
+            folder_path: the folder of the index
+            name: the name of the index
+        """
+
+        self.file_path = os.path.join(folder_path, f"{name}.wal")
+
+        # The end of the last complete record read
+        self.valid_size = 0
+
+    def append(
+            self,
+            texts: List[str],
+            metadatas: List[Optional[Dict[str, Any]]],
+            vectors: np.ndarray,
+            op: str = 'add',
+            ids: Optional[List[int]] = None
+        ) -> None:
+        """This function appends a record to the log and syncs it to disk.
+
+        Args:
+            texts: the texts
+            metadatas: the metadata of the texts
+            vectors: the vectors of the texts
+            op: the operation of the record, add or delete
+            ids: the ids of the texts
+        Returns:
+            none
+        """
+
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+
+        header = json.dumps(
+            {'op': op, 'texts': texts, 'metadatas': metadatas, 'ids': ids, 'dimension': vectors.shape[1]},
+            ensure_ascii=False
+        ).encode('utf-8')
+        payload = PAYLOAD_HEADER.pack(len(header)) + header + vectors.tobytes()
+
+        with open(self.file_path, 'ab') as f:
+            f.write(RECORD_HEADER.pack(zlib.crc32(payload), len(payload)) + payload)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read(self, offset: int = 0) -> Iterator[Dict[str, Any]]:
+        """This function reads the records of the log in order.
+
+        valid_size is updated as the records are read, so once they are all read it
+        is the offset to read the next records from.
+
+        Args:
+            offset: the end of the records already read
+        Yields:
+            the records, with the keys op, texts, metadatas, ids and vectors
+        """
+
+        self.valid_size = offset
+
+        if not self.exists():
+            return
+
+        with open(self.file_path, 'rb') as f:
+            f.seek(offset)
+            while True:
+                record_header = f.read(RECORD_HEADER.size)
+                if not record_header:
+                    return
+
+                payload = b''
+                if len(record_header) == RECORD_HEADER.size:
+                    checksum, length = RECORD_HEADER.unpack(record_header)
+                    payload = f.read(length)
+
+                if len(record_header) < RECORD_HEADER.size or len(payload) < length or zlib.crc32(payload) != checksum:
+                    logger.warning(f"Ignoring the incomplete record at the end of '{self.file_path}'")
+                    return
+
+                header_length, = PAYLOAD_HEADER.unpack_from(payload)
+                record = json.loads(payload[PAYLOAD_HEADER.size:PAYLOAD_HEADER.size + header_length])
+                record['vectors'] = np.frombuffer(
+                    payload, dtype=np.float32, offset=PAYLOAD_HEADER.size + header_length
+                ).reshape(-1, record.pop('dimension'))
+
+                self.valid_size += RECORD_HEADER.size + length
+
+                yield record
+
+    def size(self) -> int:
+        """The size of the log in bytes."""
+
+        return os.path.getsize(self.file_path) if self.exists() else 0
+
+    def exists(self) -> bool:
+        """Whether the log has been written."""
+
+        return os.path.exists(self.file_path)
+
+    def remove(self) -> None:
+        """This function removes the log, once its records are in a snapshot."""
+
+        if self.exists():
+            os.remove(self.file_path)
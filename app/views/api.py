@@ -10,6 +10,7 @@ from app.utils.index import get_indexer
 from app.utils.conversation.bot import LLMChatBot
 from app.utils.conversation import Message
 from app.utils.file.parser import get_parser
+from app.utils.llm.rate_limit import RateLimitExceeded, get_rate_limiter_stats
 from app.config import Config
 
 logger = logging.getLogger(__name__)
@@ -28,6 +29,18 @@ def hello_api():
 
     return 'Hello World!'
 
+@app.errorhandler(RateLimitExceeded)
+def rate_limit_exceeded(error):
+    """Answer 429 instead of keeping the worker waiting for the OpenAI quota"""
+
+    return {'data': str(error)}, 429
+
+@app.route(API_PREFIX('/llm/rate_limits'), methods=['GET'])
+def rate_limits():
+    """Return the queue depth, concurrency limit and throttling of every OpenAI deployment"""
+
+    return jsonify(get_rate_limiter_stats())
+
 @app.route(API_PREFIX('/parser/document'), methods=['POST'])
 def parser_document():
     """Handle document parsing"""
@@ -63,7 +76,7 @@ def indexer():
 
     elif request.method == 'DELETE':
         # Delete index
-        indexer.delete_index(index_name=index_name)
+        indexer.drop_index(index_name=index_name)
         return 'Index deleted'
     
     else:
@@ -93,8 +106,17 @@ def document():
 
     elif request.method == 'DELETE':
         # Delete document
-        
-        return jsonify({'data': 'Document delted'})
+
+        source_url = request.json['source_url']
+        index_name = request.json['index_name']
+
+        if not indexer.check_existing_index(index_name=index_name):
+            return {'data': f'Index {index_name} does not exist'}, 400
+
+        if indexer.delete_document(source_url=source_url, index_name=index_name) == 0:
+            return {'data': f'Document {source_url} does not exist'}, 404
+
+        return jsonify({'data': 'Document deleted'})
     
     else:
         raise ValueError('Method not supported')
@@ -67,7 +67,7 @@ def indexer(req: func.HttpRequest) -> func.HttpResponse:
 
     elif req.method.upper() == 'DELETE':
         # Delete index
-        indexer.delete_index(index_name=index_name)
+        indexer.drop_index(index_name=index_name)
         return func.HttpResponse('Index deleted')
     
     else:
@@ -96,9 +96,18 @@ def document(req: func.HttpRequest) -> func.HttpResponse:
         
         return func.HttpResponse(json.dumps({'data': 'Document indexed'}))
 
-    elif req.method.upper == 'DELETE':
+    elif req.method.upper() == 'DELETE':
         # Delete document
-        
+
+        source_url = req.get_json()['source_url']
+        index_name = req.get_json()['index_name']
+
+        if not indexer.check_existing_index(index_name=index_name):
+            return func.HttpResponse(json.dumps({'data': f'Index {index_name} does not exist'}), status_code=400)
+
+        if indexer.delete_document(source_url=source_url, index_name=index_name) == 0:
+            return func.HttpResponse(json.dumps({'data': f'Document {source_url} does not exist'}), status_code=404)
+
         return func.HttpResponse(json.dumps({'data': 'Document deleted'}))
     
     else:
@@ -1,4 +1,9 @@
+import os
 import pytest
+
+# The app is created when it is imported, the tests must not write an embedding cache
+os.environ['EMBEDDING_CACHE'] = 'false'
+
 from app.config import Config
 
 # Default config for testing
@@ -1,5 +1,6 @@
 import logging
 import pytest
+from datetime import datetime, timedelta
 
 from app.config import Config
 from app.utils.conversation.history import HistoryManager
@@ -187,4 +188,51 @@ def test_get_all_messages(history_managers):
         assert messsages[2].text == "What can you do?"
         assert messsages[3].text == "I can answer your questions."
 
-        history_manager.clear_all_history()
\ No newline at end of file
+        history_manager.clear_all_history()
+
+
+def test_maintain_history(history_managers):
+    """This function tests removing the expired history."""
+
+    for vector_store_type, history_manager in history_managers.items():
+        logger.info(f'Testing {vector_store_type} maintain history')
+
+        # Session 1 started long before the history expires
+        history_manager.start_session("1", "1", datetime.now() - timedelta(seconds=history_manager.history_ttl + 1))
+        history_manager.start_session("2", "1")
+
+        for i in range(0, len(test_messages), 2):
+            history_manager.add_qa_pair(test_messages[i], test_messages[i+1])
+
+        report = history_manager.maintain_history()
+
+        assert report == {'num_docs': 2, 'num_added': 4, 'num_removed': 2, 'num_expired_sessions': 1}
+        assert history_manager.get_session("1") is None
+        assert history_manager.get_all_messages("1") == []
+        assert len(history_manager.get_all_messages("2")) == 2
+
+        report = history_manager.maintain_history()
+        assert report == {'num_docs': 2, 'num_added': 0, 'num_removed': 0, 'num_expired_sessions': 0}
+
+        history_manager.clear_all_history()
+
+def test_maintain_history_if_due(history_managers):
+    """This function tests the history is maintained in the background once the interval passed."""
+
+    for vector_store_type, history_manager in history_managers.items():
+        logger.info(f'Testing {vector_store_type} maintain history if due')
+
+        history_manager.start_session("1", "1", datetime.now() - timedelta(seconds=history_manager.history_ttl + 1))
+        history_manager.add_qa_pair(test_messages[0], test_messages[1])
+
+        assert history_manager.maintain_history_if_due() is None
+
+        history_manager.last_maintenance_time = datetime.now() - timedelta(seconds=history_manager.config.CHATBOT_HISTORY_MAINTENANCE_INTERVAL + 1)
+        maintenance = history_manager.maintain_history_if_due()
+        assert maintenance is not None
+
+        maintenance.join()
+        assert history_manager.get_session("1") is None
+        assert history_manager.get_all_messages("1") == []
+
+        history_manager.clear_all_history()
@@ -0,0 +1,83 @@
+import logging
+import threading
+from datetime import datetime
+from unittest import mock
+
+from app.utils.conversation.session import LocalSessionRegistry, RedisSessionRegistry
+
+logger = logging.getLogger(__name__)
+
+def test_create_and_get_session():
+    """This function tests recording a session."""
+
+    session_registry = LocalSessionRegistry()
+
+    start_time = datetime(2021, 1, 1)
+    session_registry.create_session("1", "user", start_time)
+
+    session = session_registry.get_session("1")
+    assert session.user_id == "user"
+    assert session.start_time == start_time
+    assert session.sequence_num == 0
+    assert session.message_count == 0
+
+    assert session_registry.get_session("2") is None
+
+    session_registry.clear_all_sessions()
+    assert session_registry.get_session("1") is None
+
+def test_add_messages():
+    """This function tests reserving the sequence numbers of messages."""
+
+    session_registry = LocalSessionRegistry()
+    session_registry.create_session("1", "user")
+
+    assert session_registry.add_messages("1", 2) == 1
+    assert session_registry.add_messages("1", 2) == 3
+
+    # Concurrent turns never get the same sequence numbers
+    sequence_nums = []
+    threads = [threading.Thread(target=lambda: sequence_nums.append(session_registry.add_messages("1", 2))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sorted(sequence_nums) == list(range(5, 21, 2))
+
+    session = session_registry.get_session("1")
+    assert session.sequence_num == 20
+    assert session.message_count == 20
+
+def test_redis_add_messages():
+    """This function tests a Redis session hash created by reserving sequence numbers gets a start time."""
+
+    redis_client = mock.MagicMock()
+    pipeline = redis_client.pipeline.return_value
+    pipeline.execute.return_value = [2, 2, 1, True]
+
+    session_registry = RedisSessionRegistry(redis_client, ttl=60)
+    assert session_registry.add_messages("1", 2) == 1
+
+    key, field, _ = pipeline.hsetnx.call_args.args
+    assert key.endswith(":1")
+    assert field == "start_time"
+
+def test_redis_remove_expired_sessions():
+    """This function tests the Redis sessions not updated within the TTL are returned once their hash expired."""
+
+    redis_client = mock.MagicMock()
+    pipeline = redis_client.pipeline.return_value
+    pipeline.execute.return_value = [[b"1", b"2"], 2]
+
+    session_registry = RedisSessionRegistry(redis_client, ttl=60)
+    assert session_registry.remove_expired_sessions(60) == ["1", "2"]
+
+    key, _, max_update_time = pipeline.zrangebyscore.call_args.args
+    assert pipeline.zremrangebyscore.call_args.args == (key, '-inf', max_update_time)
+    assert max_update_time <= datetime.now().timestamp() - 60
+
+    session_registry.create_session("3", "user")
+    updates_key, mapping = pipeline.zadd.call_args.args
+    assert updates_key == key
+    assert list(mapping) == ["3"]
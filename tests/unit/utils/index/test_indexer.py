@@ -86,7 +86,7 @@ def test_similarity_search(indexer):
 
     for key in indexer:
         # Add the test document
-        indexer[key].vector_store.add_documents([doc])
+        indexer[key].vector_store.add_documents([doc], index_name='test')
 
         result = indexer[key].similarity_search(query, k = 1, index_name = 'test')
 
@@ -125,4 +125,21 @@ def test_get_retriever(indexer):
         result = retriever.get_relevant_documents(query)
 
         logger.info(result[0].page_content)
-        assert len(result) > 0
\ No newline at end of file
+        assert len(result) > 0
+
+
+def test_delete_document(indexer):
+    """This function tests delete document function."""
+
+    for key in indexer:
+        indexer[key].add_document('samples/A.txt', index_name='test')
+        num_chunks = len(indexer[key].similarity_search("Michael Jordan", k=100, filter={"source": "samples/A.txt"}, index_name='test'))
+        assert num_chunks > 0
+
+        # Adding the document again replaces its chunks
+        indexer[key].add_document('samples/A.txt', index_name='test')
+        result = indexer[key].similarity_search("Michael Jordan", k=100, filter={"source": "samples/A.txt"}, index_name='test')
+        assert len(result) == num_chunks
+
+        assert indexer[key].delete_document('samples/A.txt', index_name='test') == num_chunks
+        assert indexer[key].similarity_search("Michael Jordan", k=100, filter={"source": "samples/A.txt"}, index_name='test') == []
@@ -0,0 +1,98 @@
+import logging
+from typing import List
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+from app.utils.llm.embedding_cache import EmbeddingCache, CachedEmbeddings, TAG_SIZE
+
+logger = logging.getLogger(__name__)
+
+class CountingEmbeddings(Embeddings):
+    """Embeds a text as its length and records the texts sent."""
+
+    def __init__(self):
+        self.texts = []
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.texts += texts
+        return [[float(len(text)), 1.0, 2.0] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.texts.append(text)
+        return [float(len(text)), 1.0, 2.0]
+
+def test_cached_embeddings(tmp_path):
+    """Test cached texts are not embedded again, in the process or by another one."""
+
+    model = CountingEmbeddings()
+    embeddings = CachedEmbeddings(model, EmbeddingCache(str(tmp_path), memory_items=2))
+
+    assert embeddings.embed_documents(['a', 'bb', 'a']) == [[1.0, 1.0, 2.0], [2.0, 1.0, 2.0], [1.0, 1.0, 2.0]]
+    assert model.texts == ['a', 'bb']
+
+    assert embeddings.embed_query('bb') == [2.0, 1.0, 2.0]
+    assert embeddings.embed_documents(['ccc', 'a']) == [[3.0, 1.0, 2.0], [1.0, 1.0, 2.0]]
+    assert model.texts == ['a', 'bb', 'ccc']
+
+    # A new cache only has the disk tier
+    other_model = CountingEmbeddings()
+    other_embeddings = CachedEmbeddings(other_model, EmbeddingCache(str(tmp_path)))
+
+    assert other_embeddings.embed_documents(['a', 'bb', 'ccc', 'dddd']) == [[float(i), 1.0, 2.0] for i in range(1, 5)]
+    assert other_model.texts == ['dddd']
+
+def test_eviction(tmp_path):
+    """Test the least recently used embeddings are evicted once the cache is full."""
+
+    record_size = TAG_SIZE + 3 * 4
+    cache = EmbeddingCache(str(tmp_path), max_size=record_size * 10, memory_items=1)
+    keys = [bytes([i]) * 32 for i in range(30)]
+
+    for key in keys:
+        cache.put([key], [np.array([1.0, 2.0, 3.0], dtype=np.float32)])
+
+    # The first key is only touched in memory, and the memory holds one embedding
+    found = [key for key, vector in zip(keys, cache.get(keys)) if vector is not None]
+
+    assert len(found) <= 10
+    assert keys[-1] in found
+    assert keys[0] not in found
+    assert (tmp_path / 'vectors.bin').stat().st_size <= record_size * 10
+
+def test_read_only_folder(tmp_path):
+    """Test the cache only keeps embeddings in memory if its folder cannot be written."""
+
+    blocker = tmp_path / 'file'
+    blocker.write_text('')
+
+    model = CountingEmbeddings()
+    embeddings = CachedEmbeddings(model, EmbeddingCache(str(blocker / 'cache')))
+
+    assert embeddings.embed_documents(['a', 'a']) == [[1.0, 1.0, 2.0], [1.0, 1.0, 2.0]]
+    assert embeddings.embed_query('a') == [1.0, 1.0, 2.0]
+    assert model.texts == ['a']
+
+def test_memory_hits_refresh_disk(tmp_path, monkeypatch):
+    """Test embeddings only found in memory are not evicted first from the disk tier, and pending hits are written in batches."""
+
+    monkeypatch.setattr('app.utils.llm.embedding_cache.TOUCH_BATCH_SIZE', 2)
+
+    record_size = TAG_SIZE + 3 * 4
+    cache = EmbeddingCache(str(tmp_path), max_size=record_size * 100, memory_items=100)
+    vector = np.array([1.0, 2.0, 3.0], dtype=np.float32)
+    keys = [bytes([i]) * 32 for i in range(150)]
+
+    cache.put([keys[0]], [vector])
+    for key in keys[1:100]:
+        cache.put([key], [vector])
+        # The first key is a hit of the memory tier, its last use is written every other hit
+        cache.get([keys[0]])
+        assert len(cache._touched) < 2
+
+    for key in keys[100:]:
+        cache.put([key], [vector])
+
+    other_cache = EmbeddingCache(str(tmp_path))
+    assert other_cache.get([keys[0]])[0] is not None
+    assert other_cache.get([keys[1]])[0] is None
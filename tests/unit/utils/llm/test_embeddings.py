@@ -0,0 +1,48 @@
+import threading
+import logging
+from typing import List
+
+from langchain.embeddings.base import Embeddings
+
+from app.utils.llm.embeddings import BatchedEmbeddings
+
+logger = logging.getLogger(__name__)
+
+class RecordingEmbeddings(Embeddings):
+    """Embeds a text as its length and records the batches sent."""
+
+    def __init__(self):
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self.lock:
+            self.batches.append(list(texts))
+        return [[float(len(text))] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return [float(len(text))]
+
+def test_get_batches():
+    """Test the batches respect the batch size and the token budget."""
+
+    embeddings = BatchedEmbeddings(RecordingEmbeddings(), batch_size=3, max_batch_tokens=10, count_tokens=len)
+
+    batches = embeddings.get_batches(['a', 'b', 'c', 'd', 'eeeeeeeeeeee', 'ffff', 'gggggg', 'h'])
+
+    assert batches == [['a', 'b', 'c'], ['d'], ['eeeeeeeeeeee'], ['ffff', 'gggggg'], ['h']]
+    assert embeddings.get_batches([]) == []
+
+def test_embed_documents():
+    """Test the embeddings are returned in the order of the texts."""
+
+    model = RecordingEmbeddings()
+    embeddings = BatchedEmbeddings(model, batch_size=2, max_batch_tokens=100, max_concurrency=4, count_tokens=len)
+
+    texts = ['x' * i for i in range(1, 12)]
+    result = embeddings.embed_documents(texts)
+
+    assert result == [[float(i)] for i in range(1, 12)]
+    assert len(model.batches) == 6
+    assert all(len(batch) <= 2 for batch in model.batches)
+    assert embeddings.embed_query('abc') == [3.0]
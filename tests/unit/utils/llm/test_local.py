@@ -0,0 +1,40 @@
+import logging
+
+import numpy as np
+from langchain.schema.messages import HumanMessage
+
+from app.utils.llm import LLMHelper
+from app.utils.llm.local import LocalEmbeddings, LocalChatModel
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+def test_local_embeddings():
+    """Test the local embeddings are deterministic, normalized and similar for similar texts."""
+
+    embeddings = LocalEmbeddings(size=256)
+
+    vectors = np.array(embeddings.embed_documents(['the cat sat on the mat', 'the cat sat on a mat', 'stock market report', '']))
+
+    assert vectors.shape == (4, 256)
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0)
+    assert np.allclose(vectors[0], embeddings.embed_query('the cat sat on the mat'))
+    assert vectors[0] @ vectors[1] > vectors[0] @ vectors[2]
+
+def test_local_chat_model():
+    """Test the stub chat model answers with the words of the last message."""
+
+    llm = LocalChatModel(response_tokens=3)
+
+    assert llm([HumanMessage(content='what is the capital of France')]).content == 'what is the'
+    assert ''.join(chunk.content for chunk in llm.stream([HumanMessage(content='a b')])) == 'a b'
+
+def test_get_local_llm():
+    """Test LLM_TYPE=local needs no OpenAI settings."""
+
+    config = Config()
+    config.LLM_TYPE = 'local'
+    llm_helper = LLMHelper(config)
+
+    assert isinstance(llm_helper.get_llm(), LocalChatModel)
+    assert len(llm_helper.get_embeddings().embed_query('hello')) == int(config.OPENAI_EMBEDDING_SIZE)
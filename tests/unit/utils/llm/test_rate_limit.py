@@ -0,0 +1,132 @@
+import time
+import logging
+import threading
+
+import openai
+import pytest
+
+from app.utils.llm.rate_limit import RateLimiter, RateLimitExceeded, RateLimitedClient, get_retry_after
+
+logger = logging.getLogger(__name__)
+
+def test_retry_throttled_request():
+    """Test a throttled request is retried after the retry-after time, and the concurrency limit halves."""
+
+    rate_limiter = RateLimiter('test', max_concurrency=8, max_retries=2)
+    attempts = []
+
+    def request():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise openai.error.RateLimitError('Too many requests', headers={'retry-after-ms': '100'})
+        return {'usage': {'total_tokens': 3}}
+
+    assert rate_limiter.call(request) == {'usage': {'total_tokens': 3}}
+    assert attempts[1] - attempts[0] >= 0.09
+
+    stats = rate_limiter.get_stats()
+    assert stats['num_throttled'] == 1
+    assert stats['concurrency_limit'] == 4
+    assert stats['in_flight'] == 0 and stats['queue_depth'] == 0
+
+def test_errors_not_retried():
+    """Test invalid requests fail at once."""
+
+    rate_limiter = RateLimiter('test')
+
+    def request():
+        raise openai.error.InvalidRequestError('Bad request', None)
+
+    with pytest.raises(openai.error.InvalidRequestError):
+        rate_limiter.call(request)
+
+    assert rate_limiter.get_stats()['in_flight'] == 0
+
+def test_token_budget():
+    """Test requests over the tokens per minute wait, and fail if they would wait too long."""
+
+    # 600 tokens per minute is a bucket of 100 tokens refilled at 10 tokens per second
+    rate_limiter = RateLimiter('test', tokens_per_minute=600, max_wait=0.5)
+
+    rate_limiter.call(lambda: None, tokens=95)
+
+    start = time.monotonic()
+    rate_limiter.call(lambda: None, tokens=5)
+    rate_limiter.call(lambda: None, tokens=2)
+    assert time.monotonic() - start >= 0.15
+
+    with pytest.raises(RateLimitExceeded):
+        rate_limiter.call(lambda: None, tokens=50)
+
+def test_concurrency_limit():
+    """Test no more requests than the concurrency limit are in flight."""
+
+    rate_limiter = RateLimiter('test', max_concurrency=2)
+    in_flight, peak = [0], [0]
+    lock = threading.Lock()
+
+    def request():
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+        time.sleep(0.02)
+        with lock:
+            in_flight[0] -= 1
+
+    threads = [threading.Thread(target=rate_limiter.call, args=(request,)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert peak[0] == 2
+
+def test_rate_limited_client():
+    """Test the client estimates the tokens of chat and embedding requests."""
+
+    client = RateLimitedClient(None, RateLimiter('test'), count_tokens=lambda text: len(text.split()))
+
+    assert client.estimate_tokens(messages=[{'role': 'user', 'content': 'a b c'}], max_tokens=10) == 13
+    assert client.estimate_tokens(input=[[1, 2, 3], [4, 5]]) == 5
+    assert client.estimate_tokens(input=['a b', 'c']) == 3
+
+def test_get_retry_after():
+    """Test the retry-after headers are read."""
+
+    assert get_retry_after({'Retry-After': '2'}) == 2.0
+    assert get_retry_after({'retry-after-ms': '250'}) == 0.25
+    assert get_retry_after({}) is None
+
+def test_stream_holds_slot():
+    """Test a streamed response holds its slot until it is read or closed."""
+
+    rate_limiter = RateLimiter('test', max_concurrency=1, max_wait=0.1)
+
+    stream = rate_limiter.call(lambda: iter(['a', 'b']), stream=True)
+    assert rate_limiter.get_stats()['in_flight'] == 1
+
+    with pytest.raises(RateLimitExceeded):
+        rate_limiter.call(lambda: None)
+
+    assert list(stream) == ['a', 'b']
+    assert rate_limiter.get_stats()['in_flight'] == 0
+
+    stream = rate_limiter.call(lambda: iter(['a', 'b']), stream=True)
+    stream.close()
+    stream.close()
+    assert rate_limiter.get_stats()['in_flight'] == 0
+
+def test_retries_bounded_by_max_wait():
+    """Test the retries of a failing request stop once they would wait longer than max_wait."""
+
+    rate_limiter = RateLimiter('test', max_retries=100, max_wait=0.2)
+
+    def request():
+        raise openai.error.RateLimitError('Too many requests', headers={'retry-after-ms': '100'})
+
+    start = time.monotonic()
+    with pytest.raises(RateLimitExceeded):
+        rate_limiter.call(request)
+
+    assert time.monotonic() - start < 0.5
+    assert rate_limiter.get_stats()['in_flight'] == 0
@@ -0,0 +1,93 @@
+import os
+import json
+import logging
+import shutil
+
+import numpy as np
+
+from langchain.docstore.document import Document
+
+from app.utils.vectorstore.docstore import MmapDocstore
+
+logger = logging.getLogger(__name__)
+
+DOCSTORE_TEST_FOLDER = 'tests/unit/utils/vectorstore/test_docstore'
+
+def test_write_and_load():
+    """This function tests writing and memory-mapping a docstore."""
+
+    documents = [
+        Document(page_content="This is a test document from local.", metadata={"source": "local", "chunk_id": 0}),
+        Document(page_content="This is a test document from web. 你好", metadata={"source": "web", "chunk_id": 1})
+    ]
+
+    os.makedirs(DOCSTORE_TEST_FOLDER, exist_ok=True)
+    MmapDocstore.write(DOCSTORE_TEST_FOLDER, 'index', documents)
+
+    assert MmapDocstore.exists(DOCSTORE_TEST_FOLDER, 'index') == True
+    assert MmapDocstore.exists(DOCSTORE_TEST_FOLDER, 'another_index') == False
+
+    docstore = MmapDocstore.load(DOCSTORE_TEST_FOLDER, 'index')
+
+    assert len(docstore) == 2
+    assert docstore.search(1).page_content == "This is a test document from web. 你好"
+    assert docstore.search('0').metadata == {"source": "local", "chunk_id": 0}
+    assert isinstance(docstore.search(2), str)
+
+    shutil.rmtree(DOCSTORE_TEST_FOLDER)
+
+def test_write_and_load_empty():
+    """This function tests an empty docstore."""
+
+    os.makedirs(DOCSTORE_TEST_FOLDER, exist_ok=True)
+    MmapDocstore.write(DOCSTORE_TEST_FOLDER, 'index', [])
+
+    docstore = MmapDocstore.load(DOCSTORE_TEST_FOLDER, 'index')
+
+    assert len(docstore) == 0
+
+    shutil.rmtree(DOCSTORE_TEST_FOLDER)
+
+def test_append_and_write():
+    """This function tests appending documents and writing them with an interned source table."""
+
+    docstore = MmapDocstore.from_documents([
+        Document(page_content="This is a test document from local.", metadata={"source": "local", "chunk_id": 0}),
+        Document(page_content="Hello", metadata={"session_id": "1", "sequence_num": 2})
+    ])
+    docstore.append([Document(page_content="This is another test document from local.", metadata={"source": "local", "chunk_id": 1})])
+
+    assert len(docstore) == 3
+    assert docstore.sources == ["local"]
+    assert docstore.search(1).metadata == {"session_id": "1", "sequence_num": 2}
+
+    os.makedirs(DOCSTORE_TEST_FOLDER, exist_ok=True)
+    MmapDocstore.write(DOCSTORE_TEST_FOLDER, 'index', (docstore.search(i) for i in range(len(docstore))))
+
+    docstore = MmapDocstore.load(DOCSTORE_TEST_FOLDER, 'index')
+    docstore.append([Document(page_content="This is a test document from web.", metadata={"source": "web"})])
+
+    assert len(docstore) == 4
+    assert docstore.sources == ["local", "web"]
+    assert docstore.search(2).page_content == "This is another test document from local."
+    assert docstore.search(2).metadata == {"source": "local", "chunk_id": 1}
+    assert docstore.search(3).metadata == {"source": "web"}
+
+    shutil.rmtree(DOCSTORE_TEST_FOLDER)
+
+def test_load_json_records():
+    """This function tests loading a docstore saved as JSON records by older versions."""
+
+    record = json.dumps({'page_content': "This is a test document from local.", 'metadata': {"source": "local"}}).encode('utf-8')
+
+    os.makedirs(DOCSTORE_TEST_FOLDER, exist_ok=True)
+    with open(os.path.join(DOCSTORE_TEST_FOLDER, 'index.docs'), 'wb') as f:
+        f.write(record)
+    np.save(os.path.join(DOCSTORE_TEST_FOLDER, 'index.docs.offsets.npy'), np.array([0, len(record)], dtype=np.int64))
+
+    docstore = MmapDocstore.load(DOCSTORE_TEST_FOLDER, 'index')
+
+    assert len(docstore) == 1
+    assert docstore.search(0).metadata == {"source": "local"}
+
+    shutil.rmtree(DOCSTORE_TEST_FOLDER)
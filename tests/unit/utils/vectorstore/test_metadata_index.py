@@ -0,0 +1,92 @@
+import os
+import logging
+import shutil
+
+import numpy as np
+
+from app.utils.vectorstore.metadata_index import MetadataIndex, match_filter
+
+logger = logging.getLogger(__name__)
+
+METADATA_INDEX_TEST_FOLDER = 'tests/unit/utils/vectorstore/test_metadata_index'
+
+metadatas = [
+    {"source": "local", "chunk_id": 0},
+    {"source": "local", "chunk_id": 1},
+    {"source": "web", "chunk_id": 0, "tags": ["not", "indexed"]},
+    {"source": "web", "chunk_id": 1},
+    None
+]
+
+def test_search():
+    """This function tests resolving filters with the metadata index."""
+
+    metadata_index = MetadataIndex()
+    metadata_index.add(0, metadatas)
+
+    assert metadata_index.search({"source": "web"}).tolist() == [2, 3]
+    assert metadata_index.search({"source": ["local", "web"], "chunk_id": 1}).tolist() == [1, 3]
+    assert metadata_index.search({"chunk_id": {"gte": 1, "lt": 2}}).tolist() == [1, 3]
+    assert metadata_index.search({"source": "azure"}).tolist() == []
+    assert metadata_index.search({"tags": "indexed"}).tolist() == []
+
+def test_save_and_load():
+    """This function tests saving and loading the metadata index."""
+
+    metadata_index = MetadataIndex()
+    metadata_index.add(0, metadatas)
+
+    os.makedirs(METADATA_INDEX_TEST_FOLDER, exist_ok=True)
+    metadata_index.save(METADATA_INDEX_TEST_FOLDER, 'index')
+
+    assert MetadataIndex.exists(METADATA_INDEX_TEST_FOLDER, 'index') == True
+    assert MetadataIndex.exists(METADATA_INDEX_TEST_FOLDER, 'another_index') == False
+
+    metadata_index = MetadataIndex.load(METADATA_INDEX_TEST_FOLDER, 'index')
+    assert metadata_index.search({"source": "local", "chunk_id": 1}).tolist() == [1]
+
+    # Loaded postings can still be added to
+    metadata_index.add(5, [{"source": "local", "chunk_id": 2}])
+    assert metadata_index.search({"source": "local"}).tolist() == [0, 1, 5]
+
+    shutil.rmtree(METADATA_INDEX_TEST_FOLDER)
+
+def test_sort():
+    """This function tests ordering ids by their metadata with the metadata index."""
+
+    metadata_index = MetadataIndex()
+    metadata_index.add(0, metadatas)
+
+    ids = np.arange(len(metadatas))
+    assert metadata_index.sort(ids, "chunk_id").tolist() == [0, 2, 1, 3, 4]
+    assert metadata_index.sort(ids, "chunk_id", descending=True, limit=3).tolist() == [1, 3, 0]
+    assert metadata_index.sort(np.array([1, 2, 4]), "source", limit=2).tolist() == [1, 2]
+
+def test_boolean_values():
+    """This function tests booleans and the numbers equal to them have their own postings, also once saved and loaded."""
+
+    metadata_index = MetadataIndex()
+    metadata_index.add(0, [{"flag": True}, {"flag": 1}, {"flag": False}, {"flag": 0}])
+
+    assert metadata_index.search({"flag": True}).tolist() == [0]
+    assert metadata_index.search({"flag": 1}).tolist() == [1]
+    assert metadata_index.search({"flag": [False, 0]}).tolist() == [2, 3]
+    assert metadata_index.search({"flag": {"gte": 0}}).tolist() == [1, 3]
+
+    os.makedirs(METADATA_INDEX_TEST_FOLDER, exist_ok=True)
+    metadata_index.save(METADATA_INDEX_TEST_FOLDER, 'index')
+    loaded_index = MetadataIndex.load(METADATA_INDEX_TEST_FOLDER, 'index')
+    shutil.rmtree(METADATA_INDEX_TEST_FOLDER)
+
+    assert loaded_index.search({"flag": True}).tolist() == [0]
+    assert loaded_index.search({"flag": 0}).tolist() == [3]
+
+def test_match_filter():
+    """This function tests matching metadata with a filter without the metadata index."""
+
+    assert match_filter(metadatas[2], {"source": "web"})
+    assert match_filter(metadatas[1], {"source": ["local", "web"], "chunk_id": 1})
+    assert match_filter(metadatas[3], {"chunk_id": {"gte": 1, "lt": 2}})
+    assert not match_filter(metadatas[0], {"chunk_id": {"gte": 1}})
+    assert not match_filter(metadatas[1], {"chunk_id": True})
+    assert not match_filter(None, {"source": "local"})
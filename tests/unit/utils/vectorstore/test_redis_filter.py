@@ -0,0 +1,56 @@
+import logging
+import pytest
+
+from app.utils.vectorstore.redis_filter import compile_filter, match_text_conditions
+
+logger = logging.getLogger(__name__)
+
+schema = {
+    "content": "TEXT",
+    "content_vector": "VECTOR",
+    "session_id": "TAG",
+    "sequence_num": "NUMERIC",
+    "source": "TEXT"
+}
+
+def test_compile_filter():
+    """This function tests compiling filters into RediSearch queries."""
+
+    assert compile_filter({}, schema) == "*"
+    assert compile_filter({"session_id": "1"}, schema) == "@session_id:{1}"
+    assert compile_filter({"session_id": ["a-b", "c d"]}, schema) == "@session_id:{a\\-b | c\\ d}"
+    assert compile_filter({"sequence_num": 3}, schema) == "@sequence_num:[3.0 3.0]"
+    assert compile_filter({"sequence_num": [1, 2]}, schema) == "(@sequence_num:[1.0 1.0] | @sequence_num:[2.0 2.0])"
+    assert compile_filter({"sequence_num": {"gt": 1, "lte": 4}}, schema) == "@sequence_num:[(1.0 4.0]"
+    assert compile_filter({"source": 'a "b"'}, schema) == '@source:"a \\"b\\""'
+    assert compile_filter({"session_id": "1", "sequence_num": {"not": 0}}, schema) == "@session_id:{1} -@sequence_num:[0.0 0.0]"
+
+    # The values cannot change the query
+    assert compile_filter({"session_id": "1} | @source:{x"}, schema) == "@session_id:{1\\}\\ \\|\\ \\@source\\:\\{x}"
+
+def test_compile_invalid_filter():
+    """This function tests rejecting filters that cannot be compiled."""
+
+    with pytest.raises(ValueError):
+        compile_filter({"unknown": "1"}, schema)
+    with pytest.raises(ValueError):
+        compile_filter({"content_vector": "1"}, schema)
+    with pytest.raises(ValueError):
+        compile_filter({"session_id": {"gt": 1}}, schema)
+    with pytest.raises(ValueError):
+        compile_filter({"sequence_num": "one"}, schema)
+    with pytest.raises(ValueError):
+        compile_filter({"sequence_num": {"between": [1, 2]}}, schema)
+    with pytest.raises(ValueError):
+        compile_filter({"session_id": []}, schema)
+
+def test_match_text_conditions():
+    """This function tests checking the TEXT conditions of a filter on a document."""
+
+    assert match_text_conditions({"source": "a"}, {"source": "a"}, schema) == True
+    assert match_text_conditions({"source": "a b"}, {"source": "a"}, schema) == False
+    assert match_text_conditions({"source": "b"}, {"source": ["a", "b"]}, schema) == True
+    assert match_text_conditions({"source": "b"}, {"source": {"not": "a"}}, schema) == True
+
+    # The other fields match exactly in the index
+    assert match_text_conditions({"session_id": "2"}, {"session_id": "1"}, schema) == True
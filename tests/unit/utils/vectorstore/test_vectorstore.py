@@ -2,15 +2,21 @@ import os
 import logging
 import pytest
 import shutil
+import time
+import threading
+import faiss
+import numpy as np
 
 from langchain.docstore.document import Document
 from langchain.document_loaders import TextLoader
 from langchain.text_splitter import TokenTextSplitter
+from langchain.vectorstores import FAISS
 
 from app.utils.llm import LLMHelper
 from app.utils.vectorstore import get_vector_store
-from app.utils.vectorstore.faiss import FAISSExtended
+from app.utils.vectorstore.faiss import FAISSExtended, evaluate_vector_encodings, get_inner_index, get_index_lock, DEFAULT_INDEX_NAME, EXPIRES_AT_KEY
 from app.utils.vectorstore.redis import RedisExtended
+from app.utils.vectorstore.docstore import MmapDocstore
 from app.config import Config
 
 logger = logging.getLogger(__name__)
@@ -92,6 +98,61 @@ def test_load_local(vector_store):
 
             shutil.rmtree(config.FAISS_LOCAL_FILE_INDEX)
 
+def test_load_local_resident(vector_store):
+    """This function tests the FAISS index stays resident until the files change."""
+
+    config = Config()
+
+    for key, vector_store in vector_store.items():
+        if key == 'faiss':
+            vector_store.add_texts(["This is a test document only."], [{"source": "local"}])
+            vector_store.save_local(config.FAISS_LOCAL_FILE_INDEX)
+            resident_store = vector_store.vector_stores[DEFAULT_INDEX_NAME]
+
+            # Loading an unchanged index should not read it again
+            vector_store.load_local(config.FAISS_LOCAL_FILE_INDEX)
+            assert vector_store.vector_stores[DEFAULT_INDEX_NAME] is resident_store
+
+            # Saving from another process changes the generation and forces a reload
+            with open(os.path.join(config.FAISS_LOCAL_FILE_INDEX, f"{DEFAULT_INDEX_NAME}.generation"), 'w') as f:
+                f.write('another generation')
+
+            vector_store.load_local(config.FAISS_LOCAL_FILE_INDEX)
+            assert vector_store.vector_stores[DEFAULT_INDEX_NAME] is not resident_store
+            assert vector_store.vector_stores[DEFAULT_INDEX_NAME].index.ntotal == 1
+
+            shutil.rmtree(config.FAISS_LOCAL_FILE_INDEX)
+
+def test_load_local_read_only(vector_store):
+    """This function tests loading the FAISS index memory-mapped and read-only."""
+
+    config = Config()
+
+    # Save old config
+    old_mmap_index = Config.FAISS_MMAP_INDEX
+    Config.FAISS_MMAP_INDEX = True
+
+    for key, vector_store in vector_store.items():
+        if key == 'faiss':
+            vector_store.add_texts(["This is a test document from local."], [{"source": "local"}])
+            vector_store.save_local(config.FAISS_LOCAL_FILE_INDEX)
+
+            vector_store.load_local(config.FAISS_LOCAL_FILE_INDEX, read_only=True)
+            assert isinstance(vector_store.vector_stores[DEFAULT_INDEX_NAME].docstore, MmapDocstore)
+
+            result = vector_store.similarity_search("This is a test document from local.", k=1)
+            assert result[0][0].metadata["source"] == "local"
+
+            # Texts can only be added after loading the index writable
+            vector_store.load_local(config.FAISS_LOCAL_FILE_INDEX)
+            vector_store.add_texts(["This is a test document from web."], [{"source": "web"}])
+            assert vector_store.vector_stores[DEFAULT_INDEX_NAME].index.ntotal == 2
+
+            shutil.rmtree(config.FAISS_LOCAL_FILE_INDEX)
+
+    # Restore old config
+    Config.FAISS_MMAP_INDEX = old_mmap_index
+
 
 def test_add_documents(vector_store):
     """This function tests add documents function for vector store."""
@@ -148,6 +209,57 @@ def test_similarity_search(vector_store):
 
             vector_store.drop_index('test_similarity_search_in_unit_test')
 
+def test_train_index(vector_store):
+    """This function tests the FAISS index is trained once it reaches the threshold."""
+
+    # Save old config
+    old_index_type = Config.FAISS_INDEX_TYPE
+    old_train_threshold = Config.FAISS_TRAIN_THRESHOLD
+
+    Config.FAISS_INDEX_TYPE = 'ivf'
+    Config.FAISS_TRAIN_THRESHOLD = 3
+
+    texts = ["This is a test document from local.", "This is a test document from web.", "This is a test document from blob."]
+    metadatas = [{"source": "local"}, {"source": "web"}, {"source": "blob"}]
+
+    for key, vector_store in vector_store.items():
+        if key == 'faiss':
+            vector_store.add_texts(texts[:2], metadatas[:2])
+            assert isinstance(get_inner_index(vector_store.vector_stores[DEFAULT_INDEX_NAME].index), faiss.IndexFlat)
+
+            vector_store.add_texts(texts[2:], metadatas[2:])
+            assert isinstance(get_inner_index(vector_store.vector_stores[DEFAULT_INDEX_NAME].index), faiss.IndexIVFFlat)
+
+            result = vector_store.similarity_search("This is a test document from web.", k=1)
+            assert result[0][0].metadata["source"] == "web"
+
+    # Restore old config
+    Config.FAISS_INDEX_TYPE = old_index_type
+    Config.FAISS_TRAIN_THRESHOLD = old_train_threshold
+
+def test_evaluate_vector_encodings():
+    """This function tests the memory and recall report of the FAISS vector encodings."""
+
+    config = Config()
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((2000, 64)).astype(np.float32)
+    queries = vectors[:20]
+
+    old_pq_m = Config.FAISS_PQ_M
+    Config.FAISS_PQ_M = 8
+
+    report = evaluate_vector_encodings(config, vectors, queries, k=5)
+    report = {row['encoding']: row for row in report}
+
+    Config.FAISS_PQ_M = old_pq_m
+
+    assert report['float32']['recall'] == 1.0
+    assert report['fp16']['memory_ratio'] < 0.6
+    assert report['sq8']['memory_ratio'] < 0.3
+    assert report['pq']['memory_ratio'] < report['sq8']['memory_ratio']
+    assert report['pq']['recall_reranked'] >= report['pq']['recall']
+
 def test_get_retiever(vector_store):
     """This function tests get retiever function for vector store."""
 
@@ -178,18 +290,424 @@ def test_check_existing_index(vector_store):
     """This function tests check existing index function for vector store."""
 
     for key, vector_store in vector_store.items():
-        if key == 'redis':
-            assert vector_store.check_existing_index('test_index_in_unit_test') == False
+        assert vector_store.check_existing_index('test_index_in_unit_test') == False
 
 def test_create_and_drop_index(vector_store):
     """This function tests drop index function for vector store."""
 
     for key, vector_store in vector_store.items():
-        if key == 'redis':
-            vector_store.create_index('test_index_in_unit_test')
+        vector_store.create_index('test_index_in_unit_test')
+
+        assert vector_store.check_existing_index('test_index_in_unit_test') == True
+
+        vector_store.drop_index('test_index_in_unit_test')
+
+        assert vector_store.check_existing_index('test_index_in_unit_test') == False
 
-            assert vector_store.check_existing_index('test_index_in_unit_test') == True
+def test_filtered_search(vector_store):
+    """This function tests that filters are applied before searching FAISS indexes."""
+
+    # Save old config
+    old_exact_filter_limit = Config.FAISS_EXACT_FILTER_LIMIT
+
+    texts = [f"This is test message {i} of session {i % 10}." for i in range(100)]
+    metadatas = [{"session_id": str(i % 10), "sequence_num": i} for i in range(100)]
+
+    # Small subsets are scored exactly, large ones search the index with a selector
+    for exact_filter_limit in [100, 0]:
+        Config.FAISS_EXACT_FILTER_LIMIT = exact_filter_limit
+        config = Config()
+
+        for key, default_store in vector_store.items():
+            if key == 'faiss':
+                filtered_store = FAISSExtended(config, default_store.embeddings)
+                filtered_store.add_texts(texts, metadatas, index_name='test_index_in_unit_test')
+
+                result = filtered_store.similarity_search(
+                    "This is test message 1 of session 1.", 
+                    k=20, 
+                    filter={"session_id": "1"}, 
+                    index_name='test_index_in_unit_test'
+                )
+                assert len(result) == 10
+                assert result[0][0].metadata["sequence_num"] == 1
+                assert all(doc.metadata["session_id"] == "1" for doc, _ in result)
+
+                result = filtered_store.similarity_search(
+                    "This is a test message.", 
+                    k=20, 
+                    filter={"session_id": ["1", "2"], "sequence_num": {"gte": 20, "lt": 40}}, 
+                    index_name='test_index_in_unit_test'
+                )
+                assert sorted(doc.metadata["sequence_num"] for doc, _ in result) == [21, 22, 31, 32]
+
+                filtered_store.drop_index('test_index_in_unit_test')
+
+    # Restore old config
+    Config.FAISS_EXACT_FILTER_LIMIT = old_exact_filter_limit
+
+def test_cosine_index(vector_store):
+    """This function tests FAISS indexes created with the COSINE distance metric."""
+
+    config = Config()
+
+    for key, vector_store in vector_store.items():
+        if key == 'faiss':
+            vector_store.create_index('test_index_in_unit_test', distance_metric='COSINE')
+            vector_store.add_texts(
+                ["This is a test document from local.", "This is a test document from web."], 
+                [{"source": "local"}, {"source": "web"}], 
+                index_name='test_index_in_unit_test'
+            )
+            vector_store.save_local(config.FAISS_LOCAL_FILE_INDEX, index_name='test_index_in_unit_test')
+
+            # The scores are the cosine similarities, also after loading the index again
+            another_store = FAISSExtended(config, vector_store.embeddings)
+            result = another_store.similarity_search("This is a test document from web.", k=2, index_name='test_index_in_unit_test')
+            assert result[0][0].metadata["source"] == "web"
+            assert abs(result[0][1] - 1) < 1e-4
+            assert result[1][1] < result[0][1]
 
             vector_store.drop_index('test_index_in_unit_test')
 
-            assert vector_store.check_existing_index('test_index_in_unit_test') == False
\ No newline at end of file
+            with pytest.raises(ValueError):
+                vector_store.create_index('test_index_in_unit_test', distance_metric='MANHATTAN')
+
+def test_write_ahead_log(vector_store):
+    """This function tests that texts added to a saved FAISS index go to the write-ahead log."""
+
+    config = Config()
+
+    # Save old config
+    old_mmap_index = Config.FAISS_MMAP_INDEX
+    Config.FAISS_MMAP_INDEX = True
+
+    for key, vector_store in vector_store.items():
+        if key == 'faiss':
+            vector_store.load_local(config.FAISS_LOCAL_FILE_INDEX)
+            index_file = os.path.join(config.FAISS_LOCAL_FILE_INDEX, f"{DEFAULT_INDEX_NAME}.faiss")
+            snapshot_time = os.path.getmtime(index_file)
+
+            vector_store.add_texts(["This is a test document from local."], [{"source": "local"}])
+            vector_store.save_local(config.FAISS_LOCAL_FILE_INDEX)
+
+            # Only the log is written
+            assert os.path.getmtime(index_file) == snapshot_time
+            assert os.path.exists(os.path.join(config.FAISS_LOCAL_FILE_INDEX, f"{DEFAULT_INDEX_NAME}.wal"))
+
+            # The log is read by other instances, also read-only
+            another_store = FAISSExtended(config, vector_store.embeddings)
+            another_store.load_local(config.FAISS_LOCAL_FILE_INDEX, read_only=True)
+            result = another_store.similarity_search("This is a test document from local.", k=1)
+            assert result[0][0].metadata["source"] == "local"
+
+            # A snapshot replaces the log
+            vector_store.save_local(config.FAISS_LOCAL_FILE_INDEX, snapshot=True)
+            assert not os.path.exists(os.path.join(config.FAISS_LOCAL_FILE_INDEX, f"{DEFAULT_INDEX_NAME}.wal"))
+
+            another_store.load_local(config.FAISS_LOCAL_FILE_INDEX)
+            assert another_store.vector_stores[DEFAULT_INDEX_NAME].index.ntotal == 1
+
+            shutil.rmtree(config.FAISS_LOCAL_FILE_INDEX)
+
+    # Restore old config
+    Config.FAISS_MMAP_INDEX = old_mmap_index
+
+def test_multiple_indexes(vector_store):
+    """This function tests that FAISS indexes are separated by index name."""
+
+    config = Config()
+
+    for key, vector_store in vector_store.items():
+        if key == 'faiss':
+            vector_store.create_index('test_index_a_in_unit_test')
+            vector_store.add_texts(["This is a test document from index a."], [{"source": "a"}], index_name='test_index_a_in_unit_test')
+            vector_store.add_texts(["This is a test document from index b."], [{"source": "b"}], index_name='test_index_b_in_unit_test')
+
+            result = vector_store.similarity_search("This is a test document.", k=4, index_name='test_index_a_in_unit_test')
+            assert [doc.metadata["source"] for doc, _ in result] == ["a"]
+
+            # Indexes saved by one instance are loaded lazily by another one
+            vector_store.save_local(config.FAISS_LOCAL_FILE_INDEX, index_name='test_index_b_in_unit_test')
+            another_store = FAISSExtended(config, vector_store.embeddings)
+
+            assert another_store.check_existing_index('test_index_b_in_unit_test') == True
+            result = another_store.similarity_search("This is a test document.", k=4, index_name='test_index_b_in_unit_test')
+            assert [doc.metadata["source"] for doc, _ in result] == ["b"]
+
+            vector_store.drop_index('test_index_a_in_unit_test')
+            vector_store.drop_index('test_index_b_in_unit_test')
+
+            assert os.listdir(config.FAISS_LOCAL_FILE_INDEX) == []
+
+def test_delete_documents(vector_store):
+    """This function tests deleting FAISS documents by id and by filter."""
+
+    config = Config()
+
+    texts = ["This is a test document from local.", "This is a test document from web.", "This is a test document from blob."]
+    metadatas = [{"source": "local"}, {"source": "web"}, {"source": "blob"}]
+
+    # Save old config
+    old_tombstone_ratio = Config.FAISS_TOMBSTONE_RATIO
+    Config.FAISS_TOMBSTONE_RATIO = 1
+
+    for key, vector_store in vector_store.items():
+        if key == 'faiss':
+            vector_store.load_local(config.FAISS_LOCAL_FILE_INDEX)
+            vector_store.add_texts(texts, metadatas)
+            ids = vector_store.vector_stores[DEFAULT_INDEX_NAME].labels.tolist()
+
+            assert vector_store.delete_documents(filter={"source": "web"}) == [str(ids[1])]
+            assert vector_store.delete_documents(ids=[str(ids[0]), str(ids[1])]) == [str(ids[0])]
+
+            result = vector_store.similarity_search("This is a test document from web.", k=4)
+            assert [doc.metadata["source"] for doc, _ in result] == ["blob"]
+            assert vector_store.similarity_search("This is a test document.", filter={"source": "web"}) == []
+
+            # The deletions go to the write-ahead log and are seen by other instances
+            vector_store.save_local(config.FAISS_LOCAL_FILE_INDEX)
+            another_store = FAISSExtended(config, vector_store.embeddings)
+            another_store.load_local(config.FAISS_LOCAL_FILE_INDEX, read_only=True)
+
+            result = another_store.similarity_search("This is a test document from web.", k=4)
+            assert [doc.metadata["source"] for doc, _ in result] == ["blob"]
+
+            shutil.rmtree(config.FAISS_LOCAL_FILE_INDEX)
+
+    # Restore old config
+    Config.FAISS_TOMBSTONE_RATIO = old_tombstone_ratio
+
+def test_compact_index(vector_store):
+    """This function tests that FAISS indexes are compacted once too many of their vectors are deleted."""
+
+    config = Config()
+
+    texts = ["This is a test document from local.", "This is a test document from web.", "This is a test document from blob."]
+    metadatas = [{"source": "local"}, {"source": "web"}, {"source": "blob"}]
+
+    # Save old config
+    old_tombstone_ratio = Config.FAISS_TOMBSTONE_RATIO
+    Config.FAISS_TOMBSTONE_RATIO = 0.5
+
+    for key, vector_store in vector_store.items():
+        if key == 'faiss':
+            vector_store.load_local(config.FAISS_LOCAL_FILE_INDEX)
+            vector_store.add_texts(texts, metadatas)
+            ids = vector_store.vector_stores[DEFAULT_INDEX_NAME].labels.tolist()
+
+            vector_store.delete_documents(ids=[str(ids[0])])
+            vector_store.save_local(config.FAISS_LOCAL_FILE_INDEX)
+            assert vector_store.vector_stores[DEFAULT_INDEX_NAME].index.ntotal == 3
+
+            vector_store.delete_documents(ids=[str(ids[1])])
+            vector_store.save_local(config.FAISS_LOCAL_FILE_INDEX)
+
+            # The compaction runs in the background
+            for thread in threading.enumerate():
+                if thread.name.startswith('faiss-compaction'):
+                    thread.join()
+
+            index = vector_store.vector_stores[DEFAULT_INDEX_NAME]
+            assert index.index.ntotal == 1
+            assert len(index.tombstones) == 0
+
+            # The remaining document keeps its id
+            assert index.labels.tolist() == [ids[2]]
+            assert vector_store.delete_documents(ids=[str(ids[2])]) == [str(ids[2])]
+
+            another_store = FAISSExtended(config, vector_store.embeddings)
+            another_store.load_local(config.FAISS_LOCAL_FILE_INDEX)
+            assert another_store.vector_stores[DEFAULT_INDEX_NAME].labels.tolist() == [ids[2]]
+
+            shutil.rmtree(config.FAISS_LOCAL_FILE_INDEX)
+
+    # Restore old config
+    Config.FAISS_TOMBSTONE_RATIO = old_tombstone_ratio
+
+def test_query_by_filter(vector_store):
+    """This function tests listing FAISS documents by filter without embedding."""
+
+    texts = [f"Message {i} of session {i % 2}." for i in range(6)]
+    metadatas = [{"session_id": str(i % 2), "sequence_num": i} for i in range(6)]
+
+    for key, vector_store in vector_store.items():
+        if key == 'faiss':
+            vector_store.add_texts(texts, metadatas)
+            vector_store.delete_documents(filter={"sequence_num": 5})
+
+            # Sorted in memory and by walking the metadata index
+            for exact_filter_limit in [100, 0]:
+                vector_store.vector_stores[DEFAULT_INDEX_NAME].exact_filter_limit = exact_filter_limit
+
+                result = vector_store.query_by_filter(filter={"session_id": "1"}, sort_by="sequence_num", limit=2, descending=True)
+                assert [doc.metadata["sequence_num"] for doc in result] == [3, 1]
+
+                result = vector_store.query_by_filter(sort_by="sequence_num")
+                assert [doc.metadata["sequence_num"] for doc in result] == [0, 1, 2, 3, 4]
+
+            assert vector_store.query_by_filter(filter={"session_id": "2"}) == []
+
+def test_similarity_search_score_threshold(vector_store):
+    """This function tests leaving out the docs below a relevance score threshold."""
+
+    texts = ["This is a test document.", "Something else entirely."]
+
+    for key, vector_store in vector_store.items():
+        if key == 'faiss':
+            vector_store.add_texts(texts)
+
+            result = vector_store.similarity_search("This is a test document.", k=2, score_threshold=0.99)
+            assert [doc.page_content for doc, _ in result] == ["This is a test document."]
+
+            result = vector_store.similarity_search("This is a test document.", k=2)
+            assert len(result) == 2
+
+def test_concurrent_search(vector_store):
+    """This function tests FAISS searches running while texts are added to the same resident index."""
+
+    errors = []
+
+    def search(vector_store):
+        try:
+            for _ in range(20):
+                for doc, _ in vector_store.similarity_search("Document", k=4):
+                    assert doc.page_content.startswith("Document")
+        except Exception as e:
+            errors.append(e)
+
+    for key, vector_store in vector_store.items():
+        if key == 'faiss':
+            vector_store.add_texts(["Document 0."])
+
+            threads = [threading.Thread(target=search, args=(vector_store,)) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+
+            for i in range(1, 21):
+                vector_store.add_texts([f"Document {i}."])
+
+            for thread in threads:
+                thread.join()
+
+            assert errors == []
+            assert vector_store.vector_stores[DEFAULT_INDEX_NAME].index.ntotal == 21
+
+def test_legacy_index(vector_store):
+    """This function tests the default index saved by older versions is converted once, and other index names stay absent."""
+
+    config = Config()
+
+    for key, vector_store in vector_store.items():
+        if key == 'faiss':
+            # Older versions saved every document in the default index, with a pickled docstore
+            FAISS.from_texts(["This is a legacy document."], vector_store.embeddings) \
+                .save_local(config.FAISS_LOCAL_FILE_INDEX, DEFAULT_INDEX_NAME)
+
+            # Searching another index name finds nothing and writes nothing
+            assert not vector_store.check_existing_index("docs")
+            vector_store.load_local(config.FAISS_LOCAL_FILE_INDEX, read_only=True, index_name="docs")
+            assert vector_store.similarity_search("This is a legacy document.", k=1, index_name="docs") == []
+            assert not os.path.exists(os.path.join(config.FAISS_LOCAL_FILE_INDEX, "docs.faiss"))
+
+            # Searching the default index reads the older files as they are
+            another_store = FAISSExtended(config, vector_store.embeddings)
+            another_store.load_local(config.FAISS_LOCAL_FILE_INDEX, read_only=True)
+            result = another_store.similarity_search("This is a legacy document.", k=1)
+            assert result[0][0].page_content == "This is a legacy document."
+            assert os.path.exists(os.path.join(config.FAISS_LOCAL_FILE_INDEX, f"{DEFAULT_INDEX_NAME}.pkl"))
+
+            # Loading it writable converts it
+            vector_store.load_local(config.FAISS_LOCAL_FILE_INDEX)
+            assert not os.path.exists(os.path.join(config.FAISS_LOCAL_FILE_INDEX, f"{DEFAULT_INDEX_NAME}.pkl"))
+            assert vector_store.vector_stores[DEFAULT_INDEX_NAME].index.ntotal == 1
+
+            another_store = FAISSExtended(config, vector_store.embeddings)
+            another_store.load_local(config.FAISS_LOCAL_FILE_INDEX)
+            assert another_store.vector_stores[DEFAULT_INDEX_NAME].index.ntotal == 1
+            assert not another_store.check_existing_index("docs")
+
+def test_rebuild_resident_index(vector_store):
+    """This function tests every FAISSExtended moves to a rebuilt resident index, which keeps the unsaved changes."""
+
+    config = Config()
+
+    for key, vector_store in vector_store.items():
+        if key == 'faiss':
+            vector_store.load_local(config.FAISS_LOCAL_FILE_INDEX)
+            another_store = FAISSExtended(config, vector_store.embeddings)
+            another_store.load_local(config.FAISS_LOCAL_FILE_INDEX)
+
+            vector_store.add_texts(["This is a test document from local.", "This is a test document from web."])
+            ids = vector_store.vector_stores[DEFAULT_INDEX_NAME].labels.tolist()
+            vector_store.delete_documents(ids=[str(ids[0])])
+            assert len(vector_store.vector_stores[DEFAULT_INDEX_NAME].unsaved) == 2
+
+            vector_store.rebuild_index(retrain=False)
+            rebuilt_store = vector_store.vector_stores[DEFAULT_INDEX_NAME]
+            assert len(rebuilt_store.unsaved) == 2
+
+            assert another_store._get_vector_store() is rebuilt_store
+            assert another_store.get_index_stats()['num_docs'] == 1
+
+            shutil.rmtree(config.FAISS_LOCAL_FILE_INDEX)
+
+def test_load_local_while_index_changes(vector_store):
+    """This function tests FAISS indexes are loaded without waiting for another index, or for a resident index, being changed."""
+
+    config = Config()
+
+    for key, vector_store in vector_store.items():
+        if key == 'faiss':
+            vector_store.add_texts(["This is a test document only."])
+            vector_store.save_local(config.FAISS_LOCAL_FILE_INDEX)
+            vector_store.add_texts(["This is another test document."], index_name="docs")
+            vector_store.save_local(config.FAISS_LOCAL_FILE_INDEX, index_name="docs")
+
+            # A thread compacting the default index holds its lock
+            locked, release = threading.Event(), threading.Event()
+
+            def compact():
+                with get_index_lock(config.FAISS_LOCAL_FILE_INDEX, DEFAULT_INDEX_NAME):
+                    locked.set()
+                    release.wait()
+
+            thread = threading.Thread(target=compact)
+            thread.start()
+            locked.wait()
+
+            another_store = FAISSExtended(config, vector_store.embeddings)
+
+            def load():
+                another_store.load_local(config.FAISS_LOCAL_FILE_INDEX, index_name="docs")
+                another_store.load_local(config.FAISS_LOCAL_FILE_INDEX)
+
+            loader = threading.Thread(target=load)
+            loader.start()
+            loader.join(timeout=10)
+            assert not loader.is_alive()
+            assert another_store.vector_stores[DEFAULT_INDEX_NAME] is vector_store.vector_stores[DEFAULT_INDEX_NAME]
+            assert another_store.vector_stores["docs"].index.ntotal == 1
+
+            release.set()
+            thread.join()
+
+            shutil.rmtree(config.FAISS_LOCAL_FILE_INDEX)
+
+def test_add_texts_ttl(vector_store):
+    """This function tests FAISS texts added with a TTL record when they expire, so they can be deleted by filter."""
+
+    for key, vector_store in vector_store.items():
+        if key == 'faiss':
+            vector_store.add_texts(["This text expires."], [{"source": "local"}], index_name="history", ttl=-1)
+            vector_store.add_texts(["This text is kept."], [{"source": "local"}], index_name="history")
+            vector_store.add_texts(["This text expires later."], index_name="history", ttl=3600)
+
+            documents = vector_store.query_by_filter(index_name="history")
+            assert documents[0].metadata[EXPIRES_AT_KEY] < time.time() < documents[2].metadata[EXPIRES_AT_KEY]
+            assert EXPIRES_AT_KEY not in documents[1].metadata
+
+            deleted = vector_store.delete_documents(filter={EXPIRES_AT_KEY: {"lt": time.time()}}, index_name="history")
+            assert len(deleted) == 1
+            assert [doc.page_content for doc in vector_store.query_by_filter(index_name="history")] == \
+                ["This text is kept.", "This text expires later."]
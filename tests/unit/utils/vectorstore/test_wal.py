@@ -0,0 +1,76 @@
+import os
+import logging
+import shutil
+
+import numpy as np
+
+from app.utils.vectorstore.wal import WriteAheadLog
+
+logger = logging.getLogger(__name__)
+
+WAL_TEST_FOLDER = 'tests/unit/utils/vectorstore/test_wal'
+
+def test_append_and_read():
+    """This function tests appending records to the write-ahead log and reading them back."""
+
+    os.makedirs(WAL_TEST_FOLDER, exist_ok=True)
+    wal = WriteAheadLog(WAL_TEST_FOLDER, 'index')
+
+    assert wal.exists() == False
+    assert list(wal.read()) == []
+
+    wal.append(["This is a test document from local."], [{"source": "local"}], np.ones((1, 4)))
+    first_size = wal.size()
+    wal.append(["This is a test document from web.", "你好"], [{"source": "web"}, {}], np.zeros((2, 4)))
+
+    records = list(wal.read())
+
+    assert [record['texts'] for record in records] == [["This is a test document from local."], ["This is a test document from web.", "你好"]]
+    assert records[1]['metadatas'] == [{"source": "web"}, {}]
+    assert records[1]['vectors'].shape == (2, 4)
+    assert wal.valid_size == wal.size()
+
+    # Records can be read from the end of the ones already read
+    assert [record['texts'] for record in wal.read(offset=first_size)] == [["This is a test document from web.", "你好"]]
+    assert list(wal.read(offset=wal.size())) == []
+
+    wal.remove()
+    assert wal.exists() == False
+
+    shutil.rmtree(WAL_TEST_FOLDER)
+
+def test_read_incomplete_record():
+    """This function tests that a record cut short ends the write-ahead log."""
+
+    os.makedirs(WAL_TEST_FOLDER, exist_ok=True)
+    wal = WriteAheadLog(WAL_TEST_FOLDER, 'index')
+
+    wal.append(["This is a test document from local."], [{"source": "local"}], np.ones((1, 4)))
+    size = wal.size()
+    wal.append(["This is a test document from web."], [{"source": "web"}], np.ones((1, 4)))
+
+    with open(wal.file_path, 'r+b') as f:
+        f.truncate(wal.size() - 1)
+
+    records = list(wal.read())
+
+    assert len(records) == 1
+    assert wal.valid_size == size
+
+    shutil.rmtree(WAL_TEST_FOLDER)
+
+def test_delete_record():
+    """This function tests that the write-ahead log keeps the ids of the texts added and deleted."""
+
+    os.makedirs(WAL_TEST_FOLDER, exist_ok=True)
+    wal = WriteAheadLog(WAL_TEST_FOLDER, 'index')
+
+    wal.append(["This is a test document from local."], [{"source": "local"}], np.ones((1, 4)), ids=[7])
+    wal.append([], [], np.empty((0, 4)), op='delete', ids=[7])
+
+    records = list(wal.read())
+
+    assert [(record['op'], record['ids']) for record in records] == [('add', [7]), ('delete', [7])]
+    assert records[1]['vectors'].shape == (0, 4)
+
+    shutil.rmtree(WAL_TEST_FOLDER)